@@ -35,6 +35,7 @@ function Chat({ bearerToken, onMissingBearerToken, onToggleSettings }) {
   const [websocket, setWebsocket] = useState(null);
   const [isWebsocketReady, setIsWebsocketReady] = useState(false);
   const [errorMessage, setErrorMessage] = useState("");
+  const [statusMessage, setStatusMessage] = useState("");
 
   const chatContainerRef = useRef(null);
 
@@ -136,14 +137,19 @@ function Chat({ bearerToken, onMissingBearerToken, onToggleSettings }) {
       console.log(`message: ${JSON.stringify(json)}`);
       if (json.type === "error") {
         console.log("ERROR: " + event.data);
-        let errorMessage = json.mesage || "Unknown Error";
+        let errorMessage = json.message || "Unknown Error";
         if (json.message === "401") {
           errorMessage = "Error: Invalid Passcode";
           onMissingBearerToken();
         }
         setErrorMessage(errorMessage);
+        setStatusMessage("");
         setIsResponding(false);
+      } else if (json.type === "queue") {
+        // The server is at its limit for this model, json.message is our position in its queue
+        setStatusMessage(`Waiting for the model, position ${json.message} in the queue`);
       } else if (json.type === "end") {
+        setStatusMessage("");
         setMessages((previousMessages) => {
           const lastMessage = previousMessages[previousMessages.length - 1];
           addMessage(
@@ -164,6 +170,7 @@ function Chat({ bearerToken, onMissingBearerToken, onToggleSettings }) {
             return prevMessages.concat([{ queryText: json.message, responseText: "", sources: [] }]);
           });
         } else {
+          setStatusMessage("");
           setMessages((prevMessages) => {
             return updateMessages(prevMessages, json.message);
           });
@@ -213,6 +220,19 @@ function Chat({ bearerToken, onMissingBearerToken, onToggleSettings }) {
     }
   };
 
+  const handlePartialQuery = (queryText) => {
+    // Lets the server prefetch retrieval candidates while the user is still typing
+    if (!websocket || websocket.readyState !== websocket.OPEN || !isWebsocketReady) {
+      return;
+    }
+    websocket.send(JSON.stringify({
+      type: "partial_query",
+      query: queryText,
+      settings: {...settings, embedding: selectedConversation.embedModel},
+      session_id: selectedConversation.sessionId || selectedConversation.id
+    }));
+  };
+
   const onSelectConversation = (conversation) => {
     if (conversation == null) {
       navigate('/chat');
@@ -278,8 +298,10 @@ function Chat({ bearerToken, onMissingBearerToken, onToggleSettings }) {
             </div>
             <MessageInput
               onMessageSubmit={handleWebsocketMessageSubmit}
+              onPartialMessage={handlePartialQuery}
               isResponding={isResponding}
               errorMessage={errorMessage}
+              statusMessage={statusMessage}
             />
           </div>
         )}
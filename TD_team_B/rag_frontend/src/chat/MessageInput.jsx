@@ -1,7 +1,23 @@
-import React, {useState} from "react";
+import React, {useState, useEffect, useRef} from "react";
 
-const MessageInput = ({ onMessageSubmit, isResponding, errorMessage }) => {
+// Send at most one partial query per interval while typing, the server debounces them
+const PARTIAL_QUERY_INTERVAL_MS = 300;
+
+const MessageInput = ({ onMessageSubmit, onPartialMessage, isResponding, errorMessage, statusMessage }) => {
   const [message, setMessage] = useState("");
+  const lastPartialSent = useRef(0);
+
+  useEffect(() => {
+    if (!onPartialMessage || isResponding || !message.trim()) {
+      return;
+    }
+    const wait = Math.max(0, lastPartialSent.current + PARTIAL_QUERY_INTERVAL_MS - Date.now());
+    const timer = setTimeout(() => {
+      lastPartialSent.current = Date.now();
+      onPartialMessage(message);
+    }, wait);
+    return () => clearTimeout(timer);
+  }, [message, isResponding]);
 
 
   const sendMessage = async (event) => {
@@ -13,6 +29,7 @@ const MessageInput = ({ onMessageSubmit, isResponding, errorMessage }) => {
   return (
     <div className="px-10 py-5">
       {errorMessage && <div className="text-red-400">{errorMessage}</div>}
+      {statusMessage && <div className="text-gray-400">{statusMessage}</div>}
       <form onSubmit={sendMessage} className="flex space-x-2">
         <input
           type="text"
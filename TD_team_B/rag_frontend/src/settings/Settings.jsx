@@ -125,6 +125,46 @@ const Settings = ({ onClose }) => {
                     />
                 </SettingsModel>
 
+                <SettingsModel
+                    inputValue="llamacpp"
+                    llmChecked={localSettings['llm'] === "llamacpp"}
+                    onLLMChange={handleLLMChange}
+                    title="llama.cpp (GGUF on CPU)"
+                >
+                    <SettingsTextInput
+                        inputName="modelPath"
+                        inputValue={getModelSetting('llamacpp', 'modelPath')}
+                        onChange={(e) => { handleSettingChange('llamacpp', e) }}
+                        title="Model Directory"
+                    />
+                    <SettingsTextInput
+                        inputName="llmModel"
+                        inputValue={getModelSetting('llamacpp', 'llmModel')}
+                        onChange={(e) => { handleSettingChange('llamacpp', e) }}
+                        title="GGUF File"
+                    />
+                </SettingsModel>
+
+                <SettingsModel
+                    inputValue="openai_like"
+                    llmChecked={localSettings['llm'] === "openai_like"}
+                    onLLMChange={handleLLMChange}
+                    title="OpenAI-compatible endpoint"
+                >
+                    <SettingsTextInput
+                        inputName="apiBase"
+                        inputValue={getModelSetting('openai_like', 'apiBase')}
+                        onChange={(e) => { handleSettingChange('openai_like', e) }}
+                        title="API Base"
+                    />
+                    <SettingsTextInput
+                        inputName="llmModel"
+                        inputValue={getModelSetting('openai_like', 'llmModel')}
+                        onChange={(e) => { handleSettingChange('openai_like', e) }}
+                        title="LLM Model"
+                    />
+                </SettingsModel>
+
             </div>
 
             <div className="bg-gray-800 flex justify-end space-x-4 py-4 px-8">
@@ -10,6 +10,14 @@ export default {
       cohere: {
         llmModel: "command",
         embeddingModel: "embed-english-v3.0"
+      },
+      llamacpp: {
+        llmModel: "llama-2-7b-chat.Q4_K_M.gguf",
+        modelPath: "/model-weights"
+      },
+      openai_like: {
+        apiBase: "http://localhost:8080/v1",
+        llmModel: "local-model"
       }
     },
   };
\ No newline at end of file
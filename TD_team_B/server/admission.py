@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Per-provider limits, providers not listed use DEFAULT_LIMITS.
+# Local models get few concurrent calls, a saturated Ollama/llama.cpp slows every request down.
+PROVIDER_LIMITS = {
+    "ollama": {"max_concurrent": 2},
+    "llamacpp": {"max_concurrent": 1},
+    "cohere": {"max_concurrent": 8, "requests_per_s": 5.0},
+    "openai": {"max_concurrent": 16, "requests_per_s": 10.0},
+}
+DEFAULT_LIMITS = {"max_concurrent": 8}
+
+
+class AdmissionRejected(Exception):
+    '''
+    Raised when a provider already has max_queue requests waiting
+    '''
+
+
+def is_rate_limit_error(e):
+    # SDKs expose the HTTP status differently: status_code (cohere, openai), http_status, or an httpx response
+    for status in (getattr(e, "status_code", None), getattr(e, "http_status", None),
+                   getattr(getattr(e, "response", None), "status_code", None)):
+        if status == 429:
+            return True
+    return type(e).__name__ in ("RateLimitError", "TooManyRequestsError")
+
+
+def _retry_after(e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket():
+    '''
+    Lets `rate` calls per second through on average, with bursts of up to `burst` calls
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ProviderLimiter():
+    '''
+    Admission control for the calls to one LLM provider:
+    - At most max_concurrent requests are admitted at a time, the others wait in FIFO order
+    - At most max_queue requests wait, further ones are rejected right away with AdmissionRejected
+    - Waiting requests are told their queue position whenever it changes
+    - Calls made through retry() take a token from the bucket (requests_per_s) and are retried on
+      rate limit (429) errors with jittered exponential backoff
+    '''
+    def __init__(self, name, max_concurrent=8, max_queue=32, requests_per_s=None, burst=None, max_retries=3,
+                 backoff_base_s=0.5, backoff_max_s=8.0, position_interval_s=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.bucket = TokenBucket(requests_per_s, burst or max_concurrent) if requests_per_s else None
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.position_interval_s = position_interval_s
+        self.active = 0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "retries": 0, "wait_s": 0.0}
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _release(self):
+        # Hand the slot over to the first waiter still waiting, or free it
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    async def _wait(self, on_position):
+        if len(self._waiters) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise AdmissionRejected(f"Too many requests waiting for {self.name}")
+        self.stats["queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            position = None
+            while not waiter.done():
+                if on_position is not None and self._waiters.index(waiter) + 1 != position:
+                    position = self._waiters.index(waiter) + 1
+                    await on_position(position)
+                await asyncio.wait([waiter], timeout=self.position_interval_s)
+        except BaseException:
+            # Cancelled (e.g. client gone): leave the queue, or pass on a slot that was just handed over
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+        self.stats["wait_s"] += time.monotonic() - start
+
+    @asynccontextmanager
+    async def admit(self, on_position=None):
+        '''
+        async with limiter.admit(on_position): ... runs the block once a slot is free.
+        on_position is an optional coroutine function called with the 1-based queue position.
+        '''
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+        else:
+            await self._wait(on_position)
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def retry(self, call):
+        '''
+        Await call() and retry it on rate limit errors, every attempt takes a token from the bucket
+        '''
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                return await call()
+            except Exception as e:
+                if attempt == self.max_retries or not is_rate_limit_error(e):
+                    raise
+                # Full jitter, so that clients throttled together do not retry together
+                delay = _retry_after(e) or random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+                self.stats["retries"] += 1
+                print(f"{self.name} rate limited, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+
+class AdmissionController():
+    '''
+    One ProviderLimiter per LLM provider, created on first use with the provider's limits.
+    The limits are per provider, not per process: with num_workers sharded worker processes (shard_router.py)
+    every worker admits its share of them. Concurrent calls are split between the workers, worker_index getting
+    one of the remaining ones, and every worker keeps at least one, so with more workers than max_concurrent the
+    provider can get up to one call per worker. The rate limit is split evenly.
+    '''
+    def __init__(self, limits=None, default_limits=None, num_workers=1, worker_index=0):
+        self.limits = dict(PROVIDER_LIMITS if limits is None else limits)
+        self.default_limits = dict(DEFAULT_LIMITS if default_limits is None else default_limits)
+        self.num_workers = num_workers
+        self.worker_index = worker_index
+        self._limiters = {}
+
+    def limits_for(self, provider):
+        limits = dict(self.limits.get(provider, self.default_limits))
+        if self.num_workers > 1:
+            share, remainder = divmod(limits.get("max_concurrent", 8), self.num_workers)
+            limits["max_concurrent"] = max(share + int(self.worker_index < remainder), 1)
+            if limits.get("requests_per_s"):
+                limits["requests_per_s"] = limits["requests_per_s"] / self.num_workers
+            if limits.get("burst"):
+                # A bucket holding less than one token never lets a call through
+                limits["burst"] = max(limits["burst"] / self.num_workers, 1.0)
+        return limits
+
+    def limiter_for(self, provider):
+        if provider not in self._limiters:
+            self._limiters[provider] = ProviderLimiter(provider, **self.limits_for(provider))
+        return self._limiters[provider]
+
+    def stats(self):
+        return {name: {**limiter.stats, "active": limiter.active, "waiting": limiter.waiting}
+                for name, limiter in self._limiters.items()}
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 class ResponseType(Enum):
     START = "start"
     STREAM = "stream"
+    QUEUE = "queue" # message is the position in the provider's wait queue
     ERROR = "error"
     END = "end"
 
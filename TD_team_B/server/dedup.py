@@ -0,0 +1,129 @@
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, TransformComponent
+
+_WORD_RE = re.compile(r"\w+")
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Metadata key listing the other places a kept chunk was found, e.g. "VOO_Summary.pdf p.3; VOO_Statutory.pdf p.12"
+PROVENANCE_KEY = "duplicate_sources"
+
+
+def _source(node):
+    file_name = node.metadata.get("file_name") or node.ref_doc_id
+    page = node.metadata.get("page_label")
+    return f"{file_name} p.{page}" if page is not None else str(file_name)
+
+
+class MinHasher():
+    '''
+    MinHash signatures of word shingles, their agreement estimates the Jaccard similarity of two texts
+    '''
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        rng = np.random.RandomState(seed)
+        # a < 2^31 and hashes < 2^32, so a * hash + b never overflows uint64
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def shingles(self, text):
+        words = _WORD_RE.findall(text.lower())
+        size = min(self.shingle_size, len(words))
+        return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)} if words else set()
+
+    def signature(self, text):
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH).min(axis=0)
+
+
+class NearDuplicateFilter(TransformComponent):
+    '''
+    Ingestion stage, after the node parser, that stores near-duplicate chunks once:
+    - Every chunk gets a MinHash signature of its word shingles
+    - LSH over bands of the signature finds the earlier chunks it may duplicate, and a chunk whose
+      estimated Jaccard similarity with one of them reaches `threshold` is dropped
+    - The kept chunk lists where its duplicates came from (file and page) under PROVENANCE_KEY
+    `report` has the dedup ratio of the last run and the document pairs sharing the most chunks.
+    '''
+    threshold: float = Field(default=0.8, description="Estimated Jaccard similarity of near-duplicate chunks.")
+    num_perm: int = Field(default=128, description="Number of MinHash permutations.")
+    bands: int = Field(default=16, description="LSH bands, num_perm must be a multiple of it.")
+    shingle_size: int = Field(default=5, description="Words per shingle.")
+    _hasher: Any = PrivateAttr()
+    _report: dict = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.num_perm % self.bands:
+            raise NotImplementedError(f'Incorrect number of LSH bands - {self.bands}')
+        self._hasher = MinHasher(num_perm=self.num_perm, shingle_size=self.shingle_size)
+
+    @classmethod
+    def class_name(cls):
+        return "NearDuplicateFilter"
+
+    @property
+    def report(self):
+        return self._report
+
+    def __call__(self, nodes: List[BaseNode], **kwargs: Any) -> List[BaseNode]:
+        start = time.perf_counter()
+        rows = self.num_perm // self.bands
+        buckets = {}
+        kept, signatures, provenance = [], [], []
+        pairs = Counter()
+        for node in nodes:
+            signature = self._hasher.signature(node.get_content())
+            if signature is None:
+                kept.append(node)
+                signatures.append(None)
+                provenance.append([])
+                continue
+            keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+            candidates = {idx for key in keys for idx in buckets.get(key, ())}
+            match = max(candidates, key=lambda idx: np.mean(signatures[idx] == signature), default=None)
+            if match is not None and np.mean(signatures[match] == signature) >= self.threshold:
+                provenance[match].append(_source(node))
+                documents = sorted({kept[match].metadata.get("file_name"), node.metadata.get("file_name")}, key=str)
+                if len(documents) == 2:
+                    pairs[" <-> ".join(map(str, documents))] += 1
+                continue
+            for key in keys:
+                buckets.setdefault(key, []).append(len(kept))
+            kept.append(node)
+            signatures.append(signature)
+            provenance.append([])
+
+        for node, sources in zip(kept, provenance):
+            if sources:
+                node.metadata[PROVENANCE_KEY] = "; ".join(sources)
+                # Provenance is for the application, it changes neither the embedding nor the LLM context
+                for excluded in (node.excluded_embed_metadata_keys, node.excluded_llm_metadata_keys):
+                    if PROVENANCE_KEY not in excluded:
+                        excluded.append(PROVENANCE_KEY)
+
+        chars_in = sum(len(node.get_content()) for node in nodes)
+        chars_out = sum(len(node.get_content()) for node in kept)
+        self._report = {
+            "chunks_in": len(nodes),
+            "chunks_out": len(kept),
+            "dedup_ratio": 1 - len(kept) / len(nodes) if nodes else 0.0,
+            "chars_in": chars_in,
+            "chars_out": chars_out,
+            "duplicate_pairs": dict(pairs.most_common(10)),
+        }
+        print(f"Near-duplicate filter: {len(nodes)} -> {len(kept)} chunks ({self._report['dedup_ratio']:.1%} removed), "
+              f"{chars_in} -> {chars_out} chars in {(time.perf_counter() - start) * 1000:.0f} ms")
+        for pair, count in pairs.most_common(5):
+            print(f"  {count} chunks shared by {pair}")
+        return kept
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import (
+    CompletionResponse, CompletionResponseAsyncGen, CompletionResponseGen, CustomLLM, LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
+from rag_session import RagSession
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _hash_words(text: str) -> List[str]:
+    # Deterministic pseudo-words derived from the prompt, so identical prompts give identical answers
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return [digest[i:i + 6] for i in range(0, len(digest), 6)]
+
+
+class FakeLLM(CustomLLM):
+    '''
+    Deterministic stand-in for Ollama/Cohere, used to load test the server without a live model.
+    Waits `latency` seconds before the first token and then streams at `token_rate` tokens per second.
+    '''
+    latency: float = Field(default=0.2, description="Seconds before the first token is produced.")
+    token_rate: float = Field(default=50.0, description="Tokens streamed per second after the first token.")
+    num_output: int = Field(default=64, description="Number of tokens in every response.")
+    context_window: int = Field(default=4096, description="Context window reported to llama_index.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.num_output, model_name="fake")
+
+    def _tokens(self, prompt: str) -> List[str]:
+        words = _hash_words(prompt)
+        return [f"{words[i % len(words)]} " for i in range(self.num_output)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + self._token_delay() * (len(tokens) - 1))
+        return CompletionResponse(text="".join(tokens))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            text = ""
+            time.sleep(self.latency)
+            for idx, token in enumerate(self._tokens(prompt)):
+                if idx > 0:
+                    time.sleep(self._token_delay())
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+        return gen()
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.latency + self._token_delay() * (len(tokens) - 1))
+        return CompletionResponse(text="".join(tokens))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        # CustomLLM's default wraps the sync generator, which would block the event loop while sleeping
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            await asyncio.sleep(self.latency)
+            for idx, token in enumerate(self._tokens(prompt)):
+                if idx > 0:
+                    await asyncio.sleep(self._token_delay())
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+        return gen()
+
+
+class FakeEmbedding(BaseEmbedding):
+    '''
+    Deterministic hashed bag-of-words embedding with a configurable per-call latency.
+    Texts sharing words get similar vectors, so retrieval still behaves sensibly.
+    '''
+    latency: float = Field(default=0.01, description="Seconds spent on every embedding call.")
+    embed_dim: int = Field(default=256, description="Dimension of the embedding vectors.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.embed_dim
+        for word in _WORD_RE.findall(text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.embed_dim
+            vector[bucket] += 1.0 if digest[4] % 2 == 0 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # One simulated round trip per batch, like a real embedding API
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._embed(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+def _fake_llm_model(model_name, **kwargs):
+    return FakeLLM(
+        latency=float(kwargs.get("latency", 0.2)),
+        token_rate=float(kwargs.get("token_rate", 50.0)),
+        num_output=int(kwargs.get("num_output", 64)),
+    )
+
+
+def _fake_embedding_model(model_name, **kwargs):
+    return FakeEmbedding(
+        latency=float(kwargs.get("embedding_latency", 0.01)),
+        embed_dim=int(kwargs.get("embedding_dim", 256)),
+    )
+
+
+def register_fake_models(name="fake"):
+    '''
+    Make the fake models selectable through the usual settings, e.g.
+    {"llm": "fake", "embedding": "fake", "models": {"fake": {"latency": 0.2, "tokenRate": 50}}}
+    '''
+    RagSession._llm_model_dict.register(name, _fake_llm_model)
+    RagSession._embedding_model_dict.register(name, _fake_embedding_model)
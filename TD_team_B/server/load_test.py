@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import uvicorn
+import websockets
+
+from fake_models import register_fake_models
+
+SAMPLE_DOCUMENT = (
+    "The Sample Growth Fund seeks long-term capital appreciation. "
+    "The fund invests primarily in common stocks of large U.S. companies. "
+    "The portfolio managers are Jane Doe and John Smith. "
+    "The fund considers ESG factors as part of its investment process. "
+    "The fund may use derivatives such as futures and options for hedging purposes. "
+)
+
+QUESTIONS = [
+    "What is the investment objective of the fund?",
+    "Who manages the fund?",
+    "Does the fund use derivatives?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def fake_settings(args):
+    return {
+        "llm": "fake",
+        "embedding": "fake",
+        "models": {
+            "fake": {
+                "llmModel": "fake",
+                "embeddingModel": "fake",
+                "latency": args.llm_latency,
+                "tokenRate": args.token_rate,
+                "numOutput": args.num_output,
+                "embeddingLatency": args.embedding_latency,
+            }
+        },
+    }
+
+
+def start_server(host, port, workers=1):
+    # Import here so that the server writes its ./chroma_db into the benchmark working directory
+    processes = []
+    if workers > 1:
+        from shard_router import create_router_app, start_workers
+        processes, urls = start_workers(workers, port + 1, host=host, worker_init="fake_models:register_fake_models")
+        app = create_router_app(urls)
+    else:
+        import main as chat_server
+        app = chat_server.app
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, processes
+
+
+async def upload(client, base_url, session_id, settings, files):
+    start = time.perf_counter()
+    response = await client.post(
+        f"{base_url}/upload/",
+        data={"session_id": session_id, "settings": json.dumps(settings)},
+        files=[("files", (path.name, path.read_bytes(), "application/octet-stream")) for path in files],
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start, response.json()
+
+
+async def type_query(websocket, query, settings, session_id, typing_delay):
+    # Send the query word by word as partial queries, like the frontend does while the user types,
+    # the last one is the whole query: the user pauses before pressing enter
+    words = query.split(" ")
+    for idx in range(1, len(words) + 1):
+        await websocket.send(json.dumps({
+            "type": "partial_query", "query": " ".join(words[:idx]), "settings": settings, "session_id": session_id}))
+        await asyncio.sleep(typing_delay)
+
+
+async def chat(ws_url, session_id, settings, fund_name, turns, typing_delay=0.0):
+    results = []
+    async with websockets.connect(ws_url) as websocket:
+        await websocket.send(json.dumps({"fund_name": fund_name, "history": []}))
+        for turn in range(turns):
+            query = QUESTIONS[turn % len(QUESTIONS)]
+            if typing_delay > 0:
+                await type_query(websocket, query, settings, session_id, typing_delay)
+            start = time.perf_counter()
+            first_token = None
+            tokens = 0
+            await websocket.send(json.dumps({"query": query, "settings": settings, "session_id": session_id}))
+            while True:
+                message = json.loads(await websocket.recv())
+                if message["type"] == "error":
+                    raise RuntimeError(f"Chat error for session {session_id}")
+                if message["type"] == "end":
+                    break
+                if message["type"] == "stream" and message["sender"] == "bot":
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    tokens += 1
+            results.append({"latency": time.perf_counter() - start, "ttft": first_token, "tokens": tokens})
+    return results
+
+
+async def run_session(client, base_url, ws_url, settings, files, turns, stats, typing_delay=0.0):
+    session_id = str(uuid.uuid4())
+    try:
+        upload_time, overview = await upload(client, base_url, session_id, settings, files)
+        stats["upload"].append(upload_time)
+        for result in await chat(ws_url, session_id, settings, overview["fund_name"], turns, typing_delay):
+            stats["turn"].append(result["latency"])
+            if result["ttft"] is not None:
+                stats["ttft"].append(result["ttft"])
+            stats["tokens"] += result["tokens"]
+    except Exception as e:
+        print(f"Session {session_id} failed: {e}")
+        stats["errors"] += 1
+
+
+async def run_load_test(args, files):
+    base_url = f"http://{args.host}:{args.port}"
+    ws_url = f"ws://{args.host}:{args.port}/ws_chat"
+    settings = fake_settings(args)
+    stats = {"upload": [], "turn": [], "ttft": [], "tokens": 0, "errors": 0}
+
+    limits = httpx.Limits(max_connections=args.sessions)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            run_session(client, base_url, ws_url, settings, files, args.turns, stats, args.typing_delay)
+            for _ in range(args.sessions)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "config": {
+            "sessions": args.sessions,
+            "turns": args.turns,
+            "llm_latency": args.llm_latency,
+            "token_rate": args.token_rate,
+            "num_output": args.num_output,
+            "embedding_latency": args.embedding_latency,
+            "workers": args.workers,
+            "typing_delay": args.typing_delay,
+        },
+        "elapsed_seconds": elapsed,
+        "errors": stats["errors"],
+        "upload_latency": summarize(stats["upload"]),
+        "turn_latency": summarize(stats["turn"]),
+        "time_to_first_token": summarize(stats["ttft"]),
+        "throughput": {
+            "uploads_per_second": len(stats["upload"]) / elapsed,
+            "turns_per_second": len(stats["turn"]) / elapsed,
+            "tokens_per_second": stats["tokens"] / elapsed,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /upload/ and /ws_chat with fake LLM and embedding models.")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per session")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM seconds before first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Fake LLM tokens per second")
+    parser.add_argument("--num-output", type=int, default=64, help="Fake LLM tokens per response")
+    parser.add_argument("--embedding-latency", type=float, default=0.01, help="Fake embedding seconds per call")
+    parser.add_argument("--files", nargs="*", default=[], help="Documents to upload (defaults to a small sample text)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="Session-sharded worker processes behind a router")
+    parser.add_argument("--typing-delay", type=float, default=0.0,
+                        help="Seconds between the partial queries sent while typing each question, 0 sends none")
+    parser.add_argument("--timeout", type=float, default=300.0, help="HTTP timeout in seconds")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    files = [Path(f).resolve() for f in args.files]
+    output = Path(args.output).resolve() if args.output else None
+    work_dir = tempfile.mkdtemp(prefix="rag_load_test_")
+    if not files:
+        sample_path = Path(work_dir) / "sample_fund.txt"
+        sample_path.write_text(SAMPLE_DOCUMENT * 20)
+        files = [sample_path]
+    os.chdir(work_dir)
+
+    register_fake_models()
+    server, thread, processes = start_server(args.host, args.port, args.workers)
+    try:
+        report = asyncio.run(run_load_test(args, files))
+    finally:
+        server.should_exit = True
+        thread.join()
+        if processes:
+            from shard_router import stop_workers
+            stop_workers(processes)
+
+    report_json = json.dumps(report, indent=2)
+    print(report_json)
+    if output:
+        with open(output, "w") as f:
+            f.write(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,59 @@
+import argparse
+import asyncio
 from contextlib import asynccontextmanager
+import glob
 import json
 import logging
+import os
 from pathlib import Path
 import tempfile
+import threading
 import shutil
 
 import traceback
+from functools import lru_cache
 from typing import List
-from fastapi import FastAPI, File, Form, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import llama_index.core
 from llama_index.core import Settings, StorageContext, SimpleDirectoryReader, VectorStoreIndex
-from llama_index.vector_stores.chroma import ChromaVectorStore
+from llama_index.core.chat_engine import ContextChatEngine
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.llms import ChatMessage, MessageRole
 import uvicorn
-import chromadb
+from admission import AdmissionController, AdmissionRejected
 from chat_response import ChatResponse, ResponseType, Sender
+from context_packing import ContextPacker
+from dedup import NearDuplicateFilter
+from model_recording import ModelRecorder
+from prefetch import PrefetchCache
+from provider_registry import EMBEDDING_PROVIDERS, LLM_PROVIDERS
 from rag_session import RagSession
+from session_monitor import SessionMonitor
 
 llama_index.core.set_global_handler("simple")
 Settings.chunk_size = 200
 Settings.chunk_overlap = 30
+MEMORY_TOKEN_LIMIT = 1500
+CONTEXT_TOKEN_BUDGET = 1024
+# Estimated memory of the sessions (loaded Chroma collections, prefetched candidates, chat histories) above
+# which sessions idle for IDLE_SESSION_S are evicted
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_MB", "2048")) << 20
+IDLE_SESSION_S = float(os.environ.get("IDLE_SESSION_S", "300"))
+# Chunks copied per request when a session's collection moves to another shard
+MOVE_BATCH_SIZE = 5000
+# Record/replay of the LLM and embedding calls: MODEL_RECORDING=record|replay|update, e.g. to rerun the fund overview
+# offline, MODEL_RECORDING_LATENCY=1 replays the recorded provider timings
+MODEL_RECORDING = os.environ.get("MODEL_RECORDING")
+MODEL_RECORDING_PATH = os.environ.get("MODEL_RECORDING_PATH", "./recordings/server.sqlite")
+# The fixed instructions come before the fund name, so that every chat shares the longest possible prompt
+# prefix and local backends (llama.cpp, Ollama) can reuse its KV state instead of prefilling it again
+SYSTEM_PROMPT = (
+    "You are an expert Mutual Fund analyst for a bank, and you privide answers to your boss about whether the bank "
+    "should purchase a fund. Only base your answer on the context information. If the information is not provided, "
+    "just say you don't know. The fund is named {fund_name}."
+)
 
 queries = [
     "What is the investment strategy of the fund?",
@@ -34,6 +65,89 @@ queries = [
 ]
 
 app = FastAPI()
+# Limits concurrent and per-second LLM calls per provider, shared by all connections of this process.
+# Sharded workers (shard_router.py) each admit their share of the limits
+admission = AdmissionController(num_workers=int(os.environ.get("NUM_WORKERS", "1")),
+                                worker_index=int(os.environ.get("WORKER_INDEX", "0")))
+# Retrieval candidates prefetched from the partial queries sent while the user types
+prefetcher = PrefetchCache()
+recorder = None
+if MODEL_RECORDING:
+    recorder = ModelRecorder(MODEL_RECORDING_PATH, mode=MODEL_RECORDING,
+                             replay_latency=os.environ.get("MODEL_RECORDING_LATENCY") == "1")
+    recorder.install(LLM_PROVIDERS, EMBEDDING_PROVIDERS)
+
+
+@lru_cache(maxsize=None)
+def get_chroma_client():
+    # chromadb is only imported, and the client opened, on the first request that needs it.
+    # Sharded workers (shard_router.py) each get their own CHROMA_PATH
+    import chromadb
+    return chromadb.PersistentClient(path=os.environ.get("CHROMA_PATH", "./chroma_db"))
+
+
+def _other_chroma_paths():
+    # Directories that can hold the collection of a session this process serves now: the one of the single
+    # process server and the shards of shard_router.py, after the number of workers changed
+    base = os.environ.get("CHROMA_BASE_PATH", os.environ.get("CHROMA_PATH", "./chroma_db"))
+    own = os.path.abspath(os.environ.get("CHROMA_PATH", "./chroma_db"))
+    return [path for path in [base, *sorted(glob.glob(f"{base}_shard_*"))]
+            if os.path.isdir(path) and os.path.abspath(path) != own]
+
+
+_move_lock = threading.Lock()
+
+
+def move_collection(db, session_id: str):
+    '''
+    Move the collection of a session into db from the Chroma directory that holds it, None if there is none
+    '''
+    import chromadb
+    with _move_lock:
+        try:
+            # Moved by a concurrent request
+            return db.get_collection(session_id)
+        except ValueError:
+            pass
+        for path in _other_chroma_paths():
+            source_db = chromadb.PersistentClient(path=path)
+            try:
+                source = source_db.get_collection(session_id)
+            except ValueError:
+                continue
+            collection = db.create_collection(session_id, metadata=source.metadata)
+            for offset in range(0, source.count(), MOVE_BATCH_SIZE):
+                batch = source.get(offset=offset, limit=MOVE_BATCH_SIZE, include=["embeddings", "documents", "metadatas"])
+                collection.add(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                               metadatas=batch["metadatas"])
+            # A single copy, a stale one would be found again if the session moves back
+            source_db.delete_collection(session_id)
+            print(f"Moved the collection of session {session_id} ({collection.count()} chunks) from {path}")
+            return collection
+    return None
+
+
+def get_collection(session_id: str, create: bool = False):
+    db = get_chroma_client()
+    try:
+        return db.get_collection(session_id)
+    except ValueError:
+        collection = move_collection(db, session_id)
+        if collection is not None:
+            return collection
+        if create:
+            return db.get_or_create_collection(session_id)
+        raise
+
+
+# Per-session memory estimates, and eviction of idle sessions above the memory budget
+sessions = SessionMonitor(get_chroma_client, prefetcher, MEMORY_BUDGET_BYTES, min_idle_s=IDLE_SESSION_S)
+
+
+def get_vector_store(session_id: str, create: bool = False):
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    return ChromaVectorStore(chroma_collection=get_collection(session_id, create=create))
+
 
 origins = ["*"]
 app.add_middleware(
@@ -56,37 +170,87 @@ async def create_upload_files(session_id: str = Form(...), settings: str = Form(
                 shutil.copyfileobj(file.file, buffer)
         
         documents = SimpleDirectoryReader(input_dir=temp_dir).load_data()
+    # The temporary path changes with every upload, keep it out of the embedded and LLM text
+    for document in documents:
+        document.excluded_embed_metadata_keys.append("file_path")
+        document.excluded_llm_metadata_keys.append("file_path")
 
     rag_session = RagSession(json.loads(settings))
 
-    db = chromadb.PersistentClient(path="./chroma_db")
-    chroma_collection = db.get_or_create_collection(session_id)
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    vector_store = get_vector_store(session_id, create=True)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    index = VectorStoreIndex.from_documents(documents, storage_context=storage_context, embed_model=rag_session.embed_model)
+    # Summary and statutory prospectuses of a fund share much of their text, store those chunks once
+    dedup = NearDuplicateFilter()
+    index = VectorStoreIndex.from_documents(documents, storage_context=storage_context, embed_model=rag_session.embed_model,
+                                            transformations=[*Settings.transformations, dedup])
     query_engine = index.as_query_engine(
         llm=rag_session.llm_model
         #node_postprocessors = [reranker]
     )
-    fund_name_response = query_engine.query("What is the name of the fund? Give only the name without additional comments. The name of the fund is: ")
-    fund_name = fund_name_response.response
-    responses = []
-    for query in queries:
-        result = query_engine.query(query)
-        responses.append(result)
+    limiter = admission.limiter_for(rag_session.llm_name)
+    try:
+        async with limiter.admit():
+            # Blocking queries run in a thread so that the event loop keeps serving the chats
+            fund_name_response = await limiter.retry(lambda: asyncio.to_thread(
+                query_engine.query, "What is the name of the fund? Give only the name without additional comments. The name of the fund is: "))
+            fund_name = fund_name_response.response
+            responses = []
+            for query in queries:
+                result = await limiter.retry(lambda: asyncio.to_thread(query_engine.query, query))
+                responses.append(result)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     response_answer_pairs = [{"query": query, "response": response.response} for query,response in zip (queries, responses)]
+    sessions.touch(session_id, refresh=True)
+    await enforce_memory_budget()
 
     return {
         "fund_name": fund_name,
-        "fund_overview": response_answer_pairs
+        "fund_overview": response_answer_pairs,
+        "dedup": dedup.report,
     }
 
+async def enforce_memory_budget():
+    # Unloading collections is blocking, the prefetch cache is only changed on the event loop
+    for session_id in await asyncio.to_thread(sessions.enforce_budget):
+        prefetcher.drop(session_id)
+
+
+@app.get("/memory")
+async def memory():
+    # Resident memory of the process, per-session and per-model estimates and cache sizes
+    return await asyncio.to_thread(sessions.report)
+
+
+async def start_stream(chat_engine, message, chat_history, use_async_chat):
+    # Returns the first chunk and an async iterator over the others. Rate limit errors surface before
+    # the first chunk, so this is the part that can be retried.
+    if use_async_chat:
+        response = await chat_engine.astream_chat(message=message, chat_history=chat_history)
+        chunks = response.async_response_gen()
+    else:
+        response = chat_engine.stream_chat(message=message, chat_history=chat_history)
+
+        async def sync_chunks():
+            for chunk in response.response_gen:
+                yield chunk
+        chunks = sync_chunks()
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = None
+    return first_chunk, chunks
+
+
 @app.websocket("/ws_chat")
 async def websocket_query(websocket: WebSocket):
     await websocket.accept()
     chat_history = []
     fund_name = ""
+    chat_session_id = None
+    # One RagSession per settings, shared by the partial queries and the query they lead to
+    rag_session = None
     try:
         # TODO: set up authentication
         is_authenticated = False
@@ -106,6 +270,18 @@ async def websocket_query(websocket: WebSocket):
                 ]
             else:
                 query_info = await websocket.receive_json()
+                if rag_session is None or rag_session.settings != query_info["settings"]:
+                    rag_session = RagSession(query_info["settings"])
+                if query_info.get("type") == "partial_query":
+                    # The user is still typing, prefetch retrieval candidates for what they typed so far
+                    try:
+                        collection = await asyncio.to_thread(get_collection, query_info["session_id"])
+                    except ValueError:
+                        continue
+                    prefetcher.schedule(query_info["session_id"], query_info["query"],
+                                        rag_session.embed_model, collection)
+                    sessions.touch(query_info["session_id"])
+                    continue
 
                 query = query_info["query"]
                 await websocket.send_text(ChatResponse(sender=Sender.BOT, type=ResponseType.START).model_dump_json())
@@ -113,35 +289,57 @@ async def websocket_query(websocket: WebSocket):
 
                 session_id = query_info["session_id"]
                 print(f"session_id: {session_id}")
-                rag_session = RagSession(query_info["settings"])
-
-                db2 = chromadb.PersistentClient(path="./chroma_db")
-                chroma_collection = db2.get_collection(session_id)
-                vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-                index = VectorStoreIndex.from_vector_store(
-                    vector_store,
-                    embed_model=rag_session.embed_model,
-                )
-                memory = ChatMemoryBuffer.from_defaults(token_limit=1500)
+                if session_id != chat_session_id:
+                    # An open chat keeps its session from being evicted
+                    if chat_session_id is not None:
+                        sessions.chat_closed(chat_session_id)
+                    sessions.chat_opened(session_id)
+                    chat_session_id = session_id
+
+                try:
+                    # Moving the collection from another shard is blocking
+                    collection = await asyncio.to_thread(get_collection, session_id)
+                except ValueError:
+                    await websocket.send_text(ChatResponse(
+                        sender=Sender.BOT, message="No documents were uploaded for this session, upload the fund documents first.",
+                        type=ResponseType.ERROR).model_dump_json())
+                    continue
+                # Re-ranks the candidates prefetched while the query was typed, or queries the collection
+                retriever = await prefetcher.retriever(session_id, collection, rag_session.embed_model, query_str=query)
+                memory = ChatMemoryBuffer.from_defaults(token_limit=MEMORY_TOKEN_LIMIT)
                 print(chat_history)
-                chat_engine = index.as_chat_engine(
+                chat_engine = ContextChatEngine.from_defaults(
+                    retriever=retriever,
                     llm=rag_session.llm_model,
-                    chat_mode="context",
                     memory=memory,
-                    system_prompt=
-                        f"You are an expert Mutual Fund analyst for a bank, and you privide answers to your boss about whether the bank should purchase the fund named {fund_name}. Only base your answer on the context information. If the information is not provided, just say you don't know.",
+                    # Dedup and merge the overlapping chunks, and keep the context within what the model can take
+                    # next to the chat history and the system prompt
+                    node_postprocessors=[ContextPacker.for_llm(
+                        rag_session.llm_model, reserved_tokens=MEMORY_TOKEN_LIMIT + 256, max_budget=CONTEXT_TOKEN_BUDGET)],
+                    system_prompt=SYSTEM_PROMPT.format(fund_name=fund_name),
                 )
                 message = f"{query}\nIf the context does not contain the information to answer this question, then do not attempt to answer, and just say you don't know."
-                if rag_session.use_async_chat:
-                    response = await chat_engine.astream_chat(message=message, chat_history=chat_history)
-                    async for response_chunk in response.async_response_gen(): # Assuming this is iterable
-                        await websocket.send_text(ChatResponse(sender=Sender.BOT, message=response_chunk, type=ResponseType.STREAM).model_dump_json())
-                else:
-                    response = chat_engine.stream_chat(message=message, chat_history=chat_history)
-                    for response_chunk in response.response_gen:
-                        await websocket.send_text(ChatResponse(sender=Sender.BOT, message=response_chunk, type=ResponseType.STREAM).model_dump_json())
+
+                async def send_queue_position(position):
+                    await websocket.send_text(ChatResponse(sender=Sender.BOT, message=str(position), type=ResponseType.QUEUE).model_dump_json())
+
+                limiter = admission.limiter_for(rag_session.llm_name)
+                try:
+                    async with limiter.admit(on_position=send_queue_position):
+                        first_chunk, chunks = await limiter.retry(
+                            lambda: start_stream(chat_engine, message, chat_history, rag_session.use_async_chat))
+                        if first_chunk is not None:
+                            await websocket.send_text(ChatResponse(sender=Sender.BOT, message=first_chunk, type=ResponseType.STREAM).model_dump_json())
+                        async for response_chunk in chunks:
+                            await websocket.send_text(ChatResponse(sender=Sender.BOT, message=response_chunk, type=ResponseType.STREAM).model_dump_json())
+                except AdmissionRejected:
+                    await websocket.send_text(ChatResponse(
+                        sender=Sender.BOT, message="The server is busy, try again in a minute.", type=ResponseType.ERROR).model_dump_json())
+                    continue
                 await websocket.send_text(ChatResponse(sender=Sender.BOT, type=ResponseType.END).model_dump_json())
                 chat_history = chat_engine.chat_history
+                sessions.chat_updated(session_id, chat_history)
+                await enforce_memory_budget()
     except WebSocketDisconnect:
        logging.info("websocket disconnect")
     except Exception as e:
@@ -153,7 +351,18 @@ async def websocket_query(websocket: WebSocket):
             type=ResponseType.ERROR,
         )
         await websocket.send_text(resp.model_dump_json())
+    finally:
+        if chat_session_id is not None:
+            sessions.chat_closed(chat_session_id)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes, sessions are routed to them by consistent hashing of session_id")
+    args = parser.parse_args()
+    if args.workers > 1:
+        from shard_router import serve
+        serve(args.workers, host="0.0.0.0", port=8000)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
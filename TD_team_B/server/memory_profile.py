@@ -0,0 +1,188 @@
+# Copied to TD_team_B/server, pubmed_qa/utils and local_llama2/utils, keep the copies identical
+import gc
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# hnswlib keeps, per element, the float32 vector, 2 * M level 0 links and its label,
+# Chroma adds the id <-> label maps in Python
+_HNSW_ELEMENT_OVERHEAD = 200
+
+
+def process_memory():
+    '''
+    Resident and peak resident memory of this process in bytes, None where the platform does not tell
+    '''
+    rss = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    peak = None
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
+
+
+def torch_module_memory(module):
+    by_device = {}
+    parameters = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        device = str(tensor.device)
+        by_device[device] = by_device.get(device, 0) + tensor.numel() * tensor.element_size()
+    for tensor in module.parameters():
+        parameters += tensor.numel()
+    return {"parameters": parameters, "bytes": sum(by_device.values()), "devices": by_device}
+
+
+def _weights(model, depth=3):
+    # The llama_index wrappers keep the weights in a private attribute: HuggingFaceLLM._model,
+    # HuggingFaceEmbedding._model, BatchedLocalLLM._server.model, LlamaCPP._model (llama.cpp)
+    if depth == 0 or model is None:
+        return None
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        return model
+    if hasattr(model, "model_path") and isinstance(getattr(model, "model_path"), str):
+        return model
+    for name in ("_model", "model", "_server", "_client"):
+        found = _weights(getattr(model, name, None), depth - 1)
+        if found is not None:
+            return found
+    return None
+
+
+def model_memory(model):
+    '''
+    Memory held by a loaded LLM or embedding model: parameter bytes per device for torch models,
+    the (memory-mapped) weights file and the prompt cache for llama.cpp, 0 for remote models
+    '''
+    report = {"class": type(model).__name__, "model_name": getattr(model, "model_name", None) or getattr(model, "model", None),
+              "bytes": 0}
+    weights = _weights(model)
+    if weights is None:
+        return report
+    if hasattr(weights, "parameters"):
+        report.update(torch_module_memory(weights))
+    else:
+        report["bytes"] = os.path.getsize(weights.model_path) if os.path.exists(weights.model_path) else 0
+        cache = getattr(weights, "cache", None)
+        if cache is not None and hasattr(cache, "cache_size"):
+            report["prompt_cache_bytes"] = cache.cache_size
+            report["bytes"] += cache.cache_size
+    return report
+
+
+def live_models():
+    '''
+    Every llama_index LLM and embedding model object alive in this process
+    '''
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.llms import LLM
+    # isinstance() of pydantic models calls hasattr() on the object, which imports lazy modules (six.moves)
+    return [obj for obj in gc.get_objects() if issubclass(type(obj), (LLM, BaseEmbedding))]
+
+
+def _segment_manager(client):
+    # chromadb 0.4 keeps loaded collections in the LocalSegmentManager of the client, not a public API
+    return getattr(getattr(client, "_server", None), "_manager", None)
+
+
+def collection_loaded(client, collection):
+    '''
+    Whether the vector index (HNSW) of a Chroma collection is loaded in memory, None if unknown
+    '''
+    from chromadb.types import SegmentScope
+    manager = _segment_manager(client)
+    if manager is None:
+        return None
+    return collection.id in manager.segment_cache[SegmentScope.VECTOR].cache
+
+
+def release_collection(client, collection):
+    '''
+    Unload the vector index of a Chroma collection, the same way Chroma's own LRU policy does.
+    The data stays on disk, the next query of the collection loads it again.
+    '''
+    from chromadb.types import SegmentScope
+    manager = _segment_manager(client)
+    if manager is None:
+        return False
+    with manager._lock:
+        segment = manager.segment_cache[SegmentScope.VECTOR].pop(collection.id)
+        instance = manager._instances.pop(segment["id"], None) if segment is not None else None
+        if instance is None:
+            return False
+        handles = getattr(manager, "_vector_instances_file_handle_cache", None)
+        if handles is not None:
+            handles.cache.pop(collection.id, None)
+        if hasattr(instance, "close_persistent_index"):
+            instance.close_persistent_index()
+        instance.stop()
+    return True
+
+
+def collection_memory(collection, client=None):
+    '''
+    Vector count, dimension and estimated resident bytes of a Chroma collection's vector index
+    '''
+    count = collection.count()
+    sample = collection.get(limit=1, include=["embeddings"]) if count else {"embeddings": []}
+    dim = len(sample["embeddings"][0]) if len(sample["embeddings"]) else 0
+    links = 2 * (collection.metadata or {}).get("hnsw:M", 16)
+    report = {"vectors": count, "dim": dim, "bytes": count * (dim * 4 + links * 4 + _HNSW_ELEMENT_OVERHEAD)}
+    if client is not None:
+        report["loaded"] = collection_loaded(client, collection)
+    return report
+
+
+def index_memory(index):
+    '''
+    Node count, vector count and estimated vector bytes of a VectorStoreIndex
+    '''
+    vector_store = index.vector_store
+    store_type = vector_store.class_name()
+    report = {"vector_store": store_type, "nodes": len(index.index_struct.nodes_dict)}
+    if store_type == "QuantizedVectorStore":
+        report.update({"vectors": len(vector_store._ids), "bytes": vector_store.memory_bytes()})
+    elif store_type == "SimpleVectorStore":
+        embeddings = vector_store.data.embedding_dict
+        dim = len(next(iter(embeddings.values()))) if embeddings else 0
+        # Lists of Python floats: an 8 byte pointer and a 24 byte float object per value
+        report.update({"vectors": len(embeddings), "dim": dim, "bytes": len(embeddings) * dim * 32})
+    elif store_type == "ChromaVectorStore":
+        report.update(collection_memory(vector_store.client))
+    return report
+
+
+def chat_memory_size(memory):
+    '''
+    Messages, characters and tokens held by a chat memory (ChatMemoryBuffer) or a list of ChatMessage
+    '''
+    messages = memory.get_all() if hasattr(memory, "get_all") else list(memory)
+    text = [str(message.content or "") for message in messages]
+    report = {"messages": len(messages), "chars": sum(len(content) for content in text)}
+    tokenizer_fn = getattr(memory, "tokenizer_fn", None)
+    if tokenizer_fn is not None:
+        report["tokens"] = sum(len(tokenizer_fn(content)) for content in text)
+    return report
+
+
+def memory_report(indices=None, models=None, chat_memories=None):
+    '''
+    Memory estimates of the process, named indices and chat memories, and models (all live models by default):
+    memory_report(indices={"pubmed": index}, chat_memories={"chat": chat_engine.memory})
+    '''
+    models = live_models() if models is None else models
+    return {
+        "process": process_memory(),
+        "indices": {name: index_memory(index) for name, index in (indices or {}).items()},
+        "models": [model_memory(model) for model in models],
+        "chat_memories": {name: chat_memory_size(memory) for name, memory in (chat_memories or {}).items()},
+    }
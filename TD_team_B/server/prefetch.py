@@ -0,0 +1,202 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+
+def _distances(space, embeddings, query):
+    # Same distances as the Chroma collection (hnsw:space), so re-scored candidates rank as a full query would
+    if space == "cosine":
+        norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+        return 1.0 - embeddings @ query / np.where(norms > 0, norms, 1.0)
+    if space == "ip":
+        return 1.0 - embeddings @ query
+    return ((embeddings - query) ** 2).sum(axis=1)
+
+
+def query_collection(collection, embedding, n_results):
+    '''
+    Query a Chroma collection like ChromaVectorStore does, but keep the embeddings of the results,
+    returns {node_id: (node, embedding)}
+    '''
+    results = collection.query(query_embeddings=[embedding.tolist()], n_results=n_results,
+                               include=["documents", "metadatas", "embeddings"])
+    candidates = {}
+    for node_id, text, metadata, node_embedding in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["embeddings"][0]):
+        node = metadata_dict_to_node(metadata)
+        node.set_content(text)
+        candidates[node_id] = (node, np.asarray(node_embedding, dtype=np.float32))
+    return candidates
+
+
+class Prefetch():
+    def __init__(self, text, collection_name, embedding, candidates):
+        self.text = text
+        self.collection_name = collection_name
+        self.embedding = embedding
+        self.candidates = candidates
+        self.created = time.monotonic()
+
+
+class PrefetchRetriever(BaseRetriever):
+    '''
+    Retrieval for the final query of a chat turn, on top of the candidates prefetched for its partial text:
+    - Query unchanged since the last prefetch: the candidates are re-ranked, no embedding or vector store call
+    - Query close to the prefetched one (cosine >= min_similarity): the query is embedded, and the candidates
+      plus the delta_k nearest chunks are re-ranked
+    - No prefetch, or the user changed course: a plain similarity_top_k query of the collection
+    query_str, when given, is retrieved instead of the chat message (which carries extra instructions).
+    '''
+    def __init__(self, collection, embed_model, prefetch=None, query_str=None, similarity_top_k=2, delta_k=2,
+                 min_similarity=0.8, stats=None):
+        self.collection = collection
+        self.embed_model = embed_model
+        self.prefetch = prefetch
+        self.query_str = query_str
+        self.similarity_top_k = similarity_top_k
+        self.delta_k = delta_k
+        self.min_similarity = min_similarity
+        self.stats = stats if stats is not None else {}
+        super().__init__()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        query_str = self.query_str or query_bundle.query_str
+        prefetch = self.prefetch
+        if prefetch is not None and prefetch.text == query_str:
+            embedding, similarity = prefetch.embedding, 1.0
+        else:
+            embedding = np.asarray(self.embed_model.get_query_embedding(query_str), dtype=np.float32)
+            similarity = 0.0
+            if prefetch is not None:
+                norms = np.linalg.norm(embedding) * np.linalg.norm(prefetch.embedding)
+                similarity = float(embedding @ prefetch.embedding / norms) if norms > 0 else 0.0
+
+        if similarity >= self.min_similarity:
+            candidates = dict(prefetch.candidates)
+            if similarity < 1.0 and self.delta_k:
+                candidates.update(query_collection(self.collection, embedding, self.delta_k))
+            mode = "hit"
+        else:
+            candidates = query_collection(self.collection, embedding, self.similarity_top_k)
+            mode = "miss"
+        self.stats[mode] = self.stats.get(mode, 0) + 1
+        if not candidates:
+            return []
+
+        node_ids = list(candidates)
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        distances = _distances(space, np.stack([candidates[node_id][1] for node_id in node_ids]), embedding)
+        nodes = [NodeWithScore(node=candidates[node_ids[idx]][0], score=float(np.exp(-distances[idx])))
+                 for idx in np.argsort(distances)[:self.similarity_top_k]]
+        print(f"Prefetch {mode}: {len(candidates)} candidates re-ranked in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return nodes
+
+
+class PrefetchCache():
+    '''
+    Per-session retrieval candidates prefetched from partial queries, while the user is still typing.
+    schedule() is debounced: a prefetch starts once no newer partial query arrived for debounce_s, or at the
+    latest max_wait_s after the first partial query not prefetched yet, so steady typing still prefetches.
+    A prefetch embeds the partial text and keeps the candidates_k nearest chunks with their embeddings.
+    retriever() hands the prefetch of a session over to the PrefetchRetriever of its final query.
+    '''
+    def __init__(self, candidates_k=16, debounce_s=0.3, max_wait_s=1.0, ttl_s=120.0, max_sessions=1024, min_chars=12):
+        self.candidates_k = candidates_k
+        self.debounce_s = debounce_s
+        self.max_wait_s = max_wait_s
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.min_chars = min_chars
+        self.stats = {"scheduled": 0, "prefetched": 0}
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._waiting_since = {}
+        self._fetching = set()
+
+    def schedule(self, session_id, text, embed_model, collection):
+        text = text.strip()
+        entry = self._entries.get(session_id)
+        if len(text) < self.min_chars or (entry is not None and entry.text == text):
+            return
+        self._cancel(session_id)
+        self.stats["scheduled"] += 1
+        waiting_since = self._waiting_since.setdefault(session_id, time.monotonic())
+        delay = min(self.debounce_s, max(0.0, waiting_since + self.max_wait_s - time.monotonic()))
+        self._pending[session_id] = asyncio.create_task(
+            self._prefetch(session_id, text, embed_model, collection, delay))
+
+    def _cancel(self, session_id):
+        task = self._pending.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _prefetch(self, session_id, text, embed_model, collection, delay):
+        await asyncio.sleep(delay)
+        self._waiting_since.pop(session_id, None)
+        task = asyncio.current_task()
+        self._fetching.add(task)
+        try:
+            entry = await asyncio.to_thread(self._fetch, text, embed_model, collection)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Prefetch error: {str(e)}")
+            return
+        finally:
+            self._fetching.discard(task)
+            if self._pending.get(session_id) is task:
+                del self._pending[session_id]
+        self._entries[session_id] = entry
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def _fetch(self, text, embed_model, collection):
+        start = time.perf_counter()
+        embedding = np.asarray(embed_model.get_query_embedding(text), dtype=np.float32)
+        candidates = query_collection(collection, embedding, self.candidates_k)
+        self.stats["prefetched"] += 1
+        print(f"Prefetched {len(candidates)} candidates for a partial query in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return Prefetch(text, collection.name, embedding, candidates)
+
+    def drop(self, session_id):
+        self._cancel(session_id)
+        self._waiting_since.pop(session_id, None)
+        self._entries.pop(session_id, None)
+
+    def memory_bytes(self, session_id=None):
+        '''
+        Bytes of prefetched embeddings and text, of one session or of all of them
+        '''
+        entries = list(self._entries.values()) if session_id is None else [self._entries.get(session_id)]
+        return sum(entry.embedding.nbytes + sum(embedding.nbytes + len(node.get_content())
+                                                for node, embedding in entry.candidates.values())
+                   for entry in entries if entry is not None)
+
+    async def take(self, session_id, collection_name):
+        '''
+        Remove and return the prefetch of a session, None if there is none or it is stale.
+        A prefetch still in its debounce wait is dropped, one already running is waited for.
+        '''
+        task = self._pending.get(session_id)
+        if task is not None:
+            if task in self._fetching:
+                await asyncio.wait([task])
+            else:
+                self._cancel(session_id)
+        self._waiting_since.pop(session_id, None)
+        entry = self._entries.pop(session_id, None)
+        if entry is None or entry.collection_name != collection_name or time.monotonic() - entry.created > self.ttl_s:
+            return None
+        return entry
+
+    async def retriever(self, session_id, collection, embed_model, query_str=None, **kwargs):
+        prefetch = await self.take(session_id, collection.name)
+        return PrefetchRetriever(collection, embed_model, prefetch=prefetch, query_str=query_str, stats=self.stats, **kwargs)
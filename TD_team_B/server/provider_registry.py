@@ -0,0 +1,208 @@
+import importlib
+import os
+
+
+class ProviderRegistry():
+    '''
+    Maps a provider name ("ollama", "cohere", "local", "llamacpp", ...) to a factory building the model.
+    Factories import their SDK when called, so only the provider that is actually used gets loaded.
+    A factory is a callable `factory(model_name, **kwargs)` or a "package.module:function" string.
+    TD_team_B/server, pubmed_qa/utils and local_llama2/utils each have a copy of this module, not a shared
+    import: a change to one copy has to be made to the other two.
+    `wrapper`, when set, is called as wrapper(kind, name, model_name, build) and decides whether and when
+    build() creates the model, e.g. ModelRecorder.wrap replays recorded calls without building it.
+    '''
+    def __init__(self, kind):
+        self.kind = kind
+        self._factories = {}
+        self.wrapper = None
+
+    def register(self, name, factory=None):
+        # Can be used as a decorator: @LLM_PROVIDERS.register("name")
+        if factory is None:
+            def decorator(func):
+                self._factories[name] = func
+                return func
+            return decorator
+        self._factories[name] = factory
+        return factory
+
+    def get(self, name):
+        if name not in self._factories:
+            raise NotImplementedError(f'Unknown {self.kind} provider - {name}. Available: {self.names()}')
+        factory = self._factories[name]
+        if isinstance(factory, str):
+            module_name, attr_name = factory.split(":")
+            factory = getattr(importlib.import_module(module_name), attr_name)
+            self._factories[name] = factory
+        return factory
+
+    def create(self, name, model_name, **kwargs):
+        factory = self.get(name)
+        if self.wrapper is not None:
+            return self.wrapper(self.kind, name, model_name, lambda: factory(model_name, **kwargs))
+        return factory(model_name, **kwargs)
+
+    def names(self):
+        return sorted(self._factories.keys())
+
+    def __contains__(self, name):
+        return name in self._factories
+
+
+LLM_PROVIDERS = ProviderRegistry("llm")
+EMBEDDING_PROVIDERS = ProviderRegistry("embedding")
+
+# llama.cpp prompt caches per (model file, context window), shared by every LLM object loading that model
+_LLAMA_CPP_PREFIX_CACHES = {}
+
+
+def llama_cpp_prefix_cache(key, capacity_bytes):
+    '''
+    LRU cache of llama.cpp KV states keyed by prompt tokens, evicted by memory size (capacity_bytes).
+    A prompt resumes from the cached state with the longest common prefix, so a fixed system prompt or
+    template is prefilled once per model. Lookups and reused tokens are counted in `stats`,
+    see llama_cpp_prefix_cache_stats().
+    '''
+    if key not in _LLAMA_CPP_PREFIX_CACHES:
+        from llama_cpp import Llama, LlamaRAMCache
+
+        class InstrumentedRAMCache(LlamaRAMCache):
+            def __init__(self, capacity_bytes):
+                super().__init__(capacity_bytes=capacity_bytes)
+                self.stats = {"lookups": 0, "hits": 0, "prompt_tokens": 0, "tokens_reused": 0}
+
+            def __getitem__(self, tokens):
+                self.stats["lookups"] += 1
+                self.stats["prompt_tokens"] += len(tokens)
+                state = super().__getitem__(tokens)
+                self.stats["hits"] += 1
+                self.stats["tokens_reused"] += Llama.longest_token_prefix(state.input_ids.tolist(), tokens)
+                return state
+
+        _LLAMA_CPP_PREFIX_CACHES[key] = InstrumentedRAMCache(capacity_bytes=capacity_bytes)
+    return _LLAMA_CPP_PREFIX_CACHES[key]
+
+
+def llama_cpp_prefix_cache_stats():
+    '''
+    Lookups, hits and reused prompt tokens of every llama.cpp prefix cache, with its states and size
+    '''
+    return {str(key): {**cache.stats, "states": len(cache.cache_state), "bytes": cache.cache_size}
+            for key, cache in _LLAMA_CPP_PREFIX_CACHES.items()}
+
+
+@LLM_PROVIDERS.register("ollama")
+def ollama_llm(model_name, **kwargs):
+    from llama_index.llms.ollama import Ollama
+    return Ollama(
+        model=model_name,
+        base_url=kwargs.get("base_url") or "http://localhost:11434",
+        request_timeout=kwargs.get("request_timeout", 30.0),
+        temperature=kwargs.get("temperature", 0),
+    )
+
+
+@LLM_PROVIDERS.register("cohere")
+def cohere_llm(model_name, **kwargs):
+    from llama_index.llms.cohere import Cohere
+    return Cohere(model=model_name, api_key=kwargs.get("api_key"))
+
+
+@LLM_PROVIDERS.register("openai")
+def openai_llm(model_name, **kwargs):
+    from llama_index.llms.openai import OpenAI
+    return OpenAI(model=model_name, temperature=kwargs.get("temperature", 0.0), api_key=kwargs.get("api_key"))
+
+
+@LLM_PROVIDERS.register("local")
+def huggingface_llm(model_name, **kwargs):
+    # Using local HuggingFace LLM stored at model_path (/model-weights on the cluster)
+    from llama_index.llms.huggingface import HuggingFaceLLM
+    model_path = kwargs.get("model_path", "/model-weights")
+    gen_arg_keys = ['temperature', 'top_p', 'top_k', 'do_sample']
+    gen_kwargs = {k: v for k, v in kwargs.items() if k in gen_arg_keys}
+    return HuggingFaceLLM(
+        tokenizer_name=f"{model_path}/{model_name}",
+        model_name=f"{model_path}/{model_name}",
+        device_map="auto",
+        context_window=kwargs.get("context_window", 4096),
+        max_new_tokens=kwargs.get("max_new_tokens", 256),
+        generate_kwargs=gen_kwargs,
+        # model_kwargs={"torch_dtype": torch.float16, "load_in_8bit": True},
+    )
+
+
+@LLM_PROVIDERS.register("llamacpp")
+def llamacpp_llm(model_name, **kwargs):
+    # Quantized GGUF weights run in-process through llama.cpp, CPU only by default.
+    # model_name is a .gguf file, absolute or relative to model_path.
+    from llama_index.llms.llama_cpp import LlamaCPP
+    model_file = model_name
+    if not os.path.isabs(model_file) and kwargs.get("model_path"):
+        model_file = os.path.join(kwargs["model_path"], model_file)
+    llm = LlamaCPP(
+        model_path=model_file,
+        temperature=kwargs.get("temperature", 0.0),
+        max_new_tokens=kwargs.get("max_new_tokens", 256),
+        context_window=kwargs.get("context_window", 4096),
+        generate_kwargs={k: v for k, v in kwargs.items() if k in ['top_p', 'top_k']},
+        model_kwargs={
+            "n_gpu_layers": kwargs.get("n_gpu_layers", 0),
+            # A fixed thread count and seed keep CPU latency and outputs predictable
+            "n_threads": kwargs.get("n_threads", os.cpu_count()),
+            "seed": kwargs.get("seed", 0),
+        },
+        verbose=False,
+    )
+    if kwargs.get("prefix_cache_bytes", 2 << 30):
+        llm._model.set_cache(llama_cpp_prefix_cache(
+            (model_file, kwargs.get("context_window", 4096)), kwargs.get("prefix_cache_bytes", 2 << 30)))
+    return llm
+
+
+@LLM_PROVIDERS.register("openai_like")
+def openai_like_llm(model_name, **kwargs):
+    # Any local OpenAI-compatible endpoint: llama.cpp server, vLLM, LM Studio, ...
+    from llama_index.llms.openai_like import OpenAILike
+    return OpenAILike(
+        model=model_name,
+        api_base=kwargs.get("api_base") or "http://localhost:8080/v1",
+        api_key=kwargs.get("api_key") or "not-needed",
+        temperature=kwargs.get("temperature", 0.0),
+        max_tokens=kwargs.get("max_new_tokens", 256),
+        context_window=kwargs.get("context_window", 4096),
+        is_chat_model=kwargs.get("is_chat_model", True),
+        timeout=kwargs.get("request_timeout", 60.0),
+    )
+
+
+@EMBEDDING_PROVIDERS.register("ollama")
+def ollama_embedding(model_name, **kwargs):
+    from llama_index.embeddings.ollama import OllamaEmbedding
+    return OllamaEmbedding(
+        model_name=model_name,
+        base_url=kwargs.get("base_url") or "http://localhost:11434",
+        ollama_additional_kwargs={"mirostat": 0},
+    )
+
+
+@EMBEDDING_PROVIDERS.register("cohere")
+def cohere_embedding(model_name, **kwargs):
+    from llama_index.embeddings.cohere import CohereEmbedding
+    return CohereEmbedding(model_name=model_name, cohere_api_key=kwargs.get("api_key"))
+
+
+@EMBEDDING_PROVIDERS.register("openai")
+def openai_embedding(model_name, **kwargs):
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    return OpenAIEmbedding(model=model_name, api_key=kwargs.get("api_key"))
+
+
+@EMBEDDING_PROVIDERS.register("hf")
+def huggingface_embedding(model_name, **kwargs):
+    # Using bge base HuggingFace embeddings, can choose others based on leaderboard:
+    # https://huggingface.co/spaces/mteb/leaderboard
+    # Small bge models run fine on CPU
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    return HuggingFaceEmbedding(model_name=model_name, device=kwargs.get("device"))
@@ -1,41 +1,22 @@
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.llms.cohere import Cohere
-from llama_index.embeddings.cohere import CohereEmbedding
+import re
+
+from provider_registry import LLM_PROVIDERS, EMBEDDING_PROVIDERS
+
+# Providers whose llama_index integration has no working astream_chat, their chat is streamed synchronously
+_SYNC_CHAT_PROVIDERS = {"cohere"}
+
+
+def _provider_kwargs(params: dict) -> dict:
+    # Frontend settings are camelCase (apiKey, baseUrl, ...), provider factories take snake_case kwargs
+    return {re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower(): value for key, value in params.items()}
+
 
 class RagSession:
 
-    @staticmethod
-    def _ollama_llm_model(params):
-        return Ollama(model=params["llmModel"], request_timeout=30.0, temperature=0)
-        
-    @staticmethod
-    def _cohere_llm_model(params):
-        return Cohere(model=params["llmModel"], api_key=params["apiKey"])
-
-    _llm_model_dict = {
-        "ollama": _ollama_llm_model,
-        "cohere": _cohere_llm_model
-    }
-
-    @staticmethod
-    def _ollama_embedding_model(params):
-        return OllamaEmbedding(
-            model_name=params["embeddingModel"],
-            ollama_additional_kwargs={"mirostat": 0},
-        )
-
-    @staticmethod
-    def _cohere_embedding_model(params):
-        return CohereEmbedding(
-            model_name=params["embeddingModel"],
-            cohere_api_key=params["apiKey"]
-        )
-
-    _embedding_model_dict = {
-        "ollama": _ollama_embedding_model,
-        "cohere": _cohere_embedding_model
-    }
+    # Provider registries come from the copy of provider_registry.py kept in sync with the pubmed_qa/local_llama2 utils.
+    # Register extra providers with _llm_model_dict.register(name, factory).
+    _llm_model_dict = LLM_PROVIDERS
+    _embedding_model_dict = EMBEDDING_PROVIDERS
 
     def __init__(self, settings: dict):
         llm_name: str = str(settings["llm"])
@@ -43,10 +24,20 @@ class RagSession:
         embedding_name: str = str(settings["embedding"])
         embedding_params: dict = settings["models"][embedding_name]
 
+        self.settings = settings
         self.llm_name: str = llm_name
         self.llm_params = llm_params
         self.embedding_name: str = embedding_name
         self.embedding_params = embedding_params
-        self.llm_model = RagSession._llm_model_dict[llm_name](llm_params)
-        self.embed_model = RagSession._embedding_model_dict[embedding_name](embedding_params)
-        self.use_async_chat = (llm_name != "cohere")
+        self._llm_model = None
+        self.embed_model = RagSession._embedding_model_dict.create(
+            embedding_name, embedding_params.get("embeddingModel"), **_provider_kwargs(embedding_params))
+        self.use_async_chat = (llm_name not in _SYNC_CHAT_PROVIDERS)
+
+    @property
+    def llm_model(self):
+        # Built on first use, a session that only retrieves (prefetch while the user types) never loads the LLM
+        if self._llm_model is None:
+            self._llm_model = RagSession._llm_model_dict.create(
+                self.llm_name, self.llm_params.get("llmModel"), **_provider_kwargs(self.llm_params))
+        return self._llm_model
@@ -0,0 +1,153 @@
+import threading
+import time
+
+from memory_profile import (
+    collection_loaded, collection_memory, live_models, model_memory, process_memory, release_collection,
+)
+from provider_registry import llama_cpp_prefix_cache_stats
+
+
+class _Session():
+    def __init__(self):
+        self.last_active = time.monotonic()
+        self.open_chats = 0
+        self.chat = {"messages": 0, "chars": 0}
+        self.collection = None
+
+
+class SessionMonitor():
+    '''
+    Tracks the sessions served by this process and estimates their resident memory: the vector index
+    of their Chroma collection (when loaded), their prefetched candidates and their chat history.
+    enforce_budget() evicts sessions with no open chat and idle for min_idle_s, least recently used first,
+    until the estimate is within budget_bytes: the collection is unloaded (it stays on disk and is loaded
+    again by the next query). It runs in a worker thread and returns the evicted sessions, their prefetched
+    candidates are dropped by the caller on the event loop. It measures the sessions on a snapshot, so each
+    session is checked again, under the lock the event loop takes to update it, right before it is released.
+    '''
+    def __init__(self, get_client, prefetcher, budget_bytes, min_idle_s=300.0):
+        self.get_client = get_client
+        self.prefetcher = prefetcher
+        self.budget_bytes = budget_bytes
+        self.min_idle_s = min_idle_s
+        self.stats = {"evicted": 0, "evicted_bytes": 0}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, refresh=False):
+        '''
+        Mark a session as active, refresh=True after its collection changed (upload)
+        '''
+        with self._lock:
+            return self._touch(session_id, refresh)
+
+    def _touch(self, session_id, refresh=False):
+        session = self._sessions.setdefault(session_id, _Session())
+        session.last_active = time.monotonic()
+        if refresh:
+            session.collection = None
+        return session
+
+    def chat_opened(self, session_id):
+        with self._lock:
+            self._touch(session_id).open_chats += 1
+
+    def chat_closed(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            session.open_chats = max(session.open_chats - 1, 0)
+            session.chat = {"messages": 0, "chars": 0}
+
+    def chat_updated(self, session_id, chat_history):
+        chat = {"messages": len(chat_history), "chars": sum(len(str(message.content or "")) for message in chat_history)}
+        with self._lock:
+            self._touch(session_id).chat = chat
+
+    def _still_idle(self, session_id):
+        # Called with the lock held: the session may have been used since the snapshot was taken
+        session = self._sessions.get(session_id)
+        return (session is not None and not session.open_chats
+                and time.monotonic() - session.last_active >= self.min_idle_s)
+
+    def _collection(self, session_id):
+        try:
+            return self.get_client().get_collection(session_id)
+        except ValueError:
+            return None
+
+    def session_memory(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Evicted since the caller listed the sessions
+            return None
+        collection = self._collection(session_id)
+        report = {
+            "idle_s": round(time.monotonic() - session.last_active, 1),
+            "open_chats": session.open_chats,
+            "chat": session.chat,
+            "prefetch_bytes": self.prefetcher.memory_bytes(session_id),
+        }
+        if collection is not None:
+            # Counting vectors costs a query, the estimate is kept until the next upload
+            if session.collection is None:
+                session.collection = collection_memory(collection)
+            report["collection"] = {**session.collection, "loaded": collection_loaded(self.get_client(), collection)}
+        resident = report["prefetch_bytes"] + session.chat["chars"]
+        if report.get("collection", {}).get("loaded"):
+            resident += report["collection"]["bytes"]
+        report["bytes"] = resident
+        return report
+
+    def _snapshot(self):
+        sessions = {session_id: self.session_memory(session_id) for session_id in list(self._sessions)}
+        return {session_id: session for session_id, session in sessions.items() if session is not None}
+
+    def report(self):
+        sessions = self._snapshot()
+        return {
+            "process": process_memory(),
+            "budget_bytes": self.budget_bytes,
+            "session_bytes": sum(session["bytes"] for session in sessions.values()),
+            "sessions": sessions,
+            "models": [model for model in map(model_memory, live_models()) if model["bytes"]],
+            "caches": {"prefetch": {**self.prefetcher.stats, "bytes": self.prefetcher.memory_bytes()},
+                       "llama_cpp_prefix": llama_cpp_prefix_cache_stats()},
+            "evictions": self.stats,
+        }
+
+    def enforce_budget(self):
+        sessions = self._snapshot()
+        idle = sorted((session_id for session_id, session in sessions.items()
+                       if not session["open_chats"] and session["idle_s"] >= self.min_idle_s),
+                      key=lambda session_id: -sessions[session_id]["idle_s"])
+        # Idle sessions holding nothing in memory are no longer tracked
+        for session_id in idle:
+            if not sessions[session_id]["bytes"]:
+                with self._lock:
+                    if self._still_idle(session_id):
+                        self._sessions.pop(session_id, None)
+        total = sum(session["bytes"] for session in sessions.values())
+        if total <= self.budget_bytes:
+            return []
+        evicted = []
+        for session_id in idle:
+            if total <= self.budget_bytes:
+                break
+            if not sessions[session_id]["bytes"]:
+                continue
+            collection = self._collection(session_id)
+            # Released under the lock, so that a query cannot start on the session in between
+            with self._lock:
+                if not self._still_idle(session_id):
+                    continue
+                if collection is not None:
+                    release_collection(self.get_client(), collection)
+                self._sessions.pop(session_id, None)
+            total -= sessions[session_id]["bytes"]
+            self.stats["evicted"] += 1
+            self.stats["evicted_bytes"] += sessions[session_id]["bytes"]
+            evicted.append(session_id)
+        if evicted:
+            print(f"Memory budget: evicted {len(evicted)} idle sessions, {total / 2**20:.0f} MB of "
+                  f"{self.budget_bytes / 2**20:.0f} MB in use")
+        return evicted
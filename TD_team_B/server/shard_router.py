@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+from typing import List
+
+import httpx
+import uvicorn
+import websockets
+from fastapi import FastAPI, File, Form, Response, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from chat_response import ChatResponse, ResponseType, Sender
+
+
+def shard_id(idx):
+    # Stable name of a worker on the hash ring and of its Chroma directory, independent of its host and port
+    return f"shard_{idx}"
+
+
+class ConsistentHashRing():
+    '''
+    Maps keys (session ids) to nodes (shard ids). Every node owns `replicas` points on the ring,
+    so adding or removing a worker only moves about 1/N of the sessions.
+    '''
+    def __init__(self, nodes, replicas=128):
+        self.nodes = list(nodes)
+        self._ring = sorted((self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key):
+        idx = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._ring[idx][1]
+
+
+def _run_worker(host, port, chroma_dir, worker_init, log_level, worker_index, num_workers):
+    # Each worker owns the Chroma directory of its shard, a collection is only ever opened by the worker of its
+    # session. Sessions that moved to this shard (the number of workers changed) have their collection moved
+    # from the directory that holds it on first use, see main.get_collection
+    os.environ["CHROMA_PATH"] = f"{chroma_dir}_{shard_id(worker_index)}"
+    os.environ["CHROMA_BASE_PATH"] = chroma_dir
+    # The provider limits hold for all workers together, each one admits its share of the calls
+    os.environ["WORKER_INDEX"] = str(worker_index)
+    os.environ["NUM_WORKERS"] = str(num_workers)
+    if worker_init:
+        module_name, attr_name = worker_init.split(":")
+        getattr(importlib.import_module(module_name), attr_name)()
+    uvicorn.run("main:app", host=host, port=port, log_level=log_level)
+
+
+def _wait_for_port(host, port, timeout_s):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Worker on port {port} did not start within {timeout_s}s")
+
+
+def start_workers(num_workers, base_port, host="127.0.0.1", chroma_dir="./chroma_db", worker_init=None,
+                  log_level="warning", timeout_s=60.0):
+    '''
+    Start num_workers processes running main:app on base_port, base_port + 1, ...
+    worker_init is an optional "module:function" called in every worker before it starts serving.
+    Returns the processes and the worker urls.
+    '''
+    context = multiprocessing.get_context("spawn")
+    processes, urls = [], []
+    for idx in range(num_workers):
+        port = base_port + idx
+        process = context.Process(
+            target=_run_worker, args=(host, port, chroma_dir, worker_init, log_level, idx, num_workers), daemon=True)
+        process.start()
+        processes.append(process)
+        urls.append(f"http://{host}:{port}")
+    try:
+        for idx in range(num_workers):
+            _wait_for_port(host, base_port + idx, timeout_s)
+    except Exception:
+        stop_workers(processes)
+        raise
+    return processes, urls
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=10)
+
+
+def create_router_app(worker_urls: List[str]):
+    '''
+    Front app routing /upload/ and /ws_chat to the worker owning the session, by consistent hashing
+    of session_id. The worker keeps the session's Chroma collection and caches warm.
+    /memory collects the memory report of every worker, by worker url.
+    '''
+    app = FastAPI()
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Worker idx serves shard_id(idx), worker_urls are in the order of start_workers
+    shards = {shard_id(idx): url for idx, url in enumerate(worker_urls)}
+    ring = ConsistentHashRing(shards)
+    client = httpx.AsyncClient(timeout=None)
+
+    @app.on_event("shutdown")
+    async def close_client():
+        await client.aclose()
+
+    @app.post("/upload/")
+    async def upload(session_id: str = Form(...), settings: str = Form(...), files: List[UploadFile] = File(...)):
+        worker = shards[ring.node_for(session_id)]
+        response = await client.post(
+            f"{worker}/upload/",
+            data={"session_id": session_id, "settings": settings},
+            files=[("files", (file.filename, await file.read(), file.content_type)) for file in files],
+        )
+        return Response(content=response.content, status_code=response.status_code,
+                        media_type=response.headers.get("content-type"))
+
+    @app.get("/memory")
+    async def memory():
+        async def worker_memory(worker):
+            try:
+                response = await client.get(f"{worker}/memory")
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError as e:
+                return {"error": str(e)}
+        reports = await asyncio.gather(*(worker_memory(worker) for worker in worker_urls))
+        return dict(zip(worker_urls, reports))
+
+    @app.websocket("/ws_chat")
+    async def ws_chat(websocket: WebSocket):
+        await websocket.accept()
+        try:
+            # The first message (fund name and history) has no session_id, hold it until the first query
+            buffered = []
+            session_id = None
+            while session_id is None:
+                text = await websocket.receive_text()
+                buffered.append(text)
+                session_id = json.loads(text).get("session_id")
+            worker = shards[ring.node_for(session_id)]
+
+            # No open timeout, a busy worker (e.g. indexing an upload) answers late but does answer
+            async with websockets.connect(
+                    worker.replace("http", "ws", 1) + "/ws_chat", max_size=None, open_timeout=None) as upstream:
+                for text in buffered:
+                    await upstream.send(text)
+
+                async def client_to_worker():
+                    while True:
+                        await upstream.send(await websocket.receive_text())
+
+                async def worker_to_client():
+                    async for message in upstream:
+                        await websocket.send_text(message)
+
+                tasks = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+                for task in done:
+                    task.result()
+            # The worker closed the connection
+            await websocket.close()
+        except (WebSocketDisconnect, websockets.ConnectionClosed):
+            logging.info("websocket disconnect")
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Error: {str(e)}")
+            resp = ChatResponse(
+                sender=Sender.BOT,
+                message="Sorry, something went wrong. Try again.",
+                type=ResponseType.ERROR,
+            )
+            await websocket.send_text(resp.model_dump_json())
+
+    return app
+
+
+def serve(num_workers, host="0.0.0.0", port=8000, worker_base_port=None, worker_init=None, log_level="info"):
+    processes, urls = start_workers(
+        num_workers, worker_base_port or port + 1, worker_init=worker_init, log_level=log_level)
+    print(f"Routing sessions to {num_workers} workers: {', '.join(urls)}")
+    try:
+        uvicorn.run(create_router_app(urls), host=host, port=port, log_level=log_level)
+    finally:
+        stop_workers(processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chat server as session-sharded worker processes behind a router.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--worker-base-port", type=int, default=None, help="Port of the first worker, defaults to port + 1")
+    args = parser.parse_args()
+    serve(args.workers, host=args.host, port=args.port, worker_base_port=args.worker_base_port)
+
+
+if __name__ == "__main__":
+    main()
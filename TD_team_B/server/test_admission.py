@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, ProviderLimiter
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_slots_are_handed_over_in_fifo_order():
+    async def run():
+        limiter = ProviderLimiter("test", max_concurrent=1, position_interval_s=0.01)
+        order, positions = [], {}
+
+        async def call(name):
+            async def on_position(position):
+                positions.setdefault(name, []).append(position)
+            async with limiter.admit(on_position=on_position):
+                order.append(name)
+                await asyncio.sleep(0.02)
+
+        first = asyncio.create_task(call("first"))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(call(name)) for name in ("second", "third")]
+        await asyncio.gather(first, *waiting)
+        return limiter, order, positions
+
+    limiter, order, positions = asyncio.run(run())
+    assert order == ["first", "second", "third"]
+    assert positions == {"second": [1], "third": [2, 1]}
+    assert limiter.active == 0 and limiter.waiting == 0
+    assert limiter.stats["admitted"] == 3 and limiter.stats["queued"] == 2
+
+
+def test_full_queue_rejects():
+    async def run():
+        limiter = ProviderLimiter("test", max_concurrent=1, max_queue=1)
+
+        async def call():
+            async with limiter.admit():
+                await asyncio.sleep(0.02)
+
+        tasks = [asyncio.create_task(call()) for _ in range(3)]
+        return limiter, await asyncio.gather(*tasks, return_exceptions=True)
+
+    limiter, results = asyncio.run(run())
+    assert [type(result) for result in results] == [type(None), type(None), AdmissionRejected]
+    assert limiter.stats["rejected"] == 1 and limiter.active == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        limiter = ProviderLimiter("test", max_concurrent=1)
+        admitted = []
+
+        async def call(name):
+            async with limiter.admit():
+                admitted.append(name)
+                await asyncio.sleep(0.02)
+
+        first = asyncio.create_task(call("first"))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(call("cancelled"))
+        last = asyncio.create_task(call("last"))
+        await asyncio.sleep(0.005)
+        cancelled.cancel()
+        await asyncio.gather(first, last)
+        return limiter, admitted, cancelled
+
+    limiter, admitted, cancelled = asyncio.run(run())
+    assert cancelled.cancelled()
+    assert admitted == ["first", "last"]
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+def test_rate_limit_errors_are_retried():
+    async def run():
+        limiter = ProviderLimiter("test", max_retries=2, backoff_base_s=0.001)
+        attempts = []
+
+        async def flaky():
+            attempts.append(len(attempts))
+            if len(attempts) < 3:
+                raise RateLimitError()
+            return "ok"
+
+        result = await limiter.retry(flaky)
+
+        async def always_limited():
+            raise RateLimitError()
+
+        with pytest.raises(RateLimitError):
+            await limiter.retry(always_limited)
+
+        async def failing():
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            await limiter.retry(failing)
+        return limiter, result, attempts
+
+    limiter, result, attempts = asyncio.run(run())
+    assert result == "ok" and len(attempts) == 3
+    # Two retries for the flaky call, two more before giving up on the other one, none for other errors
+    assert limiter.stats["retries"] == 4
+
+
+def test_workers_share_the_provider_limits():
+    limits = {"ollama": {"max_concurrent": 2}, "cohere": {"max_concurrent": 8, "requests_per_s": 5.0, "burst": 2}}
+    workers = [AdmissionController(limits, num_workers=3, worker_index=idx) for idx in range(3)]
+
+    assert [worker.limits_for("ollama")["max_concurrent"] for worker in workers] == [1, 1, 1]
+    assert [worker.limits_for("cohere")["max_concurrent"] for worker in workers] == [3, 3, 2]
+    assert sum(worker.limits_for("cohere")["requests_per_s"] for worker in workers) == pytest.approx(5.0)
+    assert workers[0].limits_for("cohere")["burst"] == 1.0
+    assert AdmissionController(limits).limits_for("cohere") == limits["cohere"]
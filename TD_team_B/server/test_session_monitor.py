@@ -0,0 +1,57 @@
+import time
+
+import chromadb
+import pytest
+
+from session_monitor import SessionMonitor
+
+
+class NoPrefetch():
+    stats = {}
+
+    def memory_bytes(self, session_id=None):
+        return 0
+
+
+@pytest.fixture
+def client():
+    client = chromadb.EphemeralClient()
+    for session_id in ("session_a", "session_b"):
+        client.get_or_create_collection(session_id).add(ids=["0", "1"], embeddings=[[1.0, 0.0], [0.0, 1.0]])
+    yield client
+    for session_id in ("session_a", "session_b"):
+        client.delete_collection(session_id)
+
+
+def _idle_monitor(client):
+    monitor = SessionMonitor(lambda: client, NoPrefetch(), budget_bytes=0, min_idle_s=60.0)
+    for session_id in ("session_a", "session_b"):
+        monitor.touch(session_id).last_active = time.monotonic() - 120.0
+    return monitor
+
+
+def test_idle_sessions_are_evicted(client):
+    monitor = _idle_monitor(client)
+    monitor.chat_opened("session_b")
+
+    assert monitor.enforce_budget() == ["session_a"]
+    assert list(monitor._sessions) == ["session_b"]
+
+
+def test_session_used_after_the_snapshot_is_kept(client):
+    monitor = _idle_monitor(client)
+    collection = monitor._collection
+    measured = []
+
+    def query_arrives(session_id):
+        # Both sessions are measured first, then a query arrives on the event loop before the release
+        if len(measured) == 2:
+            monitor.chat_opened(session_id)
+        else:
+            measured.append(session_id)
+        return collection(session_id)
+
+    monitor._collection = query_arrives
+    assert monitor.enforce_budget() == []
+    assert sorted(monitor._sessions) == ["session_a", "session_b"]
+    assert monitor.stats["evicted"] == 0
@@ -0,0 +1,164 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from llama_index import SimpleDirectoryReader, StorageContext, VectorStoreIndex, load_index_from_storage
+
+
+class S3Ingestor():
+    '''
+    Incremental, parallel ingestion of an S3 bucket into a LlamaIndex index.
+    - Objects are listed with pagination and compared against the manifest of the last sync by ETag,
+      only new or changed objects are downloaded
+    - Downloads run on a thread pool, large objects are split into ranged GETs that run in parallel
+    - Only changed documents are inserted into (and deleted from) the persisted index
+    Pass endpoint_url (or a ready boto3 client) to run against moto or MinIO instead of AWS.
+    '''
+    def __init__(self, bucket, prefix="", persist_dir="./.s3_index_store", download_dir="./.s3_cache",
+                 max_workers=8, part_size=8 * 2**20, endpoint_url=None, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.persist_dir = persist_dir
+        self.download_dir = download_dir
+        self.max_workers = max_workers
+        self.part_size = part_size
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url)
+        self.manifest_path = os.path.join(persist_dir, "s3_manifest.json")
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        os.makedirs(self.persist_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _local_path(self, key):
+        return os.path.join(self.download_dir, self.bucket, key)
+
+    def list_objects(self):
+        objects = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/"):
+                    continue
+                objects[obj["Key"]] = {"etag": obj["ETag"].strip('"'), "size": obj["Size"]}
+        return objects
+
+    def _download_range(self, key, etag, path, start, end):
+        # IfMatch makes sure all parts come from the same version of the object
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag)
+        with open(path, "r+b") as f:
+            f.seek(start)
+            for chunk in response["Body"].iter_chunks(chunk_size=2**20):
+                f.write(chunk)
+
+    def _download(self, key, info, executor):
+        path = self._local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".part"
+        if info["size"] <= self.part_size:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+            with open(tmp_path, "wb") as f:
+                for chunk in response["Body"].iter_chunks(chunk_size=2**20):
+                    f.write(chunk)
+        else:
+            with open(tmp_path, "wb") as f:
+                f.truncate(info["size"])
+            ranges = [(start, min(start + self.part_size, info["size"]) - 1)
+                      for start in range(0, info["size"], self.part_size)]
+            parts = [executor.submit(self._download_range, key, info["etag"], tmp_path, start, end)
+                     for start, end in ranges]
+            for part in parts:
+                part.result()
+        os.replace(tmp_path, path)
+        return key
+
+    def sync(self):
+        '''
+        Download new and changed objects, returns (changed keys, deleted keys)
+        '''
+        start = time.perf_counter()
+        objects = self.list_objects()
+        changed = [key for key, info in objects.items()
+                   if self.manifest.get(key, {}).get("etag") != info["etag"] or not os.path.isfile(self._local_path(key))]
+        deleted = [key for key in self.manifest if key not in objects]
+
+        # Small objects and the ranged parts of big ones share one pool, the part pool is separate
+        # so that a big object waiting on its parts can never starve them of workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as part_executor:
+            futures = [executor.submit(self._download, key, objects[key], part_executor) for key in changed]
+            for future in as_completed(futures):
+                future.result()
+
+        print(f"S3 sync: {len(objects)} objects, {len(changed)} downloaded, {len(deleted)} deleted, "
+              f"{len(objects) - len(changed)} unchanged in {time.perf_counter() - start:.1f}s")
+        self._objects = objects
+        return changed, deleted
+
+    def load_documents(self, keys):
+        documents = {}
+        if not keys:
+            return documents
+        # The reader passes str(Path(path)) to file_metadata, which drops a leading "./", compare absolute paths
+        key_by_path = {os.path.abspath(self._local_path(key)): key for key in keys}
+        reader = SimpleDirectoryReader(
+            input_files=list(key_by_path.keys()),
+            file_metadata=lambda path: {"file_name": os.path.basename(path), "s3_key": key_by_path[os.path.abspath(path)]},
+        )
+        for doc in reader.load_data():
+            key = doc.metadata["s3_key"]
+            # Stable ids (one per page for PDFs) so that the documents can be replaced on the next sync
+            doc.id_ = f"s3://{self.bucket}/{key}#{len(documents.setdefault(key, []))}"
+            documents[key].append(doc)
+        return documents
+
+    def _update_manifest(self, objects, changed, documents, deleted):
+        for key in deleted:
+            self.manifest.pop(key, None)
+        # Keys without any document are recorded too, or they would be downloaded again on every sync
+        for key in changed:
+            self.manifest[key] = {**objects[key], "doc_ids": [doc.id_ for doc in documents.get(key, [])]}
+        self._save_manifest()
+
+    def build_or_update_index(self, service_context=None, show_progress=True):
+        '''
+        Load the persisted index and apply only what changed in the bucket, or build it from scratch
+        '''
+        if os.path.isdir(self.persist_dir) and os.path.isfile(os.path.join(self.persist_dir, "docstore.json")):
+            index = load_index_from_storage(
+                StorageContext.from_defaults(persist_dir=self.persist_dir), service_context=service_context)
+        else:
+            # No index to update, everything has to be (re-)indexed
+            self.manifest = {}
+            index = None
+
+        changed, deleted = self.sync()
+        documents = self.load_documents(changed)
+
+        if index is None:
+            index = VectorStoreIndex.from_documents(
+                [doc for docs in documents.values() for doc in docs],
+                service_context=service_context, show_progress=show_progress)
+        else:
+            for key in changed + deleted:
+                for doc_id in self.manifest.get(key, {}).get("doc_ids", []):
+                    index.delete_ref_doc(doc_id, delete_from_docstore=True)
+            for docs in documents.values():
+                for doc in docs:
+                    index.insert(doc)
+
+        index.storage_context.persist(persist_dir=self.persist_dir)
+        self._update_manifest(self._objects, changed, documents, deleted)
+        return index
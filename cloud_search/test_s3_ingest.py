@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+try:
+    from llama_index import MockEmbedding, ServiceContext
+    from s3_ingest import S3Ingestor
+except ImportError:
+    pytest.skip("s3_ingest uses the llama_index 0.9 API", allow_module_level=True)
+
+BUCKET = "rag-docs"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # The ingestor's default download and index directories are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def service_context():
+    return ServiceContext.from_defaults(embed_model=MockEmbedding(embed_dim=8), llm=None)
+
+
+def _texts(index):
+    return sorted(doc.text for doc in index.docstore.docs.values())
+
+
+def test_build_with_default_directories(client, service_context):
+    client.put_object(Bucket=BUCKET, Key="funds/a.txt", Body=b"Fund A invests in bonds.")
+    client.put_object(Bucket=BUCKET, Key="funds/b.txt", Body=b"Fund B invests in stocks.")
+    # Loads to no document at all
+    client.put_object(Bucket=BUCKET, Key="funds/empty.csv", Body=b"")
+
+    ingestor = S3Ingestor(BUCKET, client=client)
+    index = ingestor.build_or_update_index(service_context=service_context, show_progress=False)
+
+    assert _texts(index) == ["Fund A invests in bonds.", "Fund B invests in stocks."]
+    assert index.ref_doc_info[f"s3://{BUCKET}/funds/a.txt#0"].metadata["s3_key"] == "funds/a.txt"
+    assert set(ingestor.manifest) == {"funds/a.txt", "funds/b.txt", "funds/empty.csv"}
+    assert ingestor.manifest["funds/empty.csv"]["doc_ids"] == []
+
+    # Nothing changed, nothing is downloaded again, the empty object included
+    changed, deleted = S3Ingestor(BUCKET, client=client).sync()
+    assert changed == [] and deleted == []
+
+
+def test_update_applies_only_changes(client, service_context):
+    client.put_object(Bucket=BUCKET, Key="a.txt", Body=b"Old text of A.")
+    client.put_object(Bucket=BUCKET, Key="b.txt", Body=b"Text of B.")
+    S3Ingestor(BUCKET, client=client).build_or_update_index(service_context=service_context, show_progress=False)
+
+    client.put_object(Bucket=BUCKET, Key="a.txt", Body=b"New text of A.")
+    client.delete_object(Bucket=BUCKET, Key="b.txt")
+    client.put_object(Bucket=BUCKET, Key="c.txt", Body=b"Text of C.")
+    ingestor = S3Ingestor(BUCKET, client=client)
+    index = ingestor.build_or_update_index(service_context=service_context, show_progress=False)
+
+    assert _texts(index) == ["New text of A.", "Text of C."]
+    assert set(ingestor.manifest) == {"a.txt", "c.txt"}
+
+
+def test_ranged_download(client):
+    body = os.urandom(1000)
+    client.put_object(Bucket=BUCKET, Key="big.bin", Body=body)
+    ingestor = S3Ingestor(BUCKET, client=client, part_size=64)
+
+    changed, _ = ingestor.sync()
+
+    assert changed == ["big.bin"]
+    with open(ingestor._local_path("big.bin"), "rb") as f:
+        assert f.read() == body
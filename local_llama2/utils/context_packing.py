@@ -0,0 +1,175 @@
+# Copied to TD_team_B/server, pubmed_qa/utils and local_llama2/utils, keep the copies identical
+from functools import lru_cache
+from typing import List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.utils import get_tokenizer
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    # The tokenizer is loaded once by llama_index, counts are cached per chunk text
+    return len(get_tokenizer()(text))
+
+
+def _text_overlap(a, b, min_overlap, max_overlap):
+    # Length of the longest suffix of a that is a prefix of b
+    for size in range(min(len(a), len(b), max_overlap), min_overlap - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+class _Chunk():
+    def __init__(self, node_with_score):
+        self.node = node_with_score.node
+        self.text = node_with_score.node.get_content()
+        self.score = node_with_score.score or 0.0
+        self.start = getattr(self.node, "start_char_idx", None)
+        self.end = getattr(self.node, "end_char_idx", None)
+
+    @property
+    def source(self):
+        return (self.node.ref_doc_id or self.node.metadata.get("file_name"), self.node.metadata.get("page_label"))
+
+    def absorb(self, other, text):
+        self.text = text
+        self.score = max(self.score, other.score)
+        if self.start is not None and other.start is not None:
+            self.start, self.end = min(self.start, other.start), max(self.end, other.end)
+
+
+class ContextPacker(BaseNodePostprocessor):
+    '''
+    Packs retrieved nodes into at most token_budget tokens of context:
+    - Drops duplicate chunks and chunks contained in another one
+    - Merges chunks of the same document page that overlap (chunk_overlap) or are adjacent into one
+    - Orders the result by relevance and adds chunks until the token budget is full
+    Run it after any reranker, as the last node postprocessor.
+    '''
+    token_budget: int = Field(default=1024, description="Maximum number of context tokens.")
+    min_overlap_chars: int = Field(default=20, description="Shortest text overlap treated as chunk overlap.")
+    max_overlap_chars: int = Field(default=1000, description="Longest text overlap that is searched for.")
+    _stats: dict = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls):
+        return "ContextPacker"
+
+    @classmethod
+    def for_llm(cls, llm, reserved_tokens=0, max_budget=1024, **kwargs):
+        '''
+        Budget that fits the LLM context window next to its output and reserved_tokens (prompt, chat history)
+        '''
+        metadata = llm.metadata
+        available = metadata.context_window - (metadata.num_output or 0) - reserved_tokens
+        return cls(token_budget=max(min(max_budget, available), 64), **kwargs)
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def _merge_offsets(self, chunks):
+        # Chunks with character offsets: overlapping or touching ranges become one chunk
+        chunks = sorted(chunks, key=lambda chunk: chunk.start)
+        merged = [chunks[0]]
+        for chunk in chunks[1:]:
+            last = merged[-1]
+            if chunk.start <= last.end + 1:
+                if chunk.end > last.end:
+                    text = last.text + ("" if chunk.start <= last.end else " ") + chunk.text[max(last.end - chunk.start, 0):]
+                else:
+                    text = last.text
+                last.absorb(chunk, text)
+            else:
+                merged.append(chunk)
+        return merged
+
+    def _merge_text(self, chunks):
+        # Without offsets, find contained chunks and suffix/prefix overlaps in the text itself
+        merged = []
+        for chunk in chunks:
+            for other in merged:
+                if chunk.text in other.text:
+                    other.absorb(chunk, other.text)
+                    break
+                if other.text in chunk.text:
+                    other.absorb(chunk, chunk.text)
+                    break
+                overlap = _text_overlap(other.text, chunk.text, self.min_overlap_chars, self.max_overlap_chars)
+                if overlap:
+                    other.absorb(chunk, other.text + chunk.text[overlap:])
+                    break
+                overlap = _text_overlap(chunk.text, other.text, self.min_overlap_chars, self.max_overlap_chars)
+                if overlap:
+                    other.absorb(chunk, chunk.text + other.text[overlap:])
+                    break
+            else:
+                merged.append(chunk)
+        return merged
+
+    def _to_node(self, chunk):
+        node = chunk.node
+        if chunk.text != node.get_content():
+            node = node.copy()
+            node.set_content(chunk.text)
+            node.start_char_idx, node.end_char_idx = chunk.start, chunk.end
+        return NodeWithScore(node=node, score=chunk.score)
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+        groups = {}
+        passthrough = []
+        for node in nodes:
+            if isinstance(node.node, TextNode):
+                chunk = _Chunk(node)
+                groups.setdefault(chunk.source, []).append(chunk)
+            else:
+                passthrough.append(node)
+
+        chunks = []
+        for group in groups.values():
+            group.sort(key=lambda chunk: -chunk.score)
+            if all(chunk.start is not None and chunk.end is not None for chunk in group):
+                group = self._merge_offsets(group)
+            # A chunk can bridge two chunks that were merged separately, repeat until nothing changes
+            while True:
+                merged = self._merge_text(group)
+                if len(merged) == len(group):
+                    break
+                group = merged
+            chunks += merged
+
+        # Identical text can also come from different documents
+        unique = {}
+        for chunk in sorted(chunks, key=lambda chunk: -chunk.score):
+            unique.setdefault(" ".join(chunk.text.split()), chunk)
+
+        packed = []
+        used = 0
+        for node in sorted((self._to_node(chunk) for chunk in unique.values()), key=lambda node: -(node.score or 0.0)):
+            tokens = count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if used + tokens <= self.token_budget:
+                packed.append(node)
+                used += tokens
+            elif not packed:
+                # The most relevant chunk alone is over budget, keep the share of it that fits
+                text = node.node.get_content()
+                node = NodeWithScore(node=node.node.copy(), score=node.score)
+                node.node.set_content(text[:len(text) * self.token_budget // tokens])
+                packed.append(node)
+                used = self.token_budget
+
+        self._stats = {"nodes_in": len(nodes), "nodes_out": len(packed) + len(passthrough), "tokens": used,
+                       "tokens_in": sum(count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+                                        for node in nodes)}
+        print(f"Context packing: {self._stats['nodes_in']} -> {self._stats['nodes_out']} nodes, "
+              f"{self._stats['tokens_in']} -> {self._stats['tokens']} tokens (budget {self.token_budget})")
+        return packed + passthrough
@@ -1,9 +1,12 @@
-from llama_index.llms.huggingface import HuggingFaceLLM
+from .provider_registry import LLM_PROVIDERS
 
 class RAGLLM():
     '''
     LlamaIndex supports OpenAI, Cohere, AI21 and HuggingFace LLMs
     https://docs.llamaindex.ai/en/stable/module_guides/models/llms/usage_custom.html
+    Available llm types are the ones in LLM_PROVIDERS: 'local' (HuggingFace), 'local_batched' (HuggingFace with
+    continuous batching of concurrent prompts), 'openai', 'cohere', 'ollama', 'llamacpp' (quantized GGUF on CPU)
+    and 'openai_like' (any local OpenAI-compatible endpoint)
     '''
     def __init__(self, llm_type, llm_name):
         self.llm_type = llm_type
@@ -12,22 +15,28 @@ class RAGLLM():
 
     def load_model(self, **kwargs):
         print(f'Loading {self.llm_type} LLM model ...')
-        gen_arg_keys = ['temperature', 'top_p', 'top_k', 'do_sample']
-        gen_kwargs = {k: v for k, v in kwargs.items() if k in gen_arg_keys}
-        if self.llm_type == 'local':
-            # Using local HuggingFace LLM stored at /model-weights
-            llm = HuggingFaceLLM(
-                tokenizer_name=f"{self.local_model_path}/{self.llm_name}",
-                model_name=f"{self.local_model_path}/{self.llm_name}",
-                device_map="auto",
-                context_window=4096,
-                max_new_tokens=kwargs['max_new_tokens'],
-                generate_kwargs=gen_kwargs,
-                # model_kwargs={"torch_dtype": torch.float16, "load_in_8bit": True},
-            )
-        elif self.llm_type == 'openai':
-            # TODO - Add open ai llm
-            # llm = OpenAI()
-            raise NotImplementedError
+        kwargs.setdefault('model_path', self.local_model_path)
+        llm = LLM_PROVIDERS.create(self.llm_type, self.llm_name, **kwargs)
 
         return llm
+
+
+@LLM_PROVIDERS.register("local_batched")
+def batched_huggingface_llm(model_name, **kwargs):
+    # Local HuggingFace LLM stored at model_path, served in-process with continuous batching.
+    # quantization: None, "fp16", "bf16" or "int8" (8-bit bitsandbytes on GPU, dynamic int8 on CPU)
+    from .local_serving import BatchedLocalLLM, ContinuousBatchingServer
+    model_path = kwargs.get("model_path", "/model-weights")
+    max_new_tokens = kwargs.get("max_new_tokens", 256)
+    server = ContinuousBatchingServer.from_pretrained(
+        f"{model_path}/{model_name}",
+        quantization=kwargs.get("quantization"),
+        device=kwargs.get("device"),
+        max_batch_size=kwargs.get("max_batch_size", 8),
+        max_new_tokens=max_new_tokens,
+        temperature=kwargs.get("temperature", 0.0) if kwargs.get("do_sample", True) else 0.0,
+        top_p=kwargs.get("top_p", 1.0),
+        prefix_cache_bytes=kwargs.get("prefix_cache_bytes", 1 << 30),
+    )
+    return BatchedLocalLLM(
+        server, context_window=kwargs.get("context_window", 4096), num_output=max_new_tokens, model_name=model_name)
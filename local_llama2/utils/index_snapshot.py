@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.schema import NodeRelationship
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import DEFAULT_COLLECTION_DATA_SUFFIX, DEFAULT_NAMESPACE
+from llama_index.core.storage.docstore.utils import doc_to_json
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from .quantized_vector_store import QuantizedVectorStore, _normalize
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DTYPES = ("float32", "int8")
+MANIFEST_FILE = "manifest.json"
+NODES_FILE = "nodes.json.gz"
+
+
+def _sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _index_vectors(index):
+    '''
+    Node ids, nodes and float32 embeddings of an index, read from its vector store without re-embedding
+    '''
+    vector_store = index.vector_store
+    store_type = vector_store.class_name()
+    if store_type == "QuantizedVectorStore":
+        ids = list(vector_store._ids)
+        if not ids:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        elif vector_store._floats is not None:
+            embeddings = np.asarray(vector_store._floats)
+        elif vector_store.quantization == "int8":
+            # The float vectors are not kept without re-ranking, the int8 codes are the closest to them
+            embeddings = np.asarray(vector_store._codes, dtype=np.float32) * vector_store._scale
+        else:
+            raise ValueError('A binary QuantizedVectorStore without re-ranking keeps no vectors to export')
+    elif store_type == "SimpleVectorStore":
+        ids = list(vector_store.data.embedding_dict)
+        embeddings = np.asarray([vector_store.data.embedding_dict[node_id] for node_id in ids], dtype=np.float32)
+    elif store_type == "ChromaVectorStore":
+        # Chroma keeps the node text and metadata next to the vectors, the index docstore is empty
+        results = vector_store.client.get(include=["embeddings", "documents", "metadatas"])
+        ids = results["ids"]
+        embeddings = np.asarray(results["embeddings"], dtype=np.float32)
+        nodes = []
+        for text, metadata in zip(results["documents"], results["metadatas"]):
+            node = metadata_dict_to_node(metadata)
+            node.set_content(text)
+            nodes.append(node)
+        return ids, nodes, embeddings
+    else:
+        raise NotImplementedError(f'Incorrect vector store for snapshots - {store_type}')
+    return ids, index.docstore.get_nodes(ids), embeddings
+
+
+def export_snapshot(index, snapshot_dir, dtype="float32", model_id=None):
+    '''
+    Write an index to snapshot_dir in a portable format:
+    - vectors.npy: normalized embeddings as one contiguous float32 array, or int8 codes.npy and scale.npy
+    - nodes.json.gz: node text, metadata and relationships as gzip compressed columns
+    - manifest.json: embedding model id, counts and a sha256 checksum of every file
+    '''
+    if dtype not in SNAPSHOT_DTYPES:
+        raise NotImplementedError(f'Incorrect snapshot dtype - {dtype}')
+    start = time.perf_counter()
+    ids, nodes, embeddings = _index_vectors(index)
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    vectors = _normalize(embeddings) if len(ids) else embeddings
+    if dtype == "int8":
+        # Same per-dimension scalar quantization as QuantizedVectorStore
+        scale = np.maximum(np.abs(vectors).max(axis=0), 1e-6) / 127.0
+        np.save(os.path.join(snapshot_dir, "codes.npy"), np.clip(np.round(vectors / scale), -127, 127).astype(np.int8))
+        np.save(os.path.join(snapshot_dir, "scale.npy"), scale.astype(np.float32))
+        files = ["codes.npy", "scale.npy", NODES_FILE]
+    else:
+        np.save(os.path.join(snapshot_dir, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        files = ["vectors.npy", NODES_FILE]
+
+    # One list per field instead of one dict per node, similar values sit together and compress better
+    rows = [doc_to_json(node) for node in nodes]
+    fields = sorted({field for row in rows for field in row["__data__"] if field != "embedding"})
+    columns = {"__type__": [row["__type__"] for row in rows]}
+    columns.update({field: [row["__data__"].get(field) for row in rows] for field in fields})
+    with gzip.open(os.path.join(snapshot_dir, NODES_FILE), "wt", encoding="utf-8") as f:
+        json.dump(columns, f)
+
+    if model_id is None:
+        model_id = getattr(getattr(index, "_embed_model", None), "model_name", None)
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "model_id": model_id,
+        "dtype": dtype,
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if len(ids) else 0,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": {name: {"bytes": os.path.getsize(os.path.join(snapshot_dir, name)),
+                         "sha256": _sha256(os.path.join(snapshot_dir, name))} for name in files},
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    size = sum(entry["bytes"] for entry in manifest["files"].values())
+    print(f"Exported {len(ids)} nodes ({dtype}, {size / 2**20:.1f} MiB) to {snapshot_dir} in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+def import_snapshot(snapshot_dir, embed_model=None, verify=True):
+    '''
+    Load a snapshot as a VectorStoreIndex without re-embedding. The vectors are memory-mapped, so only the
+    pages a query touches are read. embed_model embeds the queries and must be the model of the snapshot.
+    '''
+    start = time.perf_counter()
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    if manifest["version"] != SNAPSHOT_VERSION:
+        raise NotImplementedError(f'Incorrect snapshot version - {manifest["version"]}')
+    model_name = getattr(embed_model, "model_name", None)
+    if embed_model is not None and manifest["model_id"] and model_name != manifest["model_id"]:
+        raise ValueError(f'Snapshot was embedded with {manifest["model_id"]}, not {model_name}')
+    if verify:
+        for name, entry in manifest["files"].items():
+            if _sha256(os.path.join(snapshot_dir, name)) != entry["sha256"]:
+                raise ValueError(f'Checksum mismatch for {os.path.join(snapshot_dir, name)}')
+
+    with gzip.open(os.path.join(snapshot_dir, NODES_FILE), "rt", encoding="utf-8") as f:
+        columns = json.load(f)
+    node_types = columns.pop("__type__")
+    # An empty index is exported without any field column
+    ids = columns.get("id_", [])
+    source = NodeRelationship.SOURCE.value
+    ref_doc_ids = [((relationships or {}).get(source) or {}).get("node_id")
+                   for relationships in columns.get("relationships", [])]
+    # The docstore keeps the rows as stored and parses a node only when a query returns it,
+    # building 100k pydantic nodes up front would take longer than the rest of the import
+    rows = {node_id: {"__type__": node_type, "__data__": {field: values[idx] for field, values in columns.items()}}
+            for idx, (node_id, node_type) in enumerate(zip(ids, node_types))}
+    docstore = SimpleDocumentStore.from_dict({f"{DEFAULT_NAMESPACE}{DEFAULT_COLLECTION_DATA_SUFFIX}": rows})
+
+    vector_store = QuantizedVectorStore(quantization=manifest["dtype"], rescore_multiplier=0)
+    vector_store._ids = ids
+    vector_store._ref_doc_ids = ref_doc_ids
+    if ids and manifest["dtype"] == "int8":
+        vector_store._codes = np.load(os.path.join(snapshot_dir, "codes.npy"), mmap_mode="r")
+        vector_store._scale = np.load(os.path.join(snapshot_dir, "scale.npy"))
+    elif ids:
+        vector_store._floats = np.load(os.path.join(snapshot_dir, "vectors.npy"), mmap_mode="r")
+
+    storage_context = StorageContext.from_defaults(vector_store=vector_store, docstore=docstore)
+    index_struct = IndexDict(nodes_dict={node_id: node_id for node_id in ids})
+    storage_context.index_store.add_index_struct(index_struct)
+    index = VectorStoreIndex(index_struct=index_struct, storage_context=storage_context, embed_model=embed_model)
+    print(f"Imported {len(ids)} nodes from {snapshot_dir} in {time.perf_counter() - start:.1f}s")
+    return index
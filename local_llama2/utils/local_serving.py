@@ -0,0 +1,385 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any
+
+import torch
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import CompletionResponse, CompletionResponseGen, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+QUANTIZATION_TYPES = (None, "fp16", "bf16", "int8")
+
+
+def _cache_to_tuples(past):
+    # transformers returns legacy tuples, a DynamicCache with key_cache/value_cache lists or, in newer versions, layers
+    if isinstance(past, tuple):
+        return past
+    if hasattr(past, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past.layers)
+    return tuple(zip(past.key_cache, past.value_cache))
+
+
+def _tuples_to_cache(past):
+    if past is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return past
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(past)
+
+
+def _left_pad(tensor, length, dim):
+    pad = length - tensor.shape[dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+def _kv_bytes(past):
+    return sum(k.element_size() * k.nelement() + v.element_size() * v.nelement() for k, v in past)
+
+
+def _common_prefix(a, b):
+    size = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        size += 1
+    return size
+
+
+class PrefixKVCache():
+    '''
+    KV states of prompt prefixes keyed by their token ids, for one model. The least recently used prefixes
+    are evicted once the cached tensors take more than max_bytes. A prefix gets cached when a prompt shares
+    at least min_prefix_tokens leading tokens with one of the last history prompts, e.g. a system prompt or
+    a QA template, so templates are detected without registering them.
+    '''
+    def __init__(self, max_bytes=1 << 30, min_prefix_tokens=32, history=16):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.bytes = 0
+        self.stats = {"lookups": 0, "hits": 0, "prompt_tokens": 0, "tokens_reused": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._recent = deque(maxlen=history)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, ids):
+        '''
+        Longest cached prefix of ids (leaving at least one token to prefill) and its KV state
+        '''
+        best = None
+        for prefix in self._entries:
+            if len(prefix) < len(ids) and (best is None or len(prefix) > len(best)) and tuple(ids[:len(prefix)]) == prefix:
+                best = prefix
+        if best is None:
+            return None, None
+        self._entries.move_to_end(best)
+        return best, self._entries[best][0]
+
+    def candidate(self, ids, cached_length=0):
+        '''
+        Longest prefix shared with a recent prompt, if it is worth caching on top of cached_length tokens
+        '''
+        common = max((_common_prefix(ids, other) for other in self._recent), default=0)
+        common = min(common, len(ids) - 1)
+        if common < max(self.min_prefix_tokens, cached_length + self.min_prefix_tokens):
+            return None
+        return tuple(ids[:common])
+
+    def put(self, prefix, past):
+        size = _kv_bytes(past)
+        if size > self.max_bytes:
+            return False
+        if prefix in self._entries:
+            self.bytes -= self._entries.pop(prefix)[1]
+        self._entries[prefix] = (past, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.stats["evictions"] += 1
+        return True
+
+    def record(self, ids, reused):
+        self._recent.append(ids)
+        self.stats["lookups"] += 1
+        self.stats["hits"] += int(reused > 0)
+        self.stats["prompt_tokens"] += len(ids)
+        self.stats["tokens_reused"] += reused
+
+
+class _Request():
+    def __init__(self, input_ids, max_new_tokens):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.stats = {"prompt_tokens": len(input_ids)}
+        self.output_ids = []
+        self.next_token = None
+        self.done = False
+        self.future = Future()
+        self.tokens = Queue() # Generated token ids for streaming, None once done
+
+
+class ContinuousBatchingServer():
+    '''
+    In-process generation service for local HuggingFace models with continuous batching:
+    - Prompts submitted from any thread are queued, a scheduler thread decodes one token for all active
+      sequences per forward pass
+    - New prompts join the running batch at the next step and finished ones leave it, nobody waits for
+      the longest generation of a batch
+    - The KV state of prompt prefixes shared between prompts (e.g. the Llama-2 [INST] <<SYS>> and QA
+      templates) is computed once and kept in a PrefixKVCache of at most prefix_cache_bytes, only the rest
+      of the prompt is prefilled. Reused tokens and prefill time are recorded in the stats of every request.
+    - Weights can be loaded in fp16/bf16 or int8 (bitsandbytes on GPU, dynamic quantization on CPU)
+    Throughput is tracked in stats and printed every time the batch runs empty.
+    '''
+    def __init__(self, model, tokenizer, device="cpu", max_batch_size=8, max_new_tokens=256,
+                 temperature=0.0, top_p=1.0, min_prefix_tokens=32, prefix_cache_bytes=1 << 30):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.prefix_cache = PrefixKVCache(max_bytes=prefix_cache_bytes, min_prefix_tokens=min_prefix_tokens)
+        self.stats = {"requests": 0, "prompt_tokens": 0, "prefix_tokens_reused": 0, "generated_tokens": 0,
+                      "decode_steps": 0, "batched_sequences": 0, "busy_s": 0.0}
+
+        self._queue = Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Scheduler thread state: active requests and their left-padded batch KV cache and attention mask
+        self._active = []
+        self._past = None
+        self._mask = None
+
+    @classmethod
+    def from_pretrained(cls, model_path, quantization=None, device=None, **kwargs):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        if quantization not in QUANTIZATION_TYPES:
+            raise NotImplementedError(f'Incorrect quantization type - {quantization}')
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        model_kwargs = {}
+        if quantization in ("fp16", "bf16"):
+            model_kwargs["torch_dtype"] = torch.float16 if quantization == "fp16" else torch.bfloat16
+        elif quantization == "int8" and device != "cpu":
+            from transformers import BitsAndBytesConfig
+            model_kwargs.update(quantization_config=BitsAndBytesConfig(load_in_8bit=True), device_map="auto")
+
+        model = AutoModelForCausalLM.from_pretrained(model_path, **model_kwargs)
+        if quantization == "int8" and device == "cpu":
+            # int8 weights and matmuls for the linear layers, 4x smaller than float32 and faster on CPU
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif "device_map" not in model_kwargs:
+            model = model.to(device)
+        return cls(model, AutoTokenizer.from_pretrained(model_path), device=device, **kwargs)
+
+    @property
+    def tokens_per_s(self):
+        return self.stats["generated_tokens"] / max(self.stats["busy_s"], 1e-9)
+
+    def submit(self, prompt, max_new_tokens=None):
+        request = _Request(self.tokenizer(prompt)["input_ids"], max_new_tokens or self.max_new_tokens)
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put(request)
+        return request
+
+    def generate(self, prompt, max_new_tokens=None):
+        return self.submit(prompt, max_new_tokens).future.result()
+
+    def stream(self, prompt, max_new_tokens=None):
+        return self.iter_text(self.submit(prompt, max_new_tokens))
+
+    def iter_text(self, request):
+        token_ids, text = [], ""
+        while True:
+            token = request.tokens.get()
+            if token is None:
+                break
+            token_ids.append(token)
+            # Decode the whole output, tokens are not always printable on their own
+            new_text = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+            if len(new_text) > len(text):
+                yield new_text, new_text[len(text):]
+                text = new_text
+        request.future.result()
+
+    def _forward(self, input_ids, attention_mask, past, position_ids=None):
+        out = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                         past_key_values=_tuples_to_cache(past), use_cache=True)
+        return out.logits[:, -1, :], _cache_to_tuples(out.past_key_values)
+
+    def _find_prefix(self, ids):
+        # Returns the number of prompt tokens covered by a cached KV state, and that state
+        prefix, past = self.prefix_cache.lookup(ids)
+        cached = len(prefix) if prefix else 0
+        longer = self.prefix_cache.candidate(ids, cached_length=cached)
+        if longer is not None:
+            # Extend the cached prefix (or start from scratch) up to the prefix shared with a recent prompt
+            _, longer_past = self._forward(
+                torch.tensor([longer[cached:]], device=self.device),
+                torch.ones((1, len(longer)), dtype=torch.long, device=self.device), past)
+            self.prefix_cache.put(longer, longer_past)
+            cached, past = len(longer), longer_past
+        return cached, past
+
+    def _sample(self, logits):
+        if self.temperature <= 0:
+            return logits.argmax(dim=-1).tolist()
+        probs = torch.softmax(logits.float() / self.temperature, dim=-1)
+        if self.top_p < 1.0:
+            sorted_probs, indices = probs.sort(dim=-1, descending=True)
+            sorted_probs = sorted_probs * (sorted_probs.cumsum(dim=-1) - sorted_probs < self.top_p)
+            probs = torch.zeros_like(probs).scatter(-1, indices, sorted_probs)
+        return torch.multinomial(probs, 1).squeeze(-1).tolist()
+
+    def _emit(self, request, token):
+        if token == self.tokenizer.eos_token_id:
+            request.done = True
+        else:
+            request.output_ids.append(token)
+            request.next_token = token
+            request.tokens.put(token)
+            request.done = len(request.output_ids) >= request.max_new_tokens
+        if request.done:
+            self.stats["generated_tokens"] += len(request.output_ids)
+            request.tokens.put(None)
+            request.future.set_result(self.tokenizer.decode(request.output_ids, skip_special_tokens=True))
+
+    def _prefill(self, request):
+        ids = request.input_ids
+        start_time = time.perf_counter()
+        start, past = self._find_prefix(ids)
+        logits, past = self._forward(
+            torch.tensor([ids[start:]], device=self.device), torch.ones((1, len(ids)), dtype=torch.long, device=self.device), past)
+        self.prefix_cache.record(ids, start)
+        request.stats.update(prefix_tokens_reused=start, prefill_s=time.perf_counter() - start_time)
+        self.stats["requests"] += 1
+        self.stats["prompt_tokens"] += len(ids)
+        self.stats["prefix_tokens_reused"] += start
+        self._emit(request, self._sample(logits)[0])
+        if request.done:
+            return
+        mask = torch.ones((1, len(ids)), dtype=torch.long, device=self.device)
+        if self._past is None:
+            self._active, self._past, self._mask = [request], past, mask
+            return
+        # Join the running batch: left-pad the shorter side to a common length and stack
+        length = max(self._mask.shape[1], len(ids))
+        self._past = tuple(
+            (torch.cat([_left_pad(k, length, 2), _left_pad(new_k, length, 2)]),
+             torch.cat([_left_pad(v, length, 2), _left_pad(new_v, length, 2)]))
+            for (k, v), (new_k, new_v) in zip(self._past, past))
+        self._mask = torch.cat([_left_pad(self._mask, length, 1), _left_pad(mask, length, 1)])
+        self._active.append(request)
+
+    def _step(self):
+        input_ids = torch.tensor([[request.next_token] for request in self._active], device=self.device)
+        # Each row continues at its own position, left padding is not counted
+        position_ids = self._mask.sum(dim=1, keepdim=True)
+        self._mask = torch.cat([self._mask, self._mask.new_ones((len(self._active), 1))], dim=1)
+        logits, self._past = self._forward(input_ids, self._mask, self._past, position_ids=position_ids)
+        self.stats["decode_steps"] += 1
+        self.stats["batched_sequences"] += len(self._active)
+        for request, token in zip(self._active, self._sample(logits)):
+            self._emit(request, token)
+
+        keep = [idx for idx, request in enumerate(self._active) if not request.done]
+        if not keep:
+            self._active, self._past, self._mask = [], None, None
+            return
+        if len(keep) < len(self._active):
+            rows = torch.tensor(keep, device=self.device)
+            self._active = [self._active[idx] for idx in keep]
+            self._mask = self._mask[rows]
+            # Drop the padding columns nobody left in the batch needs
+            first = int((self._mask.sum(dim=0) > 0).nonzero()[0])
+            self._mask = self._mask[:, first:]
+            self._past = tuple((k[rows][:, :, first:], v[rows][:, :, first:]) for k, v in self._past)
+
+    def _run(self):
+        while True:
+            new = [] if self._active else [self._queue.get()]
+            while len(self._active) + len(new) < self.max_batch_size:
+                try:
+                    new.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            start = time.perf_counter()
+            try:
+                with torch.inference_mode():
+                    for request in new:
+                        self._prefill(request)
+                    if self._active:
+                        self._step()
+            except Exception as e:
+                for request in self._active + new:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                        request.tokens.put(None)
+                self._active, self._past, self._mask = [], None, None
+            self.stats["busy_s"] += time.perf_counter() - start
+            if not self._active and self._queue.empty():
+                self.report()
+
+    def report(self):
+        stats = self.stats
+        print(f"Local LLM: {stats['requests']} requests, {stats['generated_tokens']} tokens generated "
+              f"at {self.tokens_per_s:.1f} tokens/s, "
+              f"avg batch {stats['batched_sequences'] / max(stats['decode_steps'], 1):.1f}, "
+              f"{stats['prefix_tokens_reused']}/{stats['prompt_tokens']} prompt tokens from the prefix cache "
+              f"({len(self.prefix_cache)} prefixes, {self.prefix_cache.bytes / 2**20:.1f} MB)")
+
+
+class BatchedLocalLLM(CustomLLM):
+    '''
+    LlamaIndex LLM backed by a ContinuousBatchingServer, concurrent complete() calls
+    (e.g. evaluate with max_workers > 1) are decoded together
+    '''
+    context_window: int = Field(default=4096, description="Context window of the model.")
+    num_output: int = Field(default=256, description="Maximum number of generated tokens.")
+    model_name: str = Field(default="local", description="Name of the model.")
+    _server: Any = PrivateAttr()
+
+    def __init__(self, server, **kwargs):
+        super().__init__(**kwargs)
+        self._server = server
+
+    @classmethod
+    def class_name(cls):
+        return "BatchedLocalLLM"
+
+    @property
+    def server(self):
+        return self._server
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.num_output, model_name=self.model_name)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        request = self._server.submit(prompt, max_new_tokens=self.num_output)
+        text = request.future.result()
+        return CompletionResponse(text=text, additional_kwargs=dict(request.stats))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        request = self._server.submit(prompt, max_new_tokens=self.num_output)
+        for text, delta in self._server.iter_text(request):
+            yield CompletionResponse(text=text, delta=delta, additional_kwargs=dict(request.stats))
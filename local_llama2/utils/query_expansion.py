@@ -0,0 +1,136 @@
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+MULTI_QUERY_PROMPT = (
+    "You are helping to search a document collection. Write {num_queries} different rephrasings of the "
+    "question below that use other words and synonyms but ask for the same information. "
+    "Write one rephrasing per line, without numbering or any other text.\n"
+    "Question: {query}\n"
+)
+
+HYDE_PROMPT = (
+    "Write a short passage, as it would appear in a relevant document, that answers the question below.\n"
+    "Question: {query}\n"
+    "Passage: "
+)
+
+
+def _query_texts(embed_model, queries):
+    '''
+    The queries in the form a get_text_embedding_batch call embeds them as queries, or None if the model has none
+    '''
+    if not type(embed_model).__module__.startswith("llama_index.embeddings.huggingface"):
+        return None
+    try:
+        from llama_index.embeddings.huggingface.utils import format_query, get_text_instruct_for_model_name
+    except ImportError:
+        return None
+    # HuggingFace models embed a query as the text behind the model's query instruction (BGE, E5, ...).
+    # Models that also put an instruction in front of documents (Instructor) cannot share the call
+    if embed_model.text_instruction or get_text_instruct_for_model_name(embed_model.model_name):
+        return None
+    return [format_query(query, embed_model.model_name, embed_model.query_instruction) for query in queries]
+
+
+class QueryExpansionRetriever(BaseRetriever):
+    '''
+    Multi-query / HyDE retrieval on top of a VectorIndexRetriever:
+    - mode 'multi_query': one LLM call writes num_queries rephrasings of the question
+    - mode 'hyde': one LLM call writes a hypothetical answer passage, which is searched instead of the question
+    The question and all its expansions are embedded in a single batched request, as queries except the HyDE
+    passage, searched in parallel and the result lists are fused with reciprocal rank fusion. Providers that only
+    embed queries one by one (e.g. Cohere search_query) get parallel requests instead. Expansions and their
+    embeddings are cached per question, so a repeated question costs no LLM or embedding call.
+    '''
+    def __init__(self, vector_retriever, mode="multi_query", num_queries=3, llm=None, rrf_k=60,
+                 max_workers=4, cache_size=1024):
+        if mode not in ("multi_query", "hyde"):
+            raise NotImplementedError(f'Incorrect query expansion mode - {mode}')
+        self.vector_retriever = vector_retriever
+        self.mode = mode
+        self.num_queries = num_queries
+        self._llm = llm
+        self.rrf_k = rrf_k
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "llm_calls": 0, "embedding_requests": 0}
+        super().__init__()
+
+    @property
+    def llm(self):
+        return self._llm or Settings.llm
+
+    @property
+    def embed_model(self):
+        return self.vector_retriever._embed_model
+
+    def expand(self, query_str):
+        if self.mode == "hyde":
+            passage = self.llm.complete(HYDE_PROMPT.format(query=query_str)).text.strip()
+            return [passage] if passage else []
+        text = self.llm.complete(MULTI_QUERY_PROMPT.format(query=query_str, num_queries=self.num_queries)).text
+        queries = []
+        for line in text.splitlines():
+            # Drop any numbering or bullets the LLM added anyway
+            line = re.sub(r"^\s*(\d+[.)]|[-*•])\s*", "", line).strip()
+            if line and line.lower() != query_str.lower() and line not in queries:
+                queries.append(line)
+        return queries[:self.num_queries]
+
+    def _expanded_queries(self, query_str):
+        key = (self.mode, self.num_queries, query_str)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return self._cache[key]
+
+        texts = [query_str] + self.expand(query_str)
+        # Rephrasings are queries, embedded with the query instruction of models like BGE,
+        # a HyDE passage is searched as the document it imitates
+        passages = texts[1:] if self.mode == "hyde" else []
+        queries = texts[:len(texts) - len(passages)]
+        query_texts = _query_texts(self.embed_model, queries)
+        if query_texts is not None:
+            embeddings = self.embed_model.get_text_embedding_batch(query_texts + passages)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                embeddings = list(executor.map(self.embed_model.get_query_embedding, queries))
+            if passages:
+                embeddings += self.embed_model.get_text_embedding_batch(passages)
+        expanded = list(zip(texts, embeddings))
+        with self._lock:
+            self.stats["llm_calls"] += 1
+            self.stats["embedding_requests"] += 1 if query_texts is not None else len(queries) + bool(passages)
+            self._cache[key] = expanded
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return expanded
+
+    def _fuse(self, result_lists):
+        fused = {}
+        for results in result_lists:
+            for rank, node in enumerate(results):
+                score = 1.0 / (self.rrf_k + rank + 1)
+                if node.node.node_id in fused:
+                    fused[node.node.node_id][1] += score
+                else:
+                    fused[node.node.node_id] = [node.node, score]
+        ranked = sorted(fused.values(), key=lambda item: -item[1])
+        return [NodeWithScore(node=node, score=score) for node, score in ranked[:self.vector_retriever._similarity_top_k]]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        expanded = self._expanded_queries(query_bundle.query_str)
+        bundles = [QueryBundle(query_str=text, embedding=embedding) for text, embedding in expanded]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            result_lists = list(executor.map(self.vector_retriever.retrieve, bundles))
+        return self._fuse(result_lists)
@@ -19,12 +19,31 @@ class RAGIndex():
         self._persist_dir = f'./.{db_type}_index_store/'
 
     def create_index(self, docs, save=True, **kwargs):
-        # Only supports ChromaDB and Weaviate as of now
-        if self.db_type == 'chromadb':
+        if self.db_type == 'snapshot':
+            # db_name is a directory written by index_snapshot.export_snapshot, the vectors are memory-mapped
+            # and nothing is embedded again, kwargs: embed_model (for the queries), verify
+            from .index_snapshot import import_snapshot
+            return import_snapshot(self.db_name, embed_model=kwargs.get("embed_model"), verify=kwargs.get("verify", True))
+
+        # Only supports ChromaDB and Weaviate as of now, plus a local quantized store
+        if self.db_type == 'quantized':
+            # Local store with int8/binary compressed embeddings, kwargs: quantization, rescore_multiplier
+            from .quantized_vector_store import QuantizedVectorStore
+            if os.path.isdir(self._persist_dir):
+                vector_store = QuantizedVectorStore.from_persist_dir(self._persist_dir)
+            else:
+                vector_store = QuantizedVectorStore(
+                    quantization=kwargs.get("quantization", "int8"),
+                    rescore_multiplier=kwargs.get("rescore_multiplier", 4))
+        elif self.db_type == 'chromadb':
+            import chromadb
+            from llama_index.vector_stores.chroma import ChromaVectorStore
             chroma_client = chromadb.Client()
             chroma_collection = chroma_client.create_collection(name=self.db_name)
             vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
         elif self.db_type == 'weaviate':
+            import weaviate
+            from llama_index.vector_stores.weaviate import WeaviateVectorStore
             with open(Path.home() / ".weaviate.key", "r") as f:
                 weaviate_api_key = f.read().rstrip("\n")
             weaviate_client = weaviate.Client(
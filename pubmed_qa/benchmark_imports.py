@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["utils.hosting_utils", "utils.rag_utils", "utils.storage_utils"]
+
+# Top-level packages that should only be loaded once their code path is chosen
+HEAVY_PACKAGES = [
+    "torch", "transformers", "sentence_transformers", "openai", "cohere", "langchain_community",
+    "langchain_openai", "ragas", "datasets", "rank_bm25", "chromadb", "weaviate", "llama_cpp",
+]
+
+# Runs in a fresh interpreter so every measurement is a true cold import
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy_loaded": heavy}}))
+"""
+
+
+def measure(module, path, repeats):
+    timings = []
+    heavy_loaded = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_PACKAGES)],
+            cwd=path, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            return {"module": module, "error": result.stderr.strip().splitlines()[-1]}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(probe["seconds"])
+        heavy_loaded = probe["heavy_loaded"]
+    return {
+        "module": module,
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "heavy_loaded": heavy_loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cold import time of the RAG utility modules and which heavy SDKs they pull in. "
+                    "For the chat server run: --path ../TD_team_B/server --modules rag_session main")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--path", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory the modules are imported from")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [measure(module, args.path, args.repeats) for module in args.modules]
+    for result in results:
+        if "error" in result:
+            print(f"{result['module']:<25} failed: {result['error']}")
+        else:
+            print(f"{result['module']:<25} {result['median_seconds']:.3f}s (min {result['min_seconds']:.3f}s) "
+                  f"heavy: {', '.join(result['heavy_loaded']) or '-'}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
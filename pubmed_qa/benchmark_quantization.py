@@ -0,0 +1,129 @@
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from task_dataset import PubMedQATaskDataset
+from utils.quantized_vector_store import QuantizedVectorStore
+from utils.rag_utils import DocumentReader, RAGEmbedding, retriever_acc
+
+# (quantization, rescore_multiplier), float32 is the exact baseline the others are compared to
+CONFIGURATIONS = [("float32", 0), ("int8", 0), ("int8", 4), ("binary", 0), ("binary", 4), ("binary", 10)]
+
+
+def embed(embed_model, texts, batch_size):
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings += embed_model.get_text_embedding_batch(texts[start:start + batch_size])
+    return embeddings
+
+
+def exact_search(nodes, query_embeddings, top_k):
+    # Brute-force cosine top_k, the ground truth for recall@k
+    ids = [node.node_id for node in nodes]
+    matrix = np.asarray([node.embedding for node in nodes], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    exact = []
+    for query_embedding in query_embeddings:
+        scores = matrix @ np.asarray(query_embedding, dtype=np.float32)
+        exact.append([ids[i] for i in np.argsort(-scores)[:top_k]])
+    return exact
+
+
+def benchmark(quantization, rescore_multiplier, nodes, query_embeddings, exact_ids, data, node_docs, args):
+    with tempfile.TemporaryDirectory() as persist_dir:
+        start = time.perf_counter()
+        store = QuantizedVectorStore(quantization=quantization, rescore_multiplier=rescore_multiplier)
+        store.add(nodes)
+        # Adding compresses the vectors, persisting writes them and maps the float vectors from the persisted file
+        store.persist(f"{persist_dir}/default__vector_store.json")
+        build_time = time.perf_counter() - start
+
+        latencies, recalls, hits, results = [], [], [], []
+        for query_embedding in query_embeddings:
+            start = time.perf_counter()
+            result = store.query(VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=args.top_k))
+            latencies.append(time.perf_counter() - start)
+            results.append(result.ids)
+        memory = store.memory_bytes()
+
+    for ids, exact, elm in zip(results, exact_ids, data):
+        recalls.append(len(set(ids) & set(exact)) / len(exact))
+        hits.append(retriever_acc(elm["id"], [node_docs[node_id] for node_id in ids]))
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "quantization": quantization,
+        "rescore": rescore_multiplier,
+        "memory_mb": memory / 2**20,
+        "bytes_per_vector": memory / len(nodes),
+        "build_time_s": build_time,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        f"recall@{args.top_k}": float(np.mean(recalls)),
+        f"hit@{args.top_k}": float(np.mean(hits)),
+    }
+
+
+def print_table(results):
+    columns = list(results[0].keys())
+    widths = [max(len(col), 10) for col in columns]
+    print(" | ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    print("-+-".join("-" * width for width in widths))
+    for result in results:
+        cells = [f"{value:.4f}" if isinstance(value, float) else str(value) for value in result.values()]
+        print(" | ".join(cell.ljust(width) for cell, width in zip(cells, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory, latency and recall@k of int8/binary quantized embeddings against float32 on PubMedQA.")
+    parser.add_argument("--embed-model-type", default="hf", help="'hf' or 'hashed' (no model needed)")
+    parser.add_argument("--embed-model-name", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--num-queries", type=int, default=None, help="Limit the number of evaluation questions")
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    Settings.llm = None
+
+    print('Loading PubMed QA data ...')
+    pubmed_data = PubMedQATaskDataset('bigbio/pubmed_qa')
+    pubmed_data.mock_knowledge_base(output_dir=args.data_dir, one_file_per_sample=True)
+    data = pubmed_data.data[:args.num_queries] if args.num_queries else pubmed_data.data
+
+    docs = DocumentReader(input_dir=f"{args.data_dir}/pubmed_doc").load_data()
+    nodes = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap).get_nodes_from_documents(docs)
+    node_docs = {node.node_id: node.metadata["file_name"].split(".")[0] for node in nodes}
+    print(f'No. of documents: {len(docs)}, nodes: {len(nodes)}, queries: {len(data)}')
+
+    # Embed once, every configuration indexes the same vectors
+    embed_model = RAGEmbedding(model_type=args.embed_model_type, model_name=args.embed_model_name).load_model()
+    start = time.perf_counter()
+    for node, embedding in zip(nodes, embed(embed_model, [node.get_content() for node in nodes], args.batch_size)):
+        node.embedding = embedding
+    query_embeddings = [embed_model.get_query_embedding(elm["question"]) for elm in data]
+    print(f'Embedded nodes and queries in {time.perf_counter() - start:.1f}s')
+
+    exact_ids = exact_search(nodes, query_embeddings, args.top_k)
+    results = []
+    for quantization, rescore_multiplier in CONFIGURATIONS:
+        print(f'Benchmarking {quantization} (rescore x{rescore_multiplier}) ...')
+        results.append(benchmark(quantization, rescore_multiplier, nodes, query_embeddings, exact_ids, data, node_docs, args))
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import QueryBundle
+
+from task_dataset import PubMedQATaskDataset
+from utils.adaptive_depth import AdaptiveDepth
+from utils.rag_utils import DocumentReader, RAGEmbedding, RAGQueryEngine, retriever_acc, retriever_mrr
+
+RETRIEVER_TYPES = ["vector", "bm25", "hybrid", "reranked", "adaptive"]
+
+
+def build_retriever(retriever_type, nodes, embed_model, args):
+    '''
+    Build the index and retriever for one configuration, returns (retriever, postprocessors)
+    '''
+    index = None
+    if retriever_type in ("vector", "hybrid", "reranked", "adaptive"):
+        index = VectorStoreIndex(nodes, embed_model=embed_model)
+
+    query_engine_args = {"nodes": nodes, "tokenizer": None, "query_mode": "default", "hybrid_search_alpha": None}
+    similarity_top_k = args.top_k
+    if retriever_type == "vector":
+        engine = RAGQueryEngine("vector_index", index, args.llm_name)
+    elif retriever_type == "bm25":
+        engine = RAGQueryEngine("bm25", index, args.llm_name)
+    elif retriever_type == "hybrid":
+        engine = RAGQueryEngine("hybrid", index, args.llm_name)
+    elif retriever_type == "reranked":
+        # Retrieve a deeper candidate list and let the local cross-encoder pick the top_k
+        engine = RAGQueryEngine("vector_index", index, args.llm_name)
+        similarity_top_k = args.rerank_candidates
+        engine.set_node_postprocessors(rerank_top_k=args.top_k, reranker_type="sentence_transformer")
+    elif retriever_type == "adaptive":
+        # As "reranked", but keeps up to top_k nodes per query and skips the cross-encoder for clear top hits
+        engine = RAGQueryEngine("vector_index", index, args.llm_name)
+        similarity_top_k = args.rerank_candidates
+        engine.set_node_postprocessors(rerank_top_k=args.top_k, reranker_type="sentence_transformer")
+        engine.node_postprocessor = [AdaptiveDepth(reranker=engine.node_postprocessor[0], max_k=args.top_k)]
+    engine.set_retriever(similarity_top_k, **query_engine_args)
+    return engine.retriever, engine.node_postprocessor or []
+
+
+def run_queries(retriever, postprocessors, data):
+    latencies = []
+    hits = []
+    mrrs = []
+    depths = []
+    for elm in data:
+        query_str = elm["question"]
+        start = time.perf_counter()
+        nodes = retriever.retrieve(query_str)
+        for postprocessor in postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=QueryBundle(query_str))
+        latencies.append(time.perf_counter() - start)
+        depths.append(len(nodes))
+
+        candidates = [node.metadata["file_name"].split(".")[0] for node in nodes]
+        hits.append(retriever_acc(elm["id"], candidates))
+        mrrs.append(retriever_mrr(elm["id"], candidates))
+    return latencies, hits, mrrs, depths
+
+
+def benchmark(retriever_type, nodes, embed_model, data, args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    retriever, postprocessors = build_retriever(retriever_type, nodes, embed_model, args)
+    build_time = time.perf_counter() - start
+    index_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies, hits, mrrs, depths = run_queries(retriever, postprocessors, data)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "retriever": retriever_type,
+        "build_time_s": build_time,
+        "index_memory_mb": index_memory / 2**20,
+        "peak_build_memory_mb": peak_memory / 2**20,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        f"hit@{args.top_k}": float(np.mean(hits)),
+        "mrr": float(np.mean(mrrs)),
+        "avg_nodes": float(np.mean(depths)),
+    }
+
+
+def print_table(results):
+    columns = list(results[0].keys())
+    widths = [max(len(col), 10) for col in columns]
+    print(" | ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    print("-+-".join("-" * width for width in widths))
+    for result in results:
+        cells = [f"{value:.4f}" if isinstance(value, float) else str(value) for value in result.values()]
+        print(" | ".join(cell.ljust(width) for cell, width in zip(cells, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark over the PubMedQA knowledge base.")
+    parser.add_argument("--retrievers", nargs="+", default=RETRIEVER_TYPES, choices=RETRIEVER_TYPES)
+    parser.add_argument("--embed-model-type", default="hashed", help="'hashed' (no model needed) or 'hf'")
+    parser.add_argument("--embed-model-name", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--llm-name", default="Llama-2-7b-chat-hf", help="Only used to pick the prompt template")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank-candidates", type=int, default=20)
+    parser.add_argument("--num-queries", type=int, default=None, help="Limit the number of evaluation questions")
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # No LLM is needed for retrieval, make sure nothing tries to reach OpenAI
+    Settings.llm = None
+
+    print('Loading PubMed QA data ...')
+    pubmed_data = PubMedQATaskDataset('bigbio/pubmed_qa')
+    pubmed_data.mock_knowledge_base(output_dir=args.data_dir, one_file_per_sample=True)
+    data = pubmed_data.data[:args.num_queries] if args.num_queries else pubmed_data.data
+
+    docs = DocumentReader(input_dir=f"{args.data_dir}/pubmed_doc").load_data()
+    nodes = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap).get_nodes_from_documents(docs)
+    print(f'No. of documents: {len(docs)}, nodes: {len(nodes)}, queries: {len(data)}')
+
+    embed_model = RAGEmbedding(model_type=args.embed_model_type, model_name=args.embed_model_name).load_model()
+
+    results = []
+    for retriever_type in args.retrievers:
+        print(f'Benchmarking {retriever_type} retriever ...')
+        results.append(benchmark(retriever_type, nodes, embed_model, data, args))
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
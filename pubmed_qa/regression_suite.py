@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.node_parser import SentenceSplitter
+
+from utils.hosting_utils import RAGLLM
+from utils.model_recording import RECORDING_MODES, ModelRecorder
+from utils.provider_registry import EMBEDDING_PROVIDERS, LLM_PROVIDERS
+from utils.rag_utils import DocumentReader, RAGEmbedding, RAGQueryEngine, evaluate
+
+
+def load_questions(args, golden):
+    # A replayed run reuses the questions of the golden run, so it needs neither the dataset nor network access
+    if golden is not None and args.mode != "record":
+        return golden["questions"]
+    from task_dataset import PubMedQATaskDataset
+    print('Loading PubMed QA data ...')
+    pubmed_data = PubMedQATaskDataset('bigbio/pubmed_qa')
+    pubmed_data.mock_knowledge_base(output_dir=args.data_dir, one_file_per_sample=True)
+    data = pubmed_data.data[:args.num_queries] if args.num_queries else pubmed_data.data
+    return [{"id": elm["id"], "question": elm["question"], "answer": elm["answer"]} for elm in data]
+
+
+def compare(predictions, golden):
+    '''
+    Questions whose answer or retrieval hit differs from the golden run
+    '''
+    expected = {prediction["id"]: prediction for prediction in golden["predictions"]}
+    return [{"id": prediction["id"], "golden": expected.get(prediction["id"]), "now": prediction}
+            for prediction in predictions if expected.get(prediction["id"]) != prediction]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="PubMedQA evaluation against golden answers, with recorded LLM and embedding calls.")
+    parser.add_argument("--mode", default="replay", choices=RECORDING_MODES,
+                        help="'record' calls the providers and writes the golden answers, 'replay' runs offline, "
+                             "'update' records only the calls missing from the recording")
+    parser.add_argument("--replay-latency", action="store_true",
+                        help="Sleep the recorded provider time of every call, to measure the pipeline overhead")
+    parser.add_argument("--recording", default="./recordings/pubmed_qa.sqlite")
+    parser.add_argument("--golden", default="./recordings/pubmed_qa_golden.json")
+    parser.add_argument("--embed-model-type", default="hf")
+    parser.add_argument("--embed-model-name", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--llm-type", default="cohere")
+    parser.add_argument("--llm-name", default="command")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--response-mode", default="compact")
+    parser.add_argument("--num-queries", type=int, default=50, help="Limit the number of evaluation questions")
+    parser.add_argument("--data-dir", default="./data")
+    args = parser.parse_args()
+
+    golden = None
+    if os.path.exists(args.golden):
+        with open(args.golden, "r") as f:
+            golden = json.load(f)
+    elif args.mode != "record":
+        sys.exit(f"No golden answers at {args.golden}, run with --mode record first")
+
+    recorder = ModelRecorder(args.recording, mode=args.mode, replay_latency=args.replay_latency)
+    recorder.install(LLM_PROVIDERS, EMBEDDING_PROVIDERS)
+
+    questions = load_questions(args, golden)
+    start = time.perf_counter()
+    embed_model = RAGEmbedding(model_type=args.embed_model_type, model_name=args.embed_model_name).load_model()
+    Settings.embed_model = embed_model
+    Settings.llm = RAGLLM(args.llm_type, args.llm_name).load_model(temperature=0.0)
+
+    docs = DocumentReader(input_dir=f"{args.data_dir}/pubmed_doc").load_data()
+    nodes = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap).get_nodes_from_documents(docs)
+    index = VectorStoreIndex(nodes, embed_model=embed_model)
+    query_engine = RAGQueryEngine("vector_index", index, args.llm_name).create(
+        args.top_k, args.response_mode, query_mode="default", hybrid_search_alpha=None, use_reranker=False)
+    result = evaluate(questions, query_engine, return_predictions=True)
+    wall_s = time.perf_counter() - start
+
+    report = recorder.report(wall_s)
+    print(f"acc: {result['acc']:.4f}, retriever_acc: {result['retriever_acc']:.4f}")
+    print(f"{report['replayed']} calls replayed, {report['recorded']} recorded, {wall_s:.1f}s "
+          f"({report['provider_s']:.1f}s in the providers, {report['overhead_s']:.1f}s of pipeline overhead, "
+          f"{report['skipped_s']:.1f}s of recorded provider time skipped)")
+
+    if args.mode == "record":
+        os.makedirs(os.path.dirname(args.golden) or ".", exist_ok=True)
+        with open(args.golden, "w") as f:
+            json.dump({"config": vars(args), "questions": questions, "acc": float(result["acc"]),
+                       "retriever_acc": float(result["retriever_acc"]), "predictions": result["predictions"]}, f, indent=2)
+        print(f"Golden answers written to {args.golden}")
+        return
+
+    changed = compare(result["predictions"], golden)
+    for change in changed:
+        print(f"Changed: {change['id']} - golden {change['golden']}, now {change['now']}")
+    print(f"{len(changed)} of {len(questions)} answers differ from the golden run "
+          f"(acc {golden['acc']:.4f} -> {result['acc']:.4f})")
+    if changed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
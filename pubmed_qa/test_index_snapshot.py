@@ -0,0 +1,43 @@
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import TextNode
+
+from utils.index_snapshot import export_snapshot, import_snapshot
+from utils.rag_utils import HashedEmbedding
+
+TEXTS = ["Fund A invests in government bonds.", "Fund B invests in technology stocks.",
+         "Fund C holds real estate in Toronto."]
+
+
+def _index(texts, embed_model):
+    nodes = [TextNode(text=text, id_=f"node_{idx}") for idx, text in enumerate(texts)]
+    return VectorStoreIndex(nodes, embed_model=embed_model)
+
+
+def _top_texts(index, query):
+    return [node.node.get_content() for node in index.as_retriever(similarity_top_k=2).retrieve(query)]
+
+
+def test_round_trip(tmp_path):
+    embed_model = HashedEmbedding(model_name="hashed", embed_dim=64)
+    index = _index(TEXTS, embed_model)
+
+    for dtype in ("float32", "int8"):
+        snapshot_dir = str(tmp_path / dtype)
+        manifest = export_snapshot(index, snapshot_dir, dtype=dtype)
+        assert manifest["count"] == 3 and manifest["dim"] == 64 and manifest["model_id"] == "hashed"
+
+        imported = import_snapshot(snapshot_dir, embed_model=embed_model)
+        assert sorted(node.get_content() for node in imported.docstore.docs.values()) == sorted(TEXTS)
+        assert _top_texts(imported, "technology stocks")[0] == TEXTS[1]
+        assert _top_texts(imported, "bonds") == _top_texts(index, "bonds")
+
+
+def test_empty_round_trip(tmp_path):
+    embed_model = HashedEmbedding(model_name="hashed", embed_dim=64)
+    snapshot_dir = str(tmp_path / "empty")
+    manifest = export_snapshot(_index([], embed_model), snapshot_dir)
+    assert manifest["count"] == 0
+
+    imported = import_snapshot(snapshot_dir, embed_model=embed_model)
+    assert imported.index_struct.nodes_dict == {}
+    assert _top_texts(imported, "bonds") == []
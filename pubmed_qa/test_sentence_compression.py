@@ -0,0 +1,47 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from utils.context_packing import ContextPacker
+from utils.sentence_compression import SentenceCompressor
+
+
+class KeywordEmbedding(BaseEmbedding):
+    # Sentences about bonds point one way, all others the other way
+    def _embed(self, text):
+        return [1.0, 0.0] if "bond" in text.lower() else [0.0, 1.0]
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+
+DOCUMENT = "Fund A invests in bonds. The fund is based in Toronto. Its bonds are rated AAA."
+
+
+def _chunk(text, score):
+    start = DOCUMENT.index(text)
+    return NodeWithScore(node=TextNode(text=text, start_char_idx=start, end_char_idx=start + len(text),
+                                       metadata={"file_name": "fund_a.txt"}), score=score)
+
+
+def test_compressed_chunks_are_merged_by_text():
+    # Two chunks that overlap on the middle sentence, as with chunk_overlap, which compression drops from both
+    nodes = [_chunk("Fund A invests in bonds. The fund is based in Toronto.", 0.9),
+             _chunk("The fund is based in Toronto. Its bonds are rated AAA.", 0.8)]
+    query = QueryBundle("Which bonds?")
+
+    compressor = SentenceCompressor(embed_model=KeywordEmbedding(), percentile_cutoff=1.0, threshold_cutoff=0.5)
+    compressed = compressor.postprocess_nodes(nodes, query_bundle=query)
+    assert [node.node.get_content() for node in compressed] == ["Fund A invests in bonds.", "Its bonds are rated AAA."]
+    assert all(node.node.start_char_idx is None and node.node.end_char_idx is None for node in compressed)
+    # The retrieved nodes are left as they were
+    assert nodes[1].node.start_char_idx == DOCUMENT.index("The fund")
+
+    # Merged by the source offsets, the text of the second chunk would be lost
+    packed = ContextPacker(token_budget=512).postprocess_nodes(compressed, query_bundle=query)
+    assert [node.node.get_content() for node in packed] == ["Fund A invests in bonds.", "Its bonds are rated AAA."]
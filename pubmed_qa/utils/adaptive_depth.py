@@ -0,0 +1,80 @@
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+
+class AdaptiveDepth(BaseNodePostprocessor):
+    '''
+    Per query retrieval depth, from the score distribution of the first stage candidates:
+    - The effective k is the perplexity of the softmax of the min-max normalized scores: 1 for a single clear winner,
+      up to max_k when they are even
+    - Candidates that all score within min_spread (a share of the top score) of each other are even
+    - When the top hit leads the second one by confident_gap standard deviations of the candidate scores, the
+      reranker is skipped and the top k candidates are kept as ranked. Otherwise all candidates are reranked,
+      deep hits are what the reranker is for, and the best k are kept. Easy queries cost no reranking and a
+      shorter LLM context.
+    The chosen depth of every query is printed, `stats` has the totals.
+    '''
+    reranker: Optional[BaseNodePostprocessor] = Field(default=None, description="Second stage reranker.")
+    min_k: int = Field(default=1, description="Minimum number of nodes kept.")
+    max_k: Optional[int] = Field(default=None, description="Maximum number of nodes kept, all candidates if None.")
+    confident_gap: float = Field(default=2.5, description="Lead of the top hit over the second one, in standard deviations of the candidate scores, to skip reranking.")
+    min_spread: float = Field(default=0.02, description="Smallest score spread, relative to the top score, that tells the candidates apart.")
+    temperature: float = Field(default=0.1, description="Softmax temperature over the normalized scores.")
+    _stats: dict = PrivateAttr(default_factory=lambda: {"queries": 0, "reranked": 0, "nodes_in": 0, "nodes_out": 0})
+
+    @classmethod
+    def class_name(cls):
+        return "AdaptiveDepth"
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def depth(self, scores):
+        '''
+        Returns (effective k, gap between the top two hits in standard deviations of the scores, perplexity)
+        '''
+        scores = np.sort(np.asarray(scores, dtype=np.float64))[::-1]
+        max_k = min(self.max_k or len(scores), len(scores))
+        spread = scores[0] - scores[-1]
+        min_spread = self.min_spread * abs(scores[0])
+        if len(scores) < 2 or spread <= min_spread:
+            # Even scores, no hit stands out
+            return max_k, 0.0, float(len(scores))
+        # The gap keeps the scale of the scores, a near tie at the top is a small gap however low the other
+        # candidates score. The floor keeps two candidates, or a few close ones, from looking far apart.
+        gap = float(scores[0] - scores[1]) / max(float(scores.std()), min_spread)
+        normalized = (scores - scores[-1]) / spread
+        weights = np.exp((normalized - 1.0) / self.temperature)
+        probs = weights / weights.sum()
+        perplexity = float(np.exp(-(probs * np.log(np.maximum(probs, 1e-12))).sum()))
+        k = min(max(int(round(perplexity)), self.min_k), max_k)
+        return k, gap, perplexity
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes or any(node.score is None for node in nodes):
+            # Nothing to adapt to, the reranker runs as it would without this step
+            return self.reranker.postprocess_nodes(nodes, query_bundle=query_bundle) if self.reranker else nodes
+        nodes = sorted(nodes, key=lambda node: node.score, reverse=True)
+        k, gap, perplexity = self.depth([node.score for node in nodes])
+        rerank = self.reranker is not None and gap < self.confident_gap
+        if rerank:
+            kept = self.reranker.postprocess_nodes(nodes, query_bundle=query_bundle)[:k]
+        else:
+            kept = nodes[:k]
+
+        self._stats["queries"] += 1
+        self._stats["reranked"] += int(rerank)
+        self._stats["nodes_in"] += len(nodes)
+        self._stats["nodes_out"] += len(kept)
+        action = f"reranked {len(nodes)}" if rerank else ("reranker skipped" if self.reranker else "no reranker")
+        print(f"Adaptive depth: k={len(kept)} of {len(nodes)} (gap {gap:.2f}, perplexity {perplexity:.1f}), {action}")
+        return kept
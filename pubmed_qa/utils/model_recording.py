@@ -0,0 +1,480 @@
+# Copied to TD_team_B/server, pubmed_qa/utils and local_llama2/utils, keep the copies identical
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage, ChatResponse, ChatResponseAsyncGen, ChatResponseGen, CompletionResponse,
+    CompletionResponseAsyncGen, CompletionResponseGen, LLMMetadata, MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.llms import LLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.prompts import PromptTemplate
+
+RECORDING_MODES = ("record", "replay", "update")
+
+
+class ReplayMiss(LookupError):
+    '''
+    A call with no recording, in replay mode
+    '''
+
+
+def _encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
+
+
+def _messages(messages: Sequence[ChatMessage]):
+    return [{"role": str(message.role.value), "content": message.content,
+             "additional_kwargs": message.additional_kwargs} for message in messages]
+
+
+class ModelRecorder():
+    '''
+    Record/replay of LLM and embedding calls, stored in one SQLite file keyed by a fingerprint of the
+    model (provider and model name) and of the request (chat messages, completion prompt or embedded text).
+    - mode="record": every call goes to the provider and its response and timings are stored
+    - mode="replay": calls are answered from the recording, the provider model is never built, and a call
+      that was not recorded raises ReplayMiss, e.g. after changing a prompt or the chunk settings
+    - mode="update": recorded calls are replayed, new ones go to the provider and are recorded
+    replay_latency=True sleeps the recorded provider time of every replayed call (time to every streamed
+    token, embedding batches), so a replayed run measures the overhead of the pipeline itself.
+    Generation settings (temperature, max tokens, ...) are not part of the fingerprint: re-record after changing them.
+
+    install() wraps every model created through the provider registries:
+    ModelRecorder("recordings/pubmed_qa.sqlite", mode="replay").install(LLM_PROVIDERS, EMBEDDING_PROVIDERS)
+    '''
+    def __init__(self, path, mode="replay", replay_latency=False):
+        if mode not in RECORDING_MODES:
+            raise NotImplementedError(f'Incorrect recording mode - {mode}')
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.stats = {"replayed": 0, "recorded": 0, "provider_s": 0.0, "skipped_s": 0.0}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recordings (key TEXT PRIMARY KEY, model TEXT, kind TEXT, value TEXT, created REAL)")
+        self._conn.commit()
+        self._registries = []
+
+    def install(self, *registries):
+        for registry in registries:
+            registry.wrapper = self.wrap
+            self._registries.append(registry)
+        return self
+
+    def uninstall(self):
+        for registry in self._registries:
+            registry.wrapper = None
+        self._registries = []
+
+    def wrap(self, kind, provider, model_name, factory):
+        '''
+        Model recording the calls of factory(), the wrapper of ProviderRegistry.create
+        '''
+        model_id = f"{kind}/{provider}/{model_name}"
+        if kind == "llm":
+            return RecordedLLM(self, model_id, factory)
+        if kind == "embedding":
+            return RecordedEmbedding(self, model_id, factory)
+        raise NotImplementedError(f'Incorrect model kind - {kind}')
+
+    @staticmethod
+    def fingerprint(model_id, call, payload):
+        data = json.dumps([model_id, call, payload], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM recordings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM recordings WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update({key: json.loads(value) for key, value in rows})
+        return found
+
+    def put_many(self, model_id, kind, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO recordings (key, model, kind, value, created) VALUES (?, ?, ?, ?, ?)",
+                [(key, model_id, kind, json.dumps(value), now) for key, value in items.items()])
+            self._conn.commit()
+
+    def count(self, provider_s, recorded=0, replayed=0):
+        with self._lock:
+            # Recorded provider time is only spent again when replay_latency is set
+            self.stats["skipped_s" if replayed and not self.replay_latency else "provider_s"] += provider_s
+            self.stats["recorded"] += recorded
+            self.stats["replayed"] += replayed
+
+    def replaying(self, key):
+        # None when the call has to go to the provider
+        if self.mode == "record":
+            return None
+        value = self.get(key)
+        if value is None and self.mode == "replay":
+            raise ReplayMiss(f'No recording of this call in {self.path} - re-record with mode="update"')
+        return value
+
+    def report(self, wall_s=None):
+        '''
+        Calls replayed and recorded, the provider time spent (or replayed) and skipped and, given the wall time
+        of the run, the time spent outside the providers. Only meaningful for calls made one at a time.
+        '''
+        report = dict(self.stats)
+        if wall_s is not None:
+            report["wall_s"] = wall_s
+            report["overhead_s"] = wall_s - self.stats["provider_s"]
+        return report
+
+
+class RecordedLLM(LLM):
+    '''
+    LLM answering from a ModelRecorder, and calling the provider model built by `factory` for the calls to record.
+    Stream and non-stream calls share their recording: a stream is replayed delta by delta at its recorded pace.
+    '''
+    model_id: str = Field(description="Provider and model name of the recorded LLM.")
+    _recorder: Any = PrivateAttr()
+    _factory: Any = PrivateAttr()
+    _inner: Any = PrivateAttr(default=None)
+    _model_metadata: dict = PrivateAttr()
+    _build_lock: Any = PrivateAttr()
+
+    def __init__(self, recorder, model_id, factory, **kwargs):
+        key = f"model:{model_id}"
+        recorded = recorder.get(key) if recorder.mode != "record" else None
+        inner = None
+        if recorded is None:
+            if recorder.mode == "replay":
+                raise ReplayMiss(f'No recording of {model_id} in {recorder.path} - re-record with mode="update"')
+            inner = factory()
+            wrapper_prompt = inner.query_wrapper_prompt
+            recorded = {
+                "metadata": json.loads(json.dumps(inner.metadata.dict(), default=str)),
+                "system_prompt": inner.system_prompt,
+                "query_wrapper_prompt": getattr(wrapper_prompt, "template", None),
+            }
+            recorder.put_many(model_id, "model", {key: recorded})
+        # predict() adds the system and query wrapper prompts before complete(formatted=True),
+        # so they are kept from the provider model to send it the same prompts
+        wrapper_prompt = recorded["query_wrapper_prompt"]
+        super().__init__(model_id=model_id, system_prompt=recorded["system_prompt"],
+                         query_wrapper_prompt=PromptTemplate(wrapper_prompt) if wrapper_prompt else None, **kwargs)
+        self._recorder = recorder
+        self._factory = factory
+        self._model_metadata = recorded["metadata"]
+        self._build_lock = threading.Lock()
+        self._set_inner(inner)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(**self._model_metadata)
+
+    def _set_inner(self, inner):
+        if inner is not None:
+            # This wrapper reports the calls to the callback handlers, not the provider model as well
+            inner.callback_manager = CallbackManager([])
+        self._inner = inner
+
+    def _provider(self):
+        # Built on the first call that has to be recorded, never in replay mode
+        with self._build_lock:
+            if self._inner is None:
+                self._set_inner(self._factory())
+        return self._inner
+
+    def _key(self, call, payload, kwargs):
+        return self._recorder.fingerprint(self.model_id, call, [payload, kwargs])
+
+    def _store(self, key, text, deltas, offsets, role=None):
+        self._recorder.put_many(self.model_id, "llm", {key: {
+            "text": text, "role": role, "deltas": deltas, "offsets": offsets}})
+        self._recorder.count(offsets[-1] if offsets else 0.0, recorded=1)
+
+    def _replayed(self, value):
+        self._recorder.count(value["offsets"][-1] if value["offsets"] else 0.0, replayed=1)
+        return value
+
+    def _chat_response(self, text, role, delta=None):
+        return ChatResponse(message=ChatMessage(role=MessageRole(role or MessageRole.ASSISTANT.value), content=text),
+                            delta=delta)
+
+    def _replay_stream(self, value, to_response):
+        start = time.perf_counter()
+        text = ""
+        for delta, offset in zip(value["deltas"], value["offsets"]):
+            if self._recorder.replay_latency:
+                time.sleep(max(0.0, offset - (time.perf_counter() - start)))
+            text += delta
+            yield to_response(text, delta)
+
+    async def _areplay_stream(self, value, to_response):
+        start = time.perf_counter()
+        text = ""
+        for delta, offset in zip(value["deltas"], value["offsets"]):
+            if self._recorder.replay_latency:
+                await asyncio.sleep(max(0.0, offset - (time.perf_counter() - start)))
+            text += delta
+            yield to_response(text, delta)
+
+    def _record_stream(self, key, responses, chat):
+        start = time.perf_counter()
+        deltas, offsets = [], []
+        response = None
+        for response in responses:
+            deltas.append(response.delta or "")
+            offsets.append(time.perf_counter() - start)
+            yield response
+        if response is not None:
+            text = response.message.content if chat else response.text
+            self._store(key, text or "", deltas, offsets, role=str(response.message.role.value) if chat else None)
+
+    async def _arecord_stream(self, key, responses, chat):
+        start = time.perf_counter()
+        deltas, offsets = [], []
+        response = None
+        async for response in responses:
+            deltas.append(response.delta or "")
+            offsets.append(time.perf_counter() - start)
+            yield response
+        if response is not None:
+            text = response.message.content if chat else response.text
+            self._store(key, text or "", deltas, offsets, role=str(response.message.role.value) if chat else None)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._key("chat", _messages(messages), kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            if self._recorder.replay_latency:
+                time.sleep(value["offsets"][-1] if value["offsets"] else 0.0)
+            self._replayed(value)
+            return self._chat_response(value["text"], value["role"])
+        start = time.perf_counter()
+        response = self._provider().chat(messages, **kwargs)
+        self._store(key, response.message.content or "", [response.message.content or ""],
+                    [time.perf_counter() - start], role=str(response.message.role.value))
+        return response
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._key("complete", [prompt, formatted], kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            if self._recorder.replay_latency:
+                time.sleep(value["offsets"][-1] if value["offsets"] else 0.0)
+            self._replayed(value)
+            return CompletionResponse(text=value["text"])
+        start = time.perf_counter()
+        response = self._provider().complete(prompt, formatted=formatted, **kwargs)
+        self._store(key, response.text, [response.text], [time.perf_counter() - start])
+        return response
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        key = self._key("chat", _messages(messages), kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            return self._replay_stream(self._replayed(value),
+                                       lambda text, delta: self._chat_response(text, value["role"], delta))
+        return self._record_stream(key, self._provider().stream_chat(messages, **kwargs), chat=True)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        key = self._key("complete", [prompt, formatted], kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            return self._replay_stream(self._replayed(value),
+                                       lambda text, delta: CompletionResponse(text=text, delta=delta))
+        return self._record_stream(key, self._provider().stream_complete(prompt, formatted=formatted, **kwargs),
+                                   chat=False)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._key("chat", _messages(messages), kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            if self._recorder.replay_latency:
+                await asyncio.sleep(value["offsets"][-1] if value["offsets"] else 0.0)
+            self._replayed(value)
+            return self._chat_response(value["text"], value["role"])
+        start = time.perf_counter()
+        response = await self._provider().achat(messages, **kwargs)
+        self._store(key, response.message.content or "", [response.message.content or ""],
+                    [time.perf_counter() - start], role=str(response.message.role.value))
+        return response
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._key("complete", [prompt, formatted], kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            if self._recorder.replay_latency:
+                await asyncio.sleep(value["offsets"][-1] if value["offsets"] else 0.0)
+            self._replayed(value)
+            return CompletionResponse(text=value["text"])
+        start = time.perf_counter()
+        response = await self._provider().acomplete(prompt, formatted=formatted, **kwargs)
+        self._store(key, response.text, [response.text], [time.perf_counter() - start])
+        return response
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        key = self._key("chat", _messages(messages), kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            return self._areplay_stream(self._replayed(value),
+                                        lambda text, delta: self._chat_response(text, value["role"], delta))
+        return self._arecord_stream(key, await self._provider().astream_chat(messages, **kwargs), chat=True)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        key = self._key("complete", [prompt, formatted], kwargs)
+        value = self._recorder.replaying(key)
+        if value is not None:
+            return self._areplay_stream(self._replayed(value),
+                                        lambda text, delta: CompletionResponse(text=text, delta=delta))
+        return self._arecord_stream(
+            key, await self._provider().astream_complete(prompt, formatted=formatted, **kwargs), chat=False)
+
+
+class RecordedEmbedding(BaseEmbedding):
+    '''
+    Embedding model answering from a ModelRecorder, text by text: a batch only sends the texts
+    that were not recorded to the provider model, and replays the recorded time of the others.
+    '''
+    model_id: str = Field(description="Provider and model name of the recorded embedding model.")
+    _recorder: Any = PrivateAttr()
+    _factory: Any = PrivateAttr()
+    _inner: Any = PrivateAttr(default=None)
+    _build_lock: Any = PrivateAttr()
+
+    def __init__(self, recorder, model_id, factory, **kwargs):
+        key = f"model:{model_id}"
+        recorded = recorder.get(key) if recorder.mode != "record" else None
+        inner = None
+        if recorded is None:
+            if recorder.mode == "replay":
+                raise ReplayMiss(f'No recording of {model_id} in {recorder.path} - re-record with mode="update"')
+            inner = factory()
+            recorded = {"model_name": inner.model_name, "embed_batch_size": inner.embed_batch_size}
+            recorder.put_many(model_id, "model", {key: recorded})
+        super().__init__(model_id=model_id, model_name=recorded["model_name"],
+                         embed_batch_size=recorded["embed_batch_size"], **kwargs)
+        self._recorder = recorder
+        self._factory = factory
+        self._build_lock = threading.Lock()
+        self._set_inner(inner)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordedEmbedding"
+
+    def _set_inner(self, inner):
+        if inner is not None:
+            inner.callback_manager = CallbackManager([])
+        self._inner = inner
+
+    def _provider(self):
+        with self._build_lock:
+            if self._inner is None:
+                self._set_inner(self._factory())
+        return self._inner
+
+    def _lookup(self, call, texts):
+        '''
+        Returns the keys of texts, their recorded values and the texts to send to the provider
+        '''
+        keys = [self._recorder.fingerprint(self.model_id, call, text) for text in texts]
+        found = {} if self._recorder.mode == "record" else self._recorder.get_many(keys)
+        if self._recorder.mode == "replay" and len(found) < len(set(keys)):
+            raise ReplayMiss(f'No recording of {len(set(keys)) - len(found)} {call} embeddings from {self.model_id} '
+                             f'in {self._recorder.path} - re-record with mode="update"')
+        missing = list(dict.fromkeys(text for key, text in zip(keys, texts) if key not in found))
+        replayed_s = sum(found[key]["latency_s"] for key in set(keys) if key in found)
+        self._recorder.count(replayed_s, replayed=len(found))
+        return keys, found, missing, replayed_s
+
+    def _record(self, call, texts, embeddings, elapsed):
+        # The time of a batch is shared by its texts
+        latency_s = elapsed / len(texts)
+        values = {self._recorder.fingerprint(self.model_id, call, text): {
+            "embedding": _encode_vector(embedding), "latency_s": latency_s} for text, embedding in zip(texts, embeddings)}
+        self._recorder.put_many(self.model_id, "embedding", values)
+        self._recorder.count(elapsed, recorded=len(values))
+        return values
+
+    def _embeddings(self, call, texts):
+        keys, found, missing, replayed_s = self._lookup(call, texts)
+        if self._recorder.replay_latency and replayed_s:
+            time.sleep(replayed_s)
+        if missing:
+            start = time.perf_counter()
+            if call == "query":
+                embeddings = [self._provider().get_query_embedding(text) for text in missing]
+            else:
+                embeddings = self._provider().get_text_embedding_batch(missing)
+            found.update(self._record(call, missing, embeddings, time.perf_counter() - start))
+        return [_decode_vector(found[key]["embedding"]) for key in keys]
+
+    async def _aembeddings(self, call, texts):
+        keys, found, missing, replayed_s = self._lookup(call, texts)
+        if self._recorder.replay_latency and replayed_s:
+            await asyncio.sleep(replayed_s)
+        if missing:
+            start = time.perf_counter()
+            if call == "query":
+                embeddings = [await self._provider().aget_query_embedding(text) for text in missing]
+            else:
+                embeddings = await self._provider().aget_text_embedding_batch(missing)
+            found.update(self._record(call, missing, embeddings, time.perf_counter() - start))
+        return [_decode_vector(found[key]["embedding"]) for key in keys]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embeddings("query", [query])[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embeddings("text", [text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings("text", texts)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._aembeddings("query", [query]))[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aembeddings("text", [text]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembeddings("text", texts)
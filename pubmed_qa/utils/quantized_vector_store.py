@@ -0,0 +1,231 @@
+import json
+import os
+import tempfile
+from typing import Any, List, Optional
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore, VectorStoreQuery, VectorStoreQueryResult,
+)
+
+QUANTIZATION_TYPES = ("float32", "int8", "binary")
+
+# Number of set bits of every byte value, for Hamming distances between packed binary codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+# Rows scored at a time, keeps the dequantized block small enough to stay in cache
+_BLOCK_SIZE = 2048
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class QuantizedVectorStore(BasePydanticVectorStore):
+    '''
+    In-process vector store that keeps compressed embeddings in memory:
+    - int8: per-dimension scalar quantization, 4x smaller than float32
+    - binary: one sign bit per dimension searched by Hamming distance, 32x smaller
+    - float32: no compression, exact search (the baseline)
+    Embeddings are compressed as they are added. The top similarity_top_k * rescore_multiplier candidates
+    are re-ranked with the float vectors, which are written to a temporary file right away and memory-mapped
+    (from the persisted file once the store is persisted), so only the candidates are read. Without re-ranking
+    the float vectors are not kept at all.
+    The int8 scale of every dimension is calibrated on the first batch added, later additions are clipped to
+    its range.
+    '''
+    stores_text: bool = False
+    flat_metadata: bool = False
+    quantization: str = Field(default="int8", description="One of float32, int8, binary.")
+    rescore_multiplier: int = Field(default=4, description="Candidates re-ranked with float vectors per result, 0 disables.")
+
+    _ids: list = PrivateAttr(default_factory=list)
+    _ref_doc_ids: list = PrivateAttr(default_factory=list)
+    _floats: Any = PrivateAttr(default=None)
+    _spill: Any = PrivateAttr(default=None)
+    _codes: Any = PrivateAttr(default=None)
+    _scale: Any = PrivateAttr(default=None)
+
+    def __init__(self, quantization="int8", rescore_multiplier=4, **kwargs):
+        if quantization not in QUANTIZATION_TYPES:
+            raise NotImplementedError(f'Incorrect quantization type - {quantization}')
+        super().__init__(quantization=quantization, rescore_multiplier=rescore_multiplier, **kwargs)
+
+    @classmethod
+    def class_name(cls):
+        return "QuantizedVectorStore"
+
+    @property
+    def client(self):
+        return None
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = _normalize(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        if self.quantization == "int8" and self._scale is None:
+            self._scale = np.maximum(np.abs(embeddings).max(axis=0), 1e-6) / 127.0
+        if self.quantization == "float32":
+            self._floats = embeddings if self._floats is None else np.concatenate([self._floats, embeddings])
+        else:
+            codes = self._quantize(embeddings)
+            self._codes = codes if self._codes is None else np.concatenate([self._codes, codes])
+            if self.rescore_multiplier > 0:
+                spilled = self._spill is not None
+                blocks = [embeddings] if spilled or self._floats is None else [*self._float_blocks(), embeddings]
+                self._spill_floats(blocks, embeddings.shape[1], append=spilled)
+        self._ids += [node.node_id for node in nodes]
+        self._ref_doc_ids += [node.ref_doc_id for node in nodes]
+        return [node.node_id for node in nodes]
+
+    def _quantize(self, vectors):
+        if self.quantization == "int8":
+            return np.clip(np.round(vectors / self._scale), -127, 127).astype(np.int8)
+        if self.quantization == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return None
+
+    def _float_blocks(self, keep=None):
+        # The float vectors block by block, a memory-mapped file is never read into memory at once
+        for start in range(0, len(self._floats), _BLOCK_SIZE):
+            block = np.asarray(self._floats[start:start + _BLOCK_SIZE])
+            yield block if keep is None else block[keep[start:start + _BLOCK_SIZE]]
+
+    def _spill_floats(self, blocks, dim, append=False):
+        # Float vectors only read for re-ranking are kept in an unlinked temporary file, memory-mapped
+        if append:
+            spill = self._spill
+            spill.seek(0, os.SEEK_END)
+        else:
+            spill = tempfile.TemporaryFile()
+        for block in blocks:
+            spill.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        spill.flush()
+        rows = spill.tell() // (4 * dim)
+        if self._spill is not None and self._spill is not spill:
+            self._spill.close()
+        self._spill = spill
+        self._floats = (np.memmap(spill, dtype=np.float32, mode="r", shape=(rows, dim)) if rows
+                        else np.zeros((0, dim), dtype=np.float32))
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        keep = np.array([ref != ref_doc_id for ref in self._ref_doc_ids], dtype=bool)
+        if keep.all():
+            return
+        self._ids = [node_id for node_id, kept in zip(self._ids, keep) if kept]
+        self._ref_doc_ids = [ref for ref, kept in zip(self._ref_doc_ids, keep) if kept]
+        if isinstance(self._floats, np.memmap):
+            self._spill_floats(list(self._float_blocks(keep)), self._floats.shape[1])
+        elif self._floats is not None:
+            self._floats = self._floats[keep]
+        if self._codes is not None:
+            self._codes = self._codes[keep]
+
+    def _approximate_scores(self, query):
+        scores = np.empty(len(self._ids), dtype=np.float32)
+        if self.quantization == "int8":
+            weighted = query * self._scale
+            for start in range(0, len(scores), _BLOCK_SIZE):
+                scores[start:start + _BLOCK_SIZE] = self._codes[start:start + _BLOCK_SIZE].astype(np.float32) @ weighted
+        elif self.quantization == "binary":
+            bits = np.packbits(query > 0)
+            dim = len(query)
+            for start in range(0, len(scores), _BLOCK_SIZE):
+                distance = _POPCOUNT[np.bitwise_xor(self._codes[start:start + _BLOCK_SIZE], bits)].sum(axis=1, dtype=np.int32)
+                # Cosine estimate from the fraction of differing signs
+                scores[start:start + _BLOCK_SIZE] = 1.0 - 2.0 * distance / dim
+        else:
+            for start in range(0, len(scores), _BLOCK_SIZE):
+                scores[start:start + _BLOCK_SIZE] = self._floats[start:start + _BLOCK_SIZE] @ query
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError('Metadata filters are not supported by QuantizedVectorStore')
+        if not self._ids:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        vector = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        k = query.similarity_top_k
+        scores = self._approximate_scores(vector)
+        if self.quantization != "float32" and self.rescore_multiplier > 0 and self._floats is not None:
+            candidates = np.sort(_top_k(scores, k * self.rescore_multiplier))
+            # Sorted row order keeps the reads from the memory-mapped float vectors sequential
+            exact = np.asarray(self._floats[candidates]) @ vector
+            order = _top_k(exact, k)
+            top, similarities = candidates[order], exact[order]
+        else:
+            top = _top_k(scores, k)
+            similarities = scores[top]
+        return VectorStoreQueryResult(
+            ids=[self._ids[i] for i in top], similarities=[float(score) for score in similarities])
+
+    def memory_bytes(self):
+        '''
+        Bytes of vector data held in memory (memory-mapped float vectors are not counted)
+        '''
+        total = 0 if self._codes is None else self._codes.nbytes
+        if self._floats is not None and not isinstance(self._floats, np.memmap):
+            total += self._floats.nbytes
+        return total
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        dirpath = os.path.dirname(persist_path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        if self._floats is not None:
+            # Written block by block next to the file, the vectors may be mapped from the file about to be replaced
+            floats = np.lib.format.open_memmap(persist_path + ".floats.tmp.npy", mode="w+", dtype=np.float32,
+                                               shape=self._floats.shape)
+            for start in range(0, len(floats), _BLOCK_SIZE):
+                floats[start:start + _BLOCK_SIZE] = self._floats[start:start + _BLOCK_SIZE]
+            floats.flush()
+            del floats
+            os.replace(persist_path + ".floats.tmp.npy", persist_path + ".floats.npy")
+        if self._codes is not None:
+            np.save(persist_path + ".codes.npy", self._codes)
+        with open(persist_path, "w") as f:
+            json.dump({
+                "quantization": self.quantization,
+                "rescore_multiplier": self.rescore_multiplier,
+                "ids": self._ids,
+                "ref_doc_ids": self._ref_doc_ids,
+                "scale": None if self._scale is None else self._scale.tolist(),
+            }, f)
+        if self.quantization != "float32" and self._floats is not None and len(self._floats):
+            # From now on the float vectors are read from the persisted file for re-ranking
+            self._floats = np.load(persist_path + ".floats.npy", mmap_mode="r")
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None):
+        with open(persist_path, "r") as f:
+            data = json.load(f)
+        store = cls(quantization=data["quantization"], rescore_multiplier=data["rescore_multiplier"])
+        store._ids = data["ids"]
+        store._ref_doc_ids = data["ref_doc_ids"]
+        store._scale = None if data["scale"] is None else np.asarray(data["scale"], dtype=np.float32)
+        if store._ids:
+            if store.quantization == "float32":
+                store._floats = np.load(persist_path + ".floats.npy")
+            elif store.rescore_multiplier > 0:
+                store._floats = np.load(persist_path + ".floats.npy", mmap_mode="r")
+            if store.quantization != "float32":
+                store._codes = np.load(persist_path + ".codes.npy")
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, namespace: str = "default"):
+        return cls.from_persist_path(os.path.join(persist_dir, f"{namespace}__vector_store.json"))
@@ -1,6 +1,8 @@
+import hashlib
 import os
 import re
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 from pathlib import Path
@@ -8,35 +10,30 @@ from llama_index.core import (
     SimpleDirectoryReader, VectorStoreIndex, PromptTemplate, 
     load_index_from_storage, get_response_synthesizer, download_loader,
 )
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.llms.huggingface import HuggingFaceLLM
-from llama_index.llms.openai import OpenAI
-from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.retrievers.bm25 import BM25Retriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.retrievers import VectorIndexRetriever, QueryFusionRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.core.postprocessor import SimilarityPostprocessor, LLMRerank, SentenceEmbeddingOptimizer
-from llama_index.postprocessor.cohere_rerank import CohereRerank
-from langchain_community.chat_models import ChatCohere
-from langchain_community.embeddings import CohereEmbeddings
-from langchain_community.llms import HuggingFaceEndpoint
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-from langchain_openai.chat_models import ChatOpenAI
-from datasets import Dataset
-from ragas.metrics import (
-        answer_relevancy,
-        faithfulness,
-        context_recall,
-        context_precision
-        )
-from ragas import evaluate as ragas_evaluate
+from llama_index.core.postprocessor import (
+    SimilarityPostprocessor, LLMRerank, SentenceEmbeddingOptimizer, SentenceTransformerRerank,
+)
+
+from .cache_utils import DiskCache
+from .adaptive_depth import AdaptiveDepth
+from .context_packing import ContextPacker
+from .query_expansion import QueryExpansionRetriever
+from .sentence_compression import SentenceCompressor
+from .provider_registry import EMBEDDING_PROVIDERS
 
+# Provider SDKs (HuggingFace, OpenAI, Cohere, LangChain, ragas, datasets, BM25) are imported
+# inside the code path that needs them, so importing this module stays fast.
 
+# Metric name -> attribute of ragas.metrics, resolved when RagasEval is created
 RAGAS_METRIC_MAP = {
-        "faithfulness": faithfulness,
-        "relevancy": answer_relevancy,
-        "recall": context_recall,
-        "precision": context_precision
+        "faithfulness": "faithfulness",
+        "relevancy": "answer_relevancy",
+        "recall": "context_recall",
+        "precision": "context_precision"
         }
 
 
@@ -80,6 +77,44 @@ class DocumentReader():
         return docs
 
 
+class HashedEmbedding(BaseEmbedding):
+    '''
+    Offline stand-in for a real embedding model: a signed hashed bag-of-words vector.
+    No model download or API call, so benchmarks can run anywhere.
+    '''
+    embed_dim: int = Field(default=384, description="Dimension of the hashed vectors.")
+
+    @classmethod
+    def class_name(cls):
+        return "HashedEmbedding"
+
+    def _embed(self, text):
+        vector = np.zeros(self.embed_dim, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.embed_dim
+            vector[bucket] += 1.0 if digest[4] % 2 == 0 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
+@EMBEDDING_PROVIDERS.register("hashed")
+def hashed_embedding(model_name, **kwargs):
+    # Offline hashed vectors, model_name is ignored
+    return HashedEmbedding(model_name='hashed')
+
+
 class RAGEmbedding():
     '''
     LlamaIndex supports embedding models from OpenAI, Cohere, HuggingFace, etc.
@@ -93,15 +128,8 @@ class RAGEmbedding():
 
     def load_model(self):
         print(f'Loading {self.model_type} embedding model ...')
-        if self.model_type == 'hf':
-            # Using bge base HuggingFace embeddings, can choose others based on leaderboard: 
-            # https://huggingface.co/spaces/mteb/leaderboard
-            embed_model = HuggingFaceEmbedding(model_name=self.model_name) # max_length does not have any effect?
-
-        elif self.model_type == 'openai':
-            # TODO - Add open ai embedding model
-            # embed_model = OpenAIEmbedding()
-            raise NotImplementedError
+        # Available model types are the ones in EMBEDDING_PROVIDERS: 'hf', 'openai', 'cohere', 'ollama', ...
+        embed_model = EMBEDDING_PROVIDERS.create(self.model_type, self.model_name)
 
         # sample_text_embedding = embed_model.get_text_embedding(sample_text)
         # print(sample_text_embedding)
@@ -128,7 +156,23 @@ class RAGQueryEngine():
         self.set_retriever(similarity_top_k, **kwargs)
         self.set_response_synthesizer(response_mode)
         if kwargs["use_reranker"]:
-            self.set_node_postprocessors(rerank_top_k=kwargs["rerank_top_k"])
+            self.set_node_postprocessors(
+                rerank_top_k=kwargs["rerank_top_k"], reranker_type=kwargs.get("reranker_type", "cohere"))
+        if kwargs.get("adaptive_depth"):
+            # Per query depth from the first stage scores, never deeper than rerank_top_k,
+            # and the reranker only runs on queries without a clear top hit
+            self.node_postprocessor = [AdaptiveDepth(
+                reranker=self.node_postprocessor[0] if self.node_postprocessor else None,
+                min_k=kwargs.get("adaptive_min_k", 1),
+                max_k=kwargs["rerank_top_k"] if kwargs["use_reranker"] else None)]
+        if kwargs.get("compression_percentile"):
+            # Keep only the sentences most similar to the query, before packing
+            self.node_postprocessor = (self.node_postprocessor or []) + [
+                SentenceCompressor(embed_model=self.index._embed_model, percentile_cutoff=kwargs["compression_percentile"])]
+        if kwargs.get("context_token_budget"):
+            # Pack the (reranked) nodes into the budget as the last postprocessing step
+            self.node_postprocessor = (self.node_postprocessor or []) + [
+                ContextPacker(token_budget=kwargs["context_token_budget"])]
         query_engine = RetrieverQueryEngine(
             retriever=self.retriever,
             node_postprocessors=self.node_postprocessor,
@@ -140,8 +184,6 @@ class RAGQueryEngine():
         # Other retrievers can be used based on the type of index: List, Tree, Knowledge Graph, etc.
         # https://docs.llamaindex.ai/en/stable/api_reference/query/retrievers.html
         # Find LlamaIndex equivalents for the following:
-        # Check MultiQueryRetriever from LangChain: https://python.langchain.com/docs/modules/data_connection/retrievers/MultiQueryRetriever
-        # Check Contextual compression from LangChain: https://python.langchain.com/docs/modules/data_connection/retrievers/contextual_compression/
         # Check Ensemble Retriever from LangChain: https://python.langchain.com/docs/modules/data_connection/retrievers/ensemble
         # Check self-query from LangChain: https://python.langchain.com/docs/modules/data_connection/retrievers/self_query
         # Check WebSearchRetriever from LangChain: https://python.langchain.com/docs/modules/data_connection/retrievers/web_research
@@ -153,15 +195,44 @@ class RAGQueryEngine():
                 alpha=kwargs["hybrid_search_alpha"],
                 )
         elif self.retriever_type == 'bm25':
+            from llama_index.retrievers.bm25 import BM25Retriever
             self.retriever = BM25Retriever(
                 nodes=kwargs["nodes"],
                 tokenizer=kwargs["tokenizer"],
                 similarity_top_k=similarity_top_k,
             )
+        elif self.retriever_type == 'hybrid':
+            # Fuse dense and BM25 results locally with reciprocal rank fusion,
+            # for vector stores without a native hybrid query mode
+            from llama_index.retrievers.bm25 import BM25Retriever
+            vector_retriever = VectorIndexRetriever(
+                index=self.index,
+                similarity_top_k=similarity_top_k,
+                )
+            bm25_retriever = BM25Retriever(
+                nodes=kwargs["nodes"],
+                tokenizer=kwargs.get("tokenizer"),
+                similarity_top_k=similarity_top_k,
+            )
+            self.retriever = QueryFusionRetriever(
+                [vector_retriever, bm25_retriever],
+                similarity_top_k=similarity_top_k,
+                num_queries=1, # No LLM query generation
+                mode="reciprocal_rerank",
+                use_async=False,
+            )
+        elif self.retriever_type in ('multi_query', 'hyde'):
+            # LLM query expansion (MultiQueryRetriever / HyDE), one LLM call and one embedding batch per question
+            self.retriever = QueryExpansionRetriever(
+                VectorIndexRetriever(index=self.index, similarity_top_k=similarity_top_k),
+                mode=self.retriever_type,
+                num_queries=kwargs.get("num_queries", 3),
+                llm=kwargs.get("llm"),
+            )
         else:
             raise NotImplementedError(f'Incorrect retriever type - {self.retriever_type}')
 
-    def set_node_postprocessors(self, rerank_top_k=2):
+    def set_node_postprocessors(self, rerank_top_k=2, reranker_type='cohere'):
         # # Node postprocessor: Porcessing nodes after retrieval before passing to the LLM for generation
         # # Re-ranking step can be performed here!
         # # Nodes can be re-ordered to include more relevant ones at the top: https://python.langchain.com/docs/modules/data_connection/document_transformers/post_retrieval/long_context_reorder
@@ -173,8 +244,15 @@ class RAGQueryEngine():
         #         embed_model=service_context.embed_model, 
         #         percentile_cutoff=0.5
         #         )]
-        cohere_rerank = CohereRerank(top_n=rerank_top_k)
-        self.node_postprocessor = [cohere_rerank]
+        if reranker_type == 'cohere':
+            from llama_index.postprocessor.cohere_rerank import CohereRerank
+            reranker = CohereRerank(top_n=rerank_top_k)
+        elif reranker_type == 'sentence_transformer':
+            # Local cross-encoder, runs without any API access
+            reranker = SentenceTransformerRerank(model="cross-encoder/ms-marco-MiniLM-L-6-v2", top_n=rerank_top_k)
+        else:
+            raise NotImplementedError(f'Incorrect reranker type - {reranker_type}')
+        self.node_postprocessor = [reranker]
 
     def set_response_synthesizer(self, response_mode):
         # Other response modes: https://docs.llamaindex.ai/en/stable/module_guides/querying/response_synthesizers/root.html#configuring-the-response-mode
@@ -215,28 +293,42 @@ def retriever_acc(actual, retrieved_candidates):
     # candidates are unordered as of now
     return (actual in retrieved_candidates)
 
-def evaluate(data, engine):
-    gt_ans = []
-    pred_ans = []
-    retriever_hit = []
-    for elm in tqdm(data, desc="Running evaluation"):
-        query_str = elm['question']
-        resp = engine.query(query_str)
-        ans = extract_yes_no(resp.response).lower()
-        gt_ans.append(elm['answer'][0])
-        pred_ans.append(ans)
-        
-        # Standalone retriever accuracy
-        try:
-            ret_nodes = engine.retriever.retrieve(query_str)
-            retriever_hit.append(retriever_acc(
-                elm['id'], [node.metadata["file_name"].split(".")[0] for node in ret_nodes]))
-        except Exception as e:
-            print(f"Exception for {elm['id']}: {e}")
-            retriever_hit.append(0)
+def retriever_mrr(actual, retrieved_candidates):
+    # Reciprocal rank of the first relevant candidate, candidates ordered by score
+    for rank, candidate in enumerate(retrieved_candidates, start=1):
+        if candidate == actual:
+            return 1.0 / rank
+    return 0.0
+
+def _evaluate_one(elm, engine):
+    query_str = elm['question']
+    resp = engine.query(query_str)
+    ans = extract_yes_no(resp.response).lower()
+
+    # Standalone retriever accuracy
+    try:
+        ret_nodes = engine.retriever.retrieve(query_str)
+        hit = retriever_acc(elm['id'], [node.metadata["file_name"].split(".")[0] for node in ret_nodes])
+    except Exception as e:
+        print(f"Exception for {elm['id']}: {e}")
+        hit = 0
+    return elm['answer'][0], ans, hit
+
+def evaluate(data, engine, max_workers=1, return_predictions=False):
+    # max_workers > 1 runs queries concurrently, e.g. for an LLM that batches concurrent prompts ('local_batched')
+    # return_predictions=True adds the answer of every question, e.g. to compare a run with golden answers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(tqdm(executor.map(lambda elm: _evaluate_one(elm, engine), data), total=len(data), desc="Running evaluation"))
+    gt_ans = [gt for gt, _, _ in results]
+    pred_ans = [pred for _, pred, _ in results]
+    retriever_hit = [hit for _, _, hit in results]
 
     acc = [(gt_ans[idx]==pred_ans[idx]) for idx in range(len(gt_ans))]
-    return {"acc": np.mean(acc), "retriever_acc": np.mean(retriever_hit)}
+    result = {"acc": np.mean(acc), "retriever_acc": np.mean(retriever_hit)}
+    if return_predictions:
+        result["predictions"] = [{"id": elm["id"], "answer": gt, "prediction": pred, "retriever_hit": bool(hit)}
+                                 for elm, (gt, pred, hit) in zip(data, results)]
+    return result
 
 def validate_rag_cfg(cfg):
     if cfg["query_mode"] == "hybrid":
@@ -246,9 +338,18 @@ def validate_rag_cfg(cfg):
 
 
 class RagasEval():
-    def __init__(self, metrics, eval_llm_type, eval_llm_name):
+    '''
+    Scores are computed per (metric, row) and cached on disk, keyed by the evaluator model, metric,
+    question, answer, contexts and ground truths. Re-running after a prompt tweak or a failure
+    only sends rows that changed, in chunks of batch_size on at most max_workers threads.
+    Set cache_dir=None to disable the cache.
+    '''
+    def __init__(self, metrics, eval_llm_type, eval_llm_name, cache_dir="./.ragas_cache", batch_size=8, max_workers=4):
         self.eval_llm_type = eval_llm_type # "openai", "cohere", "local"
         self.eval_llm_name = eval_llm_name # "gpt-3.5-turbo" # "gpt-4"
+        self.batch_size = batch_size
+        self.max_workers = max_workers # Keep low to stay within the eval LLM rate limits
+        self.cache = DiskCache(os.path.join(cache_dir, "ragas_scores.sqlite")) if cache_dir else None
 
         self.temperature = 0.0
 
@@ -259,17 +360,21 @@ class RagasEval():
         self._prepare_embedding()
         self._prepare_llm()
 
-        self.metrics = [RAGAS_METRIC_MAP[elm] for elm in metrics]
+        from ragas import metrics as ragas_metrics
+        self.metrics = [getattr(ragas_metrics, RAGAS_METRIC_MAP[elm]) for elm in metrics]
 
     def _prepare_data(self, data):
+        from datasets import Dataset
         return Dataset.from_dict(data)
 
     def _prepare_embedding(self):
         if self.eval_llm_type == "cohere":
+            from langchain_community.embeddings import CohereEmbeddings
             self.eval_embedding = CohereEmbeddings(
                     model="embed-english-v3.0"
                     )
         elif self.eval_llm_type == "local":
+            from langchain_community.embeddings import HuggingFaceBgeEmbeddings
             self.eval_embedding = HuggingFaceBgeEmbeddings(
                     model_name=self.local_embed_name,
                     )
@@ -278,26 +383,81 @@ class RagasEval():
     
     def _prepare_llm(self):
         if self.eval_llm_type == "cohere":
+            from langchain_community.chat_models import ChatCohere
             self.eval_llm = ChatCohere(
                     model="command",
                     )
         elif self.eval_llm_type == "local":
+            from langchain_community.llms import HuggingFaceEndpoint
             self.eval_llm = HuggingFaceEndpoint(
                     repo_id="meta-llama/Llama-2-7b-chat-hf",
                     token=os.environ["HUGGINGFACEHUB_API_TOKEN"],
                     )
         elif self.eval_llm_type == "openai":
+            from langchain_openai.chat_models import ChatOpenAI
             self.eval_llm = ChatOpenAI(
                 model_name=self.eval_llm_name,
                 temperature=self.temperature,
                 )
 
-    def evaluate(self, data):
-        data = self._prepare_data(data)
+    def _score_key(self, metric, row):
+        return DiskCache.make_key(self.eval_llm_type, self.eval_llm_name, metric.name, row)
+
+    def _evaluate_chunk(self, metric, rows):
+        from ragas import evaluate as ragas_evaluate
+        data = self._prepare_data({col: [row[col] for row in rows] for col in rows[0]})
         result = ragas_evaluate(
                     data,
-                    metrics=self.metrics,
+                    metrics=[metric],
                     embeddings=self.eval_embedding,
                     llm=self.eval_llm,
                 )
-        return result
\ No newline at end of file
+        return [float(score) for score in result.to_pandas()[metric.name]]
+
+    def evaluate_rows(self, data):
+        # data is column oriented (question, answer, contexts, ground_truths), returns one {metric: score} per row
+        columns = list(data.keys())
+        rows = [dict(zip(columns, values)) for values in zip(*data.values())]
+        scores = [{} for _ in rows]
+
+        jobs = []
+        for metric in self.metrics:
+            keys = [self._score_key(metric, row) for row in rows]
+            cached = self.cache.get_many(keys) if self.cache is not None else {}
+            pending = []
+            for idx, key in enumerate(keys):
+                if key in cached:
+                    scores[idx][metric.name] = cached[key]
+                else:
+                    pending.append((idx, key))
+            for start in range(0, len(pending), self.batch_size):
+                jobs.append((metric, pending[start:start + self.batch_size]))
+        print(f'{sum(len(pending) for _, pending in jobs)} uncached scores to compute in {len(jobs)} chunks')
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._evaluate_chunk, metric, [rows[idx] for idx, _ in pending]): (metric, pending)
+                for metric, pending in jobs
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Running RAGAS evaluation"):
+                metric, pending = futures[future]
+                try:
+                    chunk_scores = future.result()
+                except Exception as e:
+                    print(f"Exception for {metric.name} chunk: {e}")
+                    failed += 1
+                    chunk_scores = [float('nan')] * len(pending)
+                for (idx, _), score in zip(pending, chunk_scores):
+                    scores[idx][metric.name] = score
+                if self.cache is not None:
+                    # NaN scores are not cached so that they are retried on the next run
+                    self.cache.set_many({key: score for (_, key), score in zip(pending, chunk_scores) if not np.isnan(score)})
+
+        if failed:
+            print(f"{failed} chunks failed, run evaluate again to retry only the missing scores")
+        return scores
+
+    def evaluate(self, data):
+        scores = self.evaluate_rows(data)
+        return {metric.name: float(np.nanmean([row[metric.name] for row in scores])) for metric in self.metrics}
\ No newline at end of file
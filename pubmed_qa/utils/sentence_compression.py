@@ -0,0 +1,109 @@
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+
+class SentenceCompressor(BaseNodePostprocessor):
+    '''
+    Contextual compression of the retrieved nodes, a batched SentenceEmbeddingOptimizer:
+    - Splits all nodes into sentences and embeds the ones not seen before in one batch
+    - Scores every sentence against the query with a single matrix product
+    - Keeps the top percentile_cutoff share of sentences over all nodes, in their original order,
+      and drops nodes with no sentence left
+    Sentence embeddings are cached by text hash, so chunks retrieved again for another query are not re-embedded.
+    '''
+    embed_model: BaseEmbedding = Field(description="Embedding model of the index.")
+    percentile_cutoff: float = Field(default=0.5, description="Share of the sentences to keep.")
+    threshold_cutoff: Optional[float] = Field(default=None, description="Minimum similarity of a kept sentence.")
+    cache_size: int = Field(default=100_000, description="Number of sentence embeddings kept in memory.")
+    _split: Callable = PrivateAttr()
+    _cache: Any = PrivateAttr(default_factory=OrderedDict)
+    _stats: dict = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._split = split_by_sentence_tokenizer()
+
+    @classmethod
+    def class_name(cls):
+        return "SentenceCompressor"
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def _embed(self, sentences):
+        keys = [hashlib.sha1(sentence.encode("utf-8")).hexdigest() for sentence in sentences]
+        missing = list({key: sentence for key, sentence in zip(keys, sentences) if key not in self._cache}.items())
+        if missing:
+            embeddings = self.embed_model.get_text_embedding_batch([sentence for _, sentence in missing])
+            for (key, _), embedding in zip(missing, embeddings):
+                self._cache[key] = np.asarray(embedding, dtype=np.float32)
+        matrix = np.stack([self._cache[key] for key in keys])
+        for key in keys:
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        self._stats["embedded"] = len(missing)
+        return matrix
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes or query_bundle is None:
+            return nodes
+        owners, sentences = [], []
+        for idx, node in enumerate(nodes):
+            if isinstance(node.node, TextNode):
+                for sentence in self._split(node.node.get_content()):
+                    if sentence.strip():
+                        owners.append(idx)
+                        sentences.append(sentence.strip())
+        if not sentences:
+            return nodes
+
+        matrix = self._embed(sentences)
+        query = query_bundle.embedding or self.embed_model.get_query_embedding(query_bundle.query_str)
+        query = np.asarray(query, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        scores = matrix @ query / np.where(norms > 0, norms, 1.0)
+
+        keep = np.zeros(len(sentences), dtype=bool)
+        keep[np.argsort(-scores)[:max(math.ceil(len(sentences) * self.percentile_cutoff), 1)]] = True
+        if self.threshold_cutoff is not None:
+            keep &= scores >= self.threshold_cutoff
+
+        kept = {}
+        for owner, sentence, selected in zip(owners, sentences, keep):
+            if selected:
+                kept.setdefault(owner, []).append(sentence)
+        compressed = []
+        for idx, node in enumerate(nodes):
+            if not isinstance(node.node, TextNode):
+                compressed.append(node)
+            elif idx in kept:
+                text = " ".join(kept[idx])
+                if text != node.node.get_content():
+                    node = NodeWithScore(node=node.node.copy(), score=node.score)
+                    node.node.set_content(text)
+                    # The text no longer spans the source offsets, ContextPacker merges it by text instead
+                    node.node.start_char_idx = node.node.end_char_idx = None
+                compressed.append(node)
+
+        chars_in = sum(len(node.node.get_content()) for node in nodes)
+        chars_out = sum(len(node.node.get_content()) for node in compressed)
+        self._stats.update({"sentences_in": len(sentences), "sentences_out": int(keep.sum()),
+                            "chars_in": chars_in, "chars_out": chars_out})
+        print(f"Sentence compression: {len(sentences)} -> {int(keep.sum())} sentences, {chars_in} -> {chars_out} chars "
+              f"({self._stats['embedded']} sentences embedded)")
+        return compressed
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+from langchain.chains import RetrievalQA
+from langchain_community.vectorstores import FAISS
+
+
+class EvaluationPipeline():
+    '''
+    Answers every question of a Ragas test set against a vector store that is embedded only once.
+    The FAISS index is persisted to index_dir together with a fingerprint of the chunks and the
+    embedding model, so later runs on the same corpus skip embedding entirely.
+    Questions are answered concurrently by at most max_workers threads.
+    '''
+    def __init__(self, chunks, embeddings, llm, index_dir="./.faiss_index", k=20, max_workers=4):
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.llm = llm
+        self.index_dir = index_dir
+        self.k = k
+        self.max_workers = max_workers
+        self.vectorstore = None
+        self.qa = None
+        self.timings = {}
+
+    def _fingerprint(self):
+        # Changes whenever the chunks or the embedding model change
+        model_name = getattr(self.embeddings, "model", None) or getattr(self.embeddings, "model_name", None)
+        sha = hashlib.sha256(f"{type(self.embeddings).__name__}:{model_name}".encode("utf-8"))
+        for chunk in self.chunks:
+            sha.update(chunk.page_content.encode("utf-8"))
+            sha.update(json.dumps(chunk.metadata, sort_keys=True, default=str).encode("utf-8"))
+        return sha.hexdigest()
+
+    def _load_index(self):
+        try:
+            return FAISS.load_local(self.index_dir, self.embeddings, allow_dangerous_deserialization=True)
+        except TypeError:
+            # Older langchain_community versions do not have allow_dangerous_deserialization
+            return FAISS.load_local(self.index_dir, self.embeddings)
+
+    def build_index(self):
+        start = time.perf_counter()
+        fingerprint = self._fingerprint()
+        fingerprint_path = os.path.join(self.index_dir, "fingerprint.txt")
+        cached_fingerprint = None
+        if os.path.isfile(fingerprint_path):
+            with open(fingerprint_path) as f:
+                cached_fingerprint = f.read()
+        if cached_fingerprint == fingerprint:
+            print(f"Loading vector store from {self.index_dir} ...")
+            self.vectorstore = self._load_index()
+            self.timings["index_load_s"] = time.perf_counter() - start
+        else:
+            print(f"Embedding {len(self.chunks)} chunks ...")
+            self.vectorstore = FAISS.from_documents(self.chunks, self.embeddings)
+            self.vectorstore.save_local(self.index_dir)
+            with open(fingerprint_path, "w") as f:
+                f.write(fingerprint)
+            self.timings["index_build_s"] = time.perf_counter() - start
+
+        self.qa = RetrievalQA.from_chain_type(
+            llm=self.llm,
+            chain_type="stuff",
+            retriever=self.vectorstore.as_retriever(search_kwargs={"k": self.k}),
+            return_source_documents=True,
+        )
+        return self.vectorstore
+
+    def answer(self, query):
+        result = self.qa.invoke({"query": query})
+        return result["result"], [doc.page_content for doc in result["source_documents"]]
+
+    def answer_all(self, questions, answers, contexts):
+        '''
+        Fill answers[i] and contexts[i] in place for every questions[i]
+        '''
+        if self.qa is None:
+            self.build_index()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(self.answer, questions)
+            for index, (answer, context) in enumerate(tqdm(results, total=len(questions), desc="Answering questions")):
+                answers[index] = answer
+                contexts[index] = context
+        elapsed = time.perf_counter() - start
+        self.timings["answer_total_s"] = elapsed
+        self.timings["answer_per_question_s"] = elapsed / max(len(questions), 1)
+        return answers, contexts
@@ -0,0 +1,129 @@
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import statistics
+import time
+
+from csv_loader import CSVLoader
+from sql_advisor import SQLAdvisor
+
+TABLE = "banking_term_deposits"
+
+# The kind of SQL the database chain generates for analytics questions
+WORKLOAD = [
+    'SELECT "job", AVG("balance") FROM banking_term_deposits GROUP BY "job"',
+    'SELECT "job", "y", AVG("balance") FROM banking_term_deposits GROUP BY "job", "y"',
+    'SELECT AVG("balance") FROM banking_term_deposits WHERE "job" = \'management\' AND "y" = \'yes\'',
+    'SELECT "month", "poutcome", COUNT(*) FROM banking_term_deposits GROUP BY "month", "poutcome"',
+    'SELECT "education", AVG("duration") AS avg_duration FROM banking_term_deposits WHERE "y" = \'yes\' '
+    'GROUP BY "education" ORDER BY avg_duration DESC LIMIT 5',
+    'SELECT "marital", COUNT(*), MAX("balance") FROM banking_term_deposits WHERE "housing" = \'yes\' GROUP BY "marital"',
+    'SELECT "age", "balance" FROM banking_term_deposits WHERE "job" = \'student\' AND "loan" = \'yes\' '
+    'ORDER BY "balance" DESC, "age" DESC LIMIT 5',
+]
+
+
+def build_scaled_db(csv_path, db_path, scale, seed=0):
+    '''
+    Write the CSV scale times into a new database, jittering the integer columns of each copy
+    '''
+    rng = random.Random(seed)
+    loader = CSVLoader(db_path, TABLE)
+    types = loader.infer_types(csv_path)
+    integer_indexes = [i for i, column_type in enumerate(types) if column_type.sql_type == "INTEGER"]
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader)
+        rows = list(reader)
+
+    def scaled_rows():
+        for copy in range(scale):
+            for row in rows:
+                if copy > 0:
+                    row = list(row)
+                    for i in integer_indexes:
+                        row[i] = int(row[i]) + rng.randint(-2, 2)
+                yield row
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    return loader.load_rows(types, scaled_rows())
+
+
+def run(conn, sql):
+    return conn.execute(sql).fetchall()
+
+
+def time_query(db_path, sql, repeats):
+    conn = sqlite3.connect(db_path)
+    timings, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run(conn, sql)
+        timings.append(time.perf_counter() - start)
+    conn.close()
+    return statistics.median(timings), result
+
+
+def same_result(a, b):
+    normalize = lambda rows: sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows)
+    return normalize(a) == normalize(b)
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark SQLAdvisor indexes and aggregate tables on a scaled-up copy "
+                                                 "of the banking dataset")
+    parser.add_argument("--csv", default=os.path.join(here, "banking_term_deposits.csv"))
+    parser.add_argument("--db", default=os.path.join(here, ".benchmark", "banking_term_deposits_scaled.db"))
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    start = time.perf_counter()
+    num_rows = build_scaled_db(args.csv, args.db, args.scale)
+    print(f"Loaded {num_rows} rows in {time.perf_counter() - start:.1f}s")
+
+    advisor = SQLAdvisor(args.db)
+    baseline = {}
+    for sql in WORKLOAD:
+        baseline[sql] = time_query(args.db, sql, args.repeats)
+        for _ in range(args.repeats):
+            advisor.record(sql)
+
+    start = time.perf_counter()
+    proposals = advisor.apply()
+    apply_seconds = time.perf_counter() - start
+
+    results = []
+    for sql in WORKLOAD:
+        rewritten = advisor.rewrite(sql)
+        seconds, rows = time_query(args.db, rewritten, args.repeats)
+        before, expected = baseline[sql]
+        results.append({
+            "sql": sql, "rewritten": rewritten if rewritten != sql else None,
+            "before_s": before, "after_s": seconds, "speedup": before / max(seconds, 1e-9),
+            "same_result": same_result(expected, rows),
+        })
+
+    print(f"Applied {len(proposals)} proposals in {apply_seconds:.1f}s:")
+    for proposal in proposals:
+        print(f"  {proposal['sql']}")
+    print(f"\n{'before':>9} {'after':>9} {'speedup':>8}  same  query")
+    for result in results:
+        print(f"{result['before_s'] * 1000:8.1f}ms {result['after_s'] * 1000:8.1f}ms {result['speedup']:7.1f}x  "
+              f"{'yes' if result['same_result'] else 'NO':>4}  {'[agg] ' if result['rewritten'] else ''}{result['sql']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": num_rows, "apply_s": apply_seconds, "proposals": proposals, "queries": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
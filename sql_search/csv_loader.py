@@ -0,0 +1,231 @@
+import argparse
+import csv
+import os
+import sqlite3
+import time
+from itertools import islice
+
+
+class ColumnType():
+    '''
+    Type of one CSV column: INTEGER, REAL or TEXT, and for TEXT columns with few distinct
+    values the set of allowed values
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.sql_type = "INTEGER"
+        self.values = set()
+        self.enum = True
+
+    def observe(self, values, enum_max_distinct):
+        '''
+        Update the type with a set of distinct values of the column
+        '''
+        for value in values:
+            if self.sql_type == "INTEGER":
+                try:
+                    int(value)
+                except ValueError:
+                    self.sql_type = "REAL"
+            if self.sql_type == "REAL":
+                try:
+                    float(value)
+                except ValueError:
+                    self.sql_type = "TEXT"
+                    break
+        if self.enum:
+            self.values |= values
+            # Stop collecting once the column is clearly not categorical, this keeps memory bounded
+            if len(self.values) > enum_max_distinct:
+                self.enum = False
+                self.values = set()
+
+    @property
+    def is_enum(self):
+        return self.sql_type == "TEXT" and self.enum
+
+    def convert(self):
+        return {"INTEGER": int, "REAL": float, "TEXT": str}[self.sql_type]
+
+    def definition(self):
+        return f'"{self.name}" {self.sql_type} NOT NULL'
+
+    def comment(self):
+        # Kept in sqlite_master, so the allowed values show up in the table info given to the LLM
+        if self.is_enum:
+            return " -- one of " + ", ".join("'" + value + "'" for value in sorted(self.values))
+        return ""
+
+
+class CSVLoader():
+    '''
+    Streams a delimited CSV file into a typed SQLite table with bounded memory:
+    - Column types are inferred (INTEGER, REAL, TEXT) and enforced by a STRICT table, values of categorical
+      TEXT columns are checked against the values seen when inferring the types
+    - Rows are inserted in chunks of chunk_size with one transaction per rows_per_transaction rows, in WAL mode
+      with synchronous writes off during the load
+    - Indexes are built only after all rows are in, followed by ANALYZE
+    '''
+    def __init__(self, db_path, table, delimiter=";", chunk_size=50_000, rows_per_transaction=1_000_000,
+                 enum_max_distinct=32, index_columns=None):
+        self.db_path = db_path
+        self.table = table
+        self.delimiter = delimiter
+        self.chunk_size = chunk_size
+        self.rows_per_transaction = rows_per_transaction
+        self.enum_max_distinct = enum_max_distinct
+        self.index_columns = index_columns or []
+        self.stats = {}
+
+    def _reader(self, csv_path):
+        f = open(csv_path, newline="")
+        reader = csv.reader(f, delimiter=self.delimiter)
+        return f, next(reader), reader
+
+    def infer_types(self, csv_path, sample_rows=None):
+        '''
+        One streaming pass over the file (or its first sample_rows rows) to find the column types
+        '''
+        f, header, reader = self._reader(csv_path)
+        with f:
+            types = [ColumnType(name) for name in header]
+            rows = islice(reader, sample_rows)
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                for index, column_type in enumerate(types):
+                    column_type.observe({row[index] for row in chunk}, self.enum_max_distinct)
+        return types
+
+    def _existing_table(self, conn, types):
+        # Appending to a table: its columns must be the CSV columns, with types that take the inferred ones.
+        # INTEGER values go into a REAL column, the column type of the table is then used for the load
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)).fetchone()
+        if row is None:
+            return None
+        existing = [(name, sql_type.upper()) for _, name, sql_type, *_ in conn.execute(f'PRAGMA table_info("{self.table}")')]
+        if [name for name, _ in existing] != [column_type.name for column_type in types]:
+            raise ValueError(f"Columns of table {self.table} {[name for name, _ in existing]} "
+                             f"do not match the CSV columns {[column_type.name for column_type in types]}")
+        for (_, sql_type), column_type in zip(existing, types):
+            if sql_type == "REAL" and column_type.sql_type == "INTEGER":
+                column_type.sql_type = "REAL"
+            elif sql_type != column_type.sql_type:
+                raise ValueError(f"Column {column_type.name} of table {self.table} is {sql_type}, "
+                                 f"the CSV values are {column_type.sql_type}")
+        return row[0].rstrip().upper().endswith("STRICT")
+
+    def create_table(self, conn, types, replace=True):
+        '''
+        Create the table, or with replace=False add to the table if it exists. Returns whether it is STRICT
+        '''
+        if replace:
+            conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        else:
+            strict = self._existing_table(conn, types)
+            if strict is not None:
+                return strict
+        columns = "".join(f"\n  {column_type.definition()}{',' if i < len(types) - 1 else ''}{column_type.comment()}"
+                          for i, column_type in enumerate(types))
+        # STRICT tables (SQLite 3.37+) convert and type check the values themselves, which is much faster than in Python
+        strict = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
+        conn.execute(f'CREATE TABLE "{self.table}" ({columns}\n){strict}')
+        return bool(strict)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # The load is repeatable, so durability is traded for speed until it is done
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-262144")
+        return conn
+
+    def load_rows(self, types, rows, replace=True):
+        '''
+        Load an iterable of rows (lists of strings or values) into a table with the given column types
+        '''
+        start = time.perf_counter()
+        enums = [(index, column_type) for index, column_type in enumerate(types) if column_type.is_enum]
+        insert = f'INSERT INTO "{self.table}" VALUES ({", ".join("?" * len(types))})'
+        conn = self._connect()
+        num_rows = 0
+        try:
+            conn.execute("BEGIN")
+            strict = self.create_table(conn, types, replace=replace)
+            converters = [column_type.convert() for column_type in types]
+            rows = iter(rows)
+            uncommitted = 0
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                try:
+                    for index, column_type in enums:
+                        unknown = {row[index] for row in chunk} - column_type.values
+                        if unknown:
+                            raise ValueError(f"unexpected values {sorted(unknown)} in column {column_type.name}")
+                    if not strict:
+                        chunk = [[convert(value) for convert, value in zip(converters, row)] for row in chunk]
+                    conn.executemany(insert, chunk)
+                except (ValueError, sqlite3.IntegrityError) as e:
+                    raise ValueError(f"Invalid value in rows {num_rows + 1}-{num_rows + len(chunk)}: {e}") from e
+                num_rows += len(chunk)
+                uncommitted += len(chunk)
+                if uncommitted >= self.rows_per_transaction:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+                    uncommitted = 0
+            conn.execute("COMMIT")
+            load_seconds = time.perf_counter() - start
+
+            # Building indexes once on the full table is much faster than updating them on every insert
+            for columns in self.index_columns:
+                columns = [columns] if isinstance(columns, str) else list(columns)
+                name = f"idx_{self.table}_{'_'.join(columns)}".lower()
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{self.table}" '
+                             f'({", ".join(chr(34) + column + chr(34) for column in columns)})')
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        self.stats = {"rows": num_rows, "load_s": load_seconds, "total_s": time.perf_counter() - start}
+        self.stats["rows_per_s"] = num_rows / max(load_seconds, 1e-9)
+        return num_rows
+
+    def load_csv(self, csv_path, replace=True, sample_rows=None):
+        types = self.infer_types(csv_path, sample_rows=sample_rows)
+        f, _, reader = self._reader(csv_path)
+        with f:
+            return self.load_rows(types, reader, replace=replace)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a delimited CSV file into a typed SQLite table")
+    parser.add_argument("csv_path")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default=None, help="Defaults to the CSV file name")
+    parser.add_argument("--delimiter", default=";")
+    parser.add_argument("--chunk_size", type=int, default=50_000)
+    parser.add_argument("--append", action="store_true", help="Add the rows to the table if it exists, instead of replacing it")
+    parser.add_argument("--index", action="append", default=[],
+                        help="Comma separated columns of an index to build after the load, can be repeated")
+    args = parser.parse_args()
+
+    table = args.table or os.path.splitext(os.path.basename(args.csv_path))[0]
+    loader = CSVLoader(args.db_path, table, delimiter=args.delimiter, chunk_size=args.chunk_size,
+                       index_columns=[index.split(",") for index in args.index])
+    loader.load_csv(args.csv_path, replace=not args.append)
+    print(f"Loaded {loader.stats['rows']} rows into {table} in {loader.stats['total_s']:.1f}s "
+          f"({loader.stats['rows_per_s']:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+QUERY_RE = re.compile(
+    r'^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+"?(?P<table>\w+)"?'
+    r'(?:\s+WHERE\s+(?P<where>.+?))?'
+    r'(?:\s+GROUP\s+BY\s+(?P<group>.+?))?'
+    r'(?:\s+HAVING\s+(?P<having>.+?))?'
+    r'(?:\s+ORDER\s+BY\s+(?P<order>.+?))?'
+    r'(?:\s+LIMIT\s+(?P<limit>\d+(?:\s*(?:,|OFFSET)\s*\d+)?))?\s*$',
+    re.IGNORECASE | re.DOTALL)
+AGGREGATE_RE = re.compile(r'\b(AVG|SUM|TOTAL|COUNT|MIN|MAX)\s*\(\s*(DISTINCT\s+)?(\*|"?\w+"?)\s*\)', re.IGNORECASE)
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+IDENTIFIER_RE = re.compile(r'"(\w+)"|\b(\w+)\b')
+EQUALITY_RE = re.compile(r'"?(\w+)"?\s*(?:=|\bIN\b|\bIS\b)', re.IGNORECASE)
+
+METADATA_TABLE = "_advisor_aggregates"
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+def _split_top_level(text):
+    # Split a select list on commas that are not inside parentheses or quotes
+    parts, depth, quote, current = [], 0, None, ""
+    for char in text:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += char
+    parts.append(current.strip())
+    return parts
+
+
+class ParsedQuery():
+    '''
+    The parts of a simple single-table SELECT that the advisor can reason about.
+    Anything with joins, subqueries or set operations is not parsed (parse returns None).
+    '''
+    def __init__(self, match, columns):
+        self.select = match.group("select").strip()
+        self.table = match.group("table")
+        self.where = match.group("where")
+        self.group = match.group("group")
+        self.having = match.group("having")
+        self.order = match.group("order")
+        self.limit = match.group("limit")
+        self._columns = {column.lower(): column for column in columns}
+
+        self.aggregates = [(func.upper(), bool(distinct), arg.strip('"'))
+                           for func, distinct, arg in AGGREGATE_RE.findall(self.select + " " + (self.having or "")
+                                                                             + " " + (self.order or ""))]
+        self.where_columns = self.columns_in(self.where)
+        self.equality_columns = [column for column in self._ordered(EQUALITY_RE.findall(self.where or ""))
+                                 if column in self.where_columns]
+        self.group_columns = self.columns_in(self.group)
+
+    def _ordered(self, names):
+        found = []
+        for name in names:
+            column = self._columns.get(name.lower())
+            if column is not None and column not in found:
+                found.append(column)
+        return found
+
+    def columns_in(self, text, outside_aggregates=False):
+        if not text:
+            return []
+        text = STRING_RE.sub("''", text)
+        if outside_aggregates:
+            text = AGGREGATE_RE.sub("", text)
+        return self._ordered(quoted or bare for quoted, bare in IDENTIFIER_RE.findall(text))
+
+    @property
+    def aggregated_columns(self):
+        return self._ordered(arg for _, _, arg in self.aggregates if arg != "*")
+
+
+class SQLAdvisor():
+    '''
+    Records the SQL an application runs against a SQLite database and speeds up the hot patterns:
+    - Proposes (and optionally creates) covering indexes: equality filters, then GROUP BY columns,
+      then the remaining filtered and aggregated columns
+    - Proposes (and optionally creates) materialized aggregate tables for hot GROUP BY patterns,
+      holding COUNT/SUM/MIN/MAX per group so that AVG, SUM, COUNT, MIN and MAX can be recomputed
+    - Rewrites matching aggregate queries to read the (much smaller) aggregate table instead
+    Aggregate tables are marked stale by triggers whenever the base table changes and are then
+    no longer used until refresh() rebuilds them.
+    '''
+    def __init__(self, db_path, min_count=2, max_index_columns=6, max_aggregate_ratio=0.05):
+        self.db_path = db_path
+        self.min_count = min_count
+        self.max_index_columns = max_index_columns
+        self.max_aggregate_ratio = max_aggregate_ratio
+        self.queries = Counter()
+        self._lock = threading.Lock()
+        self._table_columns = {}
+        self._aggregates = None
+        self._aggregates_version = None
+        self.stats = {"recorded": 0, "rewritten": 0}
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def table_columns(self, table):
+        if table not in self._table_columns:
+            with self._connect() as conn:
+                self._table_columns[table] = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+        return self._table_columns[table]
+
+    def parse(self, sql):
+        sql = sql.strip().rstrip(";").strip()
+        if len(re.findall(r"\bSELECT\b", sql, re.IGNORECASE)) != 1:
+            return None
+        match = QUERY_RE.match(sql)
+        if match is None:
+            return None
+        columns = self.table_columns(match.group("table"))
+        if not columns:
+            return None
+        return ParsedQuery(match, columns)
+
+    def record(self, sql):
+        if not sql.lstrip().upper().startswith("SELECT"):
+            return
+        with self._lock:
+            self.queries[re.sub(r"\s+", " ", sql.strip().rstrip(";"))] += 1
+            self.stats["recorded"] += 1
+
+    def attach(self, sql_database):
+        '''
+        Record every statement run by a langchain SQLDatabase (e.g. the one used by SQLDatabaseChain)
+        '''
+        from sqlalchemy import event
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.record(statement)
+        event.listen(sql_database._engine, "before_cursor_execute", before_cursor_execute)
+
+    def _hot_queries(self):
+        with self._lock:
+            queries = list(self.queries.items())
+        for sql, count in queries:
+            parsed = self.parse(sql)
+            if parsed is not None and count >= self.min_count:
+                yield parsed, count
+
+    def _existing_indexes(self, conn, table):
+        indexes = []
+        for _, name, *_ in conn.execute(f"PRAGMA index_list({_quote(table)})"):
+            indexes.append([row[2] for row in conn.execute(f"PRAGMA index_info({_quote(name)})")])
+        return indexes
+
+    def _aggregate_name(self, table, key_columns):
+        return f"agg_{table}_by_{'_'.join(key_columns)}".lower()
+
+    def propose(self):
+        '''
+        Returns a list of proposals, each a dict with type ('index' or 'aggregate'), name, sql and count
+        '''
+        indexes = {}
+        aggregates = {}
+        for parsed, count in self._hot_queries():
+            # Equality filters first so the index can seek, then the grouping order, then the rest to cover the query
+            columns = list(parsed.equality_columns)
+            columns += [column for column in parsed.group_columns if column not in columns]
+            columns += [column for column in parsed.where_columns if column not in columns]
+            key_width = len(columns)
+            columns += [column for column in parsed.columns_in(parsed.select + " " + (parsed.order or ""))
+                        if column not in columns]
+            if len(columns) > self.max_index_columns:
+                columns = columns[:max(key_width, 1)]
+            if columns:
+                key = (parsed.table, tuple(columns))
+                indexes[key] = indexes.get(key, 0) + count
+
+            if parsed.group_columns and parsed.aggregates and not any(distinct for _, distinct, _ in parsed.aggregates):
+                key_columns = tuple(sorted(set(parsed.group_columns + parsed.where_columns)))
+                entry = aggregates.setdefault((parsed.table, key_columns), {"count": 0, "columns": set()})
+                entry["count"] += count
+                entry["columns"].update(parsed.aggregated_columns)
+
+        proposals = []
+        with self._connect() as conn:
+            for (table, columns), count in sorted(indexes.items(), key=lambda item: -item[1]):
+                existing = self._existing_indexes(conn, table)
+                if any(index[:len(columns)] == list(columns) for index in existing):
+                    continue
+                name = f"idx_{table}_{'_'.join(columns)}".lower()
+                proposals.append({
+                    "type": "index", "name": name, "table": table, "count": count,
+                    "sql": f"CREATE INDEX IF NOT EXISTS {_quote(name)} ON {_quote(table)} "
+                           f"({', '.join(_quote(column) for column in columns)})",
+                })
+
+            base_rows = {}
+            for (table, key_columns), entry in sorted(aggregates.items(), key=lambda item: -item[1]["count"]):
+                name = self._aggregate_name(table, key_columns)
+                if table not in base_rows:
+                    base_rows[table] = conn.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+                keys = ", ".join(_quote(column) for column in key_columns)
+                groups = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {_quote(table)} GROUP BY {keys})").fetchone()[0]
+                # An aggregate table with nearly as many rows as the base table would not save anything
+                if groups > self.max_aggregate_ratio * base_rows[table]:
+                    continue
+                measures = ["COUNT(*) AS \"cnt\""]
+                for column in sorted(entry["columns"]):
+                    quoted = _quote(column)
+                    measures += [f"COUNT({quoted}) AS \"cnt_{column}\"", f"SUM({quoted}) AS \"sum_{column}\"",
+                                 f"MIN({quoted}) AS \"min_{column}\"", f"MAX({quoted}) AS \"max_{column}\""]
+                proposals.append({
+                    "type": "aggregate", "name": name, "table": table, "count": entry["count"],
+                    "key_columns": list(key_columns), "agg_columns": sorted(entry["columns"]), "rows": groups,
+                    "sql": f"CREATE TABLE {_quote(name)} AS SELECT {keys}, {', '.join(measures)} "
+                           f"FROM {_quote(table)} GROUP BY {keys}",
+                })
+        return proposals
+
+    def _create_metadata(self, conn, table):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (name TEXT PRIMARY KEY, base_table TEXT, "
+                     "key_columns TEXT, agg_columns TEXT, rows INTEGER, stale INTEGER, create_sql TEXT)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS \"_advisor_stale_{table}_{event.lower()}\" "
+                         f"AFTER {event} ON {_quote(table)} BEGIN "
+                         f"UPDATE {METADATA_TABLE} SET stale = 1 WHERE base_table = '{table}'; END")
+
+    def apply(self, proposals=None):
+        '''
+        Create the proposed indexes and aggregate tables (all of propose() by default)
+        '''
+        proposals = self.propose() if proposals is None else proposals
+        with self._connect() as conn:
+            for proposal in proposals:
+                print(f"Creating {proposal['type']} {proposal['name']} (seen {proposal['count']} times)")
+                if proposal["type"] == "aggregate":
+                    self._create_metadata(conn, proposal["table"])
+                    conn.execute(f"DROP TABLE IF EXISTS {_quote(proposal['name'])}")
+                    conn.execute(proposal["sql"])
+                    conn.execute(f"INSERT OR REPLACE INTO {METADATA_TABLE} VALUES (?, ?, ?, ?, ?, 0, ?)", (
+                        proposal["name"], proposal["table"], json.dumps(proposal["key_columns"]),
+                        json.dumps(proposal["agg_columns"]), proposal["rows"], proposal["sql"]))
+                else:
+                    conn.execute(proposal["sql"])
+            conn.execute("ANALYZE")
+        self._aggregates_version = None
+        return proposals
+
+    def refresh(self):
+        '''
+        Rebuild the aggregate tables that are stale because the base table changed
+        '''
+        with self._connect() as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (METADATA_TABLE,)).fetchone():
+                return []
+            stale = conn.execute(f"SELECT name, create_sql FROM {METADATA_TABLE} WHERE stale = 1").fetchall()
+            for name, create_sql in stale:
+                conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+                conn.execute(create_sql)
+                rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0]
+                conn.execute(f"UPDATE {METADATA_TABLE} SET stale = 0, rows = ? WHERE name = ?", (rows, name))
+        self._aggregates_version = None
+        return [name for name, _ in stale]
+
+    def _load_aggregates(self, include_stale=False):
+        # Writes in WAL mode only touch the -wal file until the next checkpoint
+        version = max(os.path.getmtime(path) for path in (self.db_path, self.db_path + "-wal") if os.path.exists(path))
+        if self._aggregates is None or self._aggregates_version != version:
+            self._aggregates = self._read_aggregates()
+            self._aggregates_version = version
+        return [aggregate for aggregate in self._aggregates if include_stale or not aggregate["stale"]]
+
+    def _read_aggregates(self):
+        with self._connect() as conn:
+            try:
+                rows = conn.execute(f"SELECT name, base_table, key_columns, agg_columns, rows, stale "
+                                    f"FROM {METADATA_TABLE} ORDER BY rows").fetchall()
+            except sqlite3.OperationalError:
+                rows = []
+        return [{"name": name, "table": table, "key_columns": set(json.loads(keys)),
+                 "agg_columns": set(json.loads(agg_columns)), "rows": count, "stale": bool(stale)}
+                for name, table, keys, agg_columns, count, stale in rows]
+
+    def is_internal_table(self, name):
+        '''
+        True for the tables the advisor created itself, they should not be shown to the LLM
+        '''
+        return name == METADATA_TABLE or name.startswith("agg_") and name in {
+            aggregate["name"] for aggregate in self._load_aggregates(include_stale=True)}
+
+    def rewrite(self, sql):
+        '''
+        Returns sql rewritten to read a matching aggregate table, or sql unchanged if none matches
+        '''
+        parsed = self.parse(sql)
+        if parsed is None or not parsed.aggregates or any(distinct for _, distinct, _ in parsed.aggregates):
+            return sql
+        needed_keys = set(parsed.where_columns + parsed.group_columns
+                          + parsed.columns_in(parsed.select + " " + (parsed.having or "") + " " + (parsed.order or ""),
+                                              outside_aggregates=True))
+        needed_measures = set(parsed.aggregated_columns)
+        for aggregate in self._load_aggregates():
+            if (aggregate["table"] == parsed.table and needed_keys <= aggregate["key_columns"]
+                    and needed_measures <= aggregate["agg_columns"]):
+                break
+        else:
+            return sql
+
+        def replace(match):
+            func, arg = match.group(1).upper(), match.group(3).strip('"')
+            if arg == "*":
+                return 'SUM("cnt")'
+            arg = next(column for column in parsed.aggregated_columns if column.lower() == arg.lower())
+            return {
+                "COUNT": f'SUM("cnt_{arg}")',
+                "SUM": f'SUM("sum_{arg}")',
+                "TOTAL": f'TOTAL("sum_{arg}")',
+                "MIN": f'MIN("min_{arg}")',
+                "MAX": f'MAX("max_{arg}")',
+                "AVG": f'(TOTAL("sum_{arg}") / NULLIF(SUM("cnt_{arg}"), 0))',
+            }[func]
+
+        # Keep the original result column names, they are what the LLM sees in the result
+        select = []
+        for item in _split_top_level(parsed.select):
+            if AGGREGATE_RE.search(item) and not re.search(r"\bAS\s+\S+$", item, re.IGNORECASE):
+                alias = item.replace('"', '""')
+                item = f'{AGGREGATE_RE.sub(replace, item)} AS "{alias}"'
+            else:
+                item = AGGREGATE_RE.sub(replace, item)
+            select.append(item)
+
+        rewritten = f"SELECT {', '.join(select)} FROM {_quote(aggregate['name'])}"
+        if parsed.where:
+            rewritten += f" WHERE {parsed.where}"
+        if parsed.group:
+            rewritten += f" GROUP BY {parsed.group}"
+        if parsed.having:
+            rewritten += f" HAVING {AGGREGATE_RE.sub(replace, parsed.having)}"
+        if parsed.order:
+            rewritten += f" ORDER BY {AGGREGATE_RE.sub(replace, parsed.order)}"
+        if parsed.limit:
+            rewritten += f" LIMIT {parsed.limit}"
+        self.stats["rewritten"] += 1
+        return rewritten
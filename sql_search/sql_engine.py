@@ -0,0 +1,237 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+SQL_PROMPT_TEMPLATE = """You are a SQLite expert. Given an input question, create a syntactically correct SQLite query to run.
+Unless the user specifies in the question a specific number of examples to obtain, query for at most {top_k} results using the LIMIT clause as per SQLite.
+Never query for all columns from a table. You must query only the columns that are needed to answer the question. Wrap each column name in double quotes (") to denote them as delimited identifiers.
+Pay attention to use only the column names you can see in the tables below. Be careful to not query for columns that do not exist.
+Do not prepend the SQL Query with ```sql or append it with ```, instead, just prepend it with SQLQuery:
+
+Only use the following tables:
+{table_info}
+
+Question: {input}
+SQLQuery: """
+
+ANSWER_PROMPT_TEMPLATE = """Given an input question, the SQLite query that was run for it and the result of the query, answer the question.
+
+Question: {input}
+SQLQuery: {sql}
+SQLResult: {result}
+Answer: """
+
+
+class LRUCache():
+    '''
+    Thread-safe in-memory LRU cache holding at most max_size entries
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ReadOnlyConnectionPool():
+    '''
+    Fixed-size pool of read-only SQLite connections.
+    Every statement is aborted once it runs longer than timeout_s seconds.
+    '''
+    def __init__(self, db_path, size=4, timeout_s=5.0):
+        self.db_path = db_path
+        self.timeout_s = timeout_s
+        self._pool = queue.Queue()
+        for _ in range(size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        # mode=ro makes any write fail, whatever SQL the LLM comes up with
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        deadline = time.monotonic() + self.timeout_s
+        # A non-zero return value from the progress handler interrupts the running statement
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+        try:
+            yield conn
+        finally:
+            conn.set_progress_handler(None, 0)
+            self._pool.put(conn)
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
+
+
+class TextToSQLEngine():
+    '''
+    Answers natural language questions over a SQLite database, like SQLDatabaseChain but with caching:
+    - The schema summary (CREATE statements and a few sample rows) is built once per database version
+    - Generated SQL is cached by normalized question, so a repeated question skips the SQL generation call
+    - Queries run through a pool of read-only connections with a statement timeout
+    - Result sets are cached by SQL text and database mtime, answers by question and result
+    llm is any langchain LLM (anything with invoke(prompt) returning text or a message).
+    An optional SQLAdvisor records every query and rewrites it to use its aggregate tables.
+    '''
+    def __init__(self, db_path, llm, table_names=None, sample_rows=3, top_k=5, pool_size=4,
+                 timeout_s=5.0, cache_size=256, max_result_rows=100, advisor=None):
+        self.db_path = db_path
+        self.llm = llm
+        self.table_names = table_names
+        self.sample_rows = sample_rows
+        self.top_k = top_k
+        self.max_result_rows = max_result_rows
+        self.advisor = advisor
+        self.pool = ReadOnlyConnectionPool(db_path, size=pool_size, timeout_s=timeout_s)
+        self.sql_cache = LRUCache(cache_size)
+        self.result_cache = LRUCache(cache_size)
+        self.answer_cache = LRUCache(cache_size)
+        self._schema = None
+        self.stats = {"sql_cache_hits": 0, "result_cache_hits": 0, "answer_cache_hits": 0, "llm_calls": 0}
+
+    def db_version(self):
+        # Any write to the database (or its WAL) changes the mtime and invalidates cached results
+        wal_path = self.db_path + "-wal"
+        mtime = os.path.getmtime(self.db_path)
+        if os.path.exists(wal_path):
+            mtime = max(mtime, os.path.getmtime(wal_path))
+        return mtime
+
+    @staticmethod
+    def normalize_question(question):
+        question = re.sub(r"\s+", " ", question.strip().lower())
+        return question.rstrip("?.! ")
+
+    def schema_summary(self):
+        version = self.db_version()
+        if self._schema is not None and self._schema[0] == version:
+            return self._schema[1]
+
+        with self.pool.connection() as conn:
+            tables = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+                                  "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+            parts = []
+            for name, create_sql in tables:
+                if self.table_names is not None and name not in self.table_names:
+                    continue
+                if self.advisor is not None and self.advisor.is_internal_table(name):
+                    continue
+                cursor = conn.execute(f'SELECT * FROM "{name}" LIMIT {self.sample_rows}')
+                columns = [column[0] for column in cursor.description]
+                rows = ["\t".join(str(value) for value in row) for row in cursor.fetchall()]
+                parts.append(f"{create_sql}\n\n/*\n{self.sample_rows} rows from {name} table:\n"
+                             + "\t".join(columns) + "\n" + "\n".join(rows) + "\n*/")
+        summary = "\n\n".join(parts)
+        self._schema = (version, summary)
+        return summary
+
+    def _complete(self, prompt):
+        self.stats["llm_calls"] += 1
+        result = self.llm.invoke(prompt)
+        return getattr(result, "content", result)
+
+    @staticmethod
+    def _parse_sql(text):
+        text = text.strip()
+        if "SQLQuery:" in text:
+            text = text.split("SQLQuery:", 1)[1]
+        # Cut off anything the LLM continued with after the query
+        text = re.split(r"\n\s*(SQLResult|Answer|Question):", text)[0]
+        text = re.sub(r"^```(sql)?|```$", "", text.strip(), flags=re.IGNORECASE)
+        return text.strip().rstrip(";").strip()
+
+    def generate_sql(self, question):
+        schema = self.schema_summary()
+        key = (self.normalize_question(question), hash(schema))
+        sql = self.sql_cache.get(key)
+        if sql is not None:
+            self.stats["sql_cache_hits"] += 1
+            return sql
+        prompt = SQL_PROMPT_TEMPLATE.format(top_k=self.top_k, table_info=schema, input=question)
+        sql = self._parse_sql(self._complete(prompt))
+        self.sql_cache.set(key, sql)
+        return sql
+
+    def run_sql(self, sql):
+        '''
+        Returns (column names, rows), at most max_result_rows rows
+        '''
+        key = (sql, self.db_version())
+        result = self.result_cache.get(key)
+        if result is not None:
+            self.stats["result_cache_hits"] += 1
+            return result
+        executed_sql = sql
+        if self.advisor is not None:
+            self.advisor.record(sql)
+            executed_sql = self.advisor.rewrite(sql)
+        with self.pool.connection() as conn:
+            cursor = conn.execute(executed_sql)
+            columns = [column[0] for column in cursor.description] if cursor.description else []
+            rows = cursor.fetchmany(self.max_result_rows)
+        result = (columns, rows)
+        self.result_cache.set(key, result)
+        return result
+
+    def query(self, question, answer=True):
+        '''
+        Returns a dict with the generated sql, the result set and (if answer) the natural language answer
+        '''
+        timings = {}
+        start = time.perf_counter()
+        sql = self.generate_sql(question)
+        timings["generate_sql_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            columns, rows = self.run_sql(sql)
+        except sqlite3.Error as e:
+            print(f"Query failed: {e}\n{sql}")
+            # Do not keep serving SQL that does not run
+            self.sql_cache.set((self.normalize_question(question), hash(self.schema_summary())), None)
+            return {"question": question, "sql": sql, "error": str(e), "timings": timings}
+        timings["run_sql_s"] = time.perf_counter() - start
+
+        response = {"question": question, "sql": sql, "columns": columns, "rows": rows, "timings": timings}
+        if answer:
+            start = time.perf_counter()
+            key = (self.normalize_question(question), sql, self.db_version())
+            response["answer"] = self.answer_cache.get(key)
+            if response["answer"] is not None:
+                self.stats["answer_cache_hits"] += 1
+            else:
+                prompt = ANSWER_PROMPT_TEMPLATE.format(input=question, sql=sql, result=rows)
+                response["answer"] = self._complete(prompt).strip()
+                self.answer_cache.set(key, response["answer"])
+            timings["answer_s"] = time.perf_counter() - start
+        return response
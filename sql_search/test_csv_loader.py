@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+from csv_loader import CSVLoader
+
+
+def _write_csv(path, rows):
+    path.write_text("\n".join(";".join(row) for row in [["age", "job", "balance"], *rows]) + "\n")
+    return str(path)
+
+
+def _rows(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute('SELECT age, job, balance FROM deposits ORDER BY age').fetchall()
+
+
+def test_load_twice_appends(tmp_path):
+    db_path = str(tmp_path / "deposits.db")
+    loader = CSVLoader(db_path, "deposits", index_columns=["job"])
+    loader.load_csv(_write_csv(tmp_path / "first.csv", [["58", "management", "2143.5"], ["44", "technician", "29.0"]]))
+    # Integer balances go into the REAL column of the existing table
+    loader.load_csv(_write_csv(tmp_path / "second.csv", [["33", "management", "2"]]), replace=False)
+
+    assert _rows(db_path) == [(33, "management", 2.0), (44, "technician", 29.0), (58, "management", 2143.5)]
+
+    loader.load_csv(_write_csv(tmp_path / "third.csv", [["21", "student", "5"]]))
+    assert _rows(db_path) == [(21, "student", 5)]
+
+
+def test_append_checks_the_columns(tmp_path):
+    db_path = str(tmp_path / "deposits.db")
+    loader = CSVLoader(db_path, "deposits")
+    loader.load_csv(_write_csv(tmp_path / "first.csv", [["58", "management", "2143"]]))
+
+    with pytest.raises(ValueError, match="Column age"):
+        loader.load_csv(_write_csv(tmp_path / "second.csv", [["unknown", "management", "1"]]), replace=False)
+    (tmp_path / "other.csv").write_text("age;job\n33;student\n")
+    with pytest.raises(ValueError, match="do not match"):
+        loader.load_csv(str(tmp_path / "other.csv"), replace=False)
+    assert _rows(db_path) == [(58, "management", 2143)]
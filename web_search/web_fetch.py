@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate
+from urllib.parse import urlparse
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+
+def extract_text(html):
+    '''
+    Visible text of a page. Runs in a worker process, so it must stay a top-level function.
+    '''
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text(separator="\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class PageCache():
+    '''
+    On-disk cache of fetched pages, one json file per URL.
+    Entries younger than ttl seconds are served without any request, older ones are
+    revalidated with If-None-Match / If-Modified-Since so unchanged pages are not downloaded again.
+    '''
+    def __init__(self, cache_dir="./.web_cache", ttl=3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry["fetched_at"] < self.ttl
+
+    def validation_headers(self, entry):
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        elif entry.get("fetched_at"):
+            headers["If-Modified-Since"] = formatdate(entry["fetched_at"], usegmt=True)
+        return headers
+
+    def put(self, url, text, etag=None, last_modified=None):
+        entry = {"url": url, "text": text, "etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        # Write then rename so a crash never leaves a half-written entry behind
+        tmp_path = self._path(url) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(url))
+        return entry
+
+    def touch(self, entry):
+        return self.put(entry["url"], entry["text"], entry.get("etag"), entry.get("last_modified"))
+
+
+class WebFetcher():
+    '''
+    Fetches many web pages concurrently and returns their visible text.
+    - One pooled aiohttp session, at most max_connections sockets and per_host_limit per host
+    - Every request is bounded by timeout seconds and max_bytes of body
+    - HTML to text extraction runs on a process pool, overlapping with the downloads
+    - Pages are cached on disk with ETag/Last-Modified revalidation (cache_dir=None disables it)
+    A search with 10 results therefore takes about as long as the slowest page.
+    '''
+    def __init__(self, max_connections=20, per_host_limit=4, timeout=10.0, max_bytes=2_000_000,
+                 extract_workers=None, cache_dir="./.web_cache", cache_ttl=3600,
+                 user_agent="Mozilla/5.0 (compatible; rag-bootcamp)"):
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.extract_workers = extract_workers
+        self.user_agent = user_agent
+        self.cache = PageCache(cache_dir, cache_ttl) if cache_dir else None
+        self.stats = {}
+
+    async def _read_capped(self, response):
+        # Stop reading once max_bytes is reached, huge pages are truncated rather than downloaded fully
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            body.extend(chunk)
+            if len(body) >= self.max_bytes:
+                self.stats["truncated"] += 1
+                break
+        return bytes(body[:self.max_bytes])
+
+    async def _fetch_one(self, session, pool, url):
+        entry = self.cache.get(url) if self.cache else None
+        if self.cache and self.cache.is_fresh(entry):
+            self.stats["cache_hits"] += 1
+            return entry["text"]
+
+        headers = self.cache.validation_headers(entry) if self.cache else {}
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    self.stats["revalidated"] += 1
+                    self.cache.touch(entry)
+                    return entry["text"]
+                if response.status >= 400:
+                    print(f"Skipping {url}: HTTP {response.status}")
+                    self.stats["errors"] += 1
+                    return None
+                html = await self._read_capped(response)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Skipping {url}: {type(e).__name__} {e}")
+            self.stats["errors"] += 1
+            return None
+
+        self.stats["downloaded"] += 1
+        text = await asyncio.get_running_loop().run_in_executor(pool, extract_text, html)
+        if self.cache:
+            self.cache.put(url, text, etag, last_modified)
+        return text
+
+    async def afetch(self, urls):
+        '''
+        Returns the page texts in the same order as urls, None for pages that failed
+        '''
+        self.stats = {"downloaded": 0, "cache_hits": 0, "revalidated": 0, "truncated": 0, "errors": 0}
+        start = time.perf_counter()
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+            async with aiohttp.ClientSession(
+                    connector=connector, timeout=timeout, headers={"User-Agent": self.user_agent}) as session:
+                texts = await asyncio.gather(*[self._fetch_one(session, pool, url) for url in urls])
+        self.stats["seconds"] = time.perf_counter() - start
+        self.stats["hosts"] = len({urlparse(url).netloc for url in urls})
+        return list(texts)
+
+    def fetch(self, urls):
+        # Notebooks already run an event loop, in that case run ours on a separate thread
+        urls = list(urls)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.afetch(urls))
+
+        result = {}
+        def run():
+            try:
+                result["texts"] = asyncio.run(self.afetch(urls))
+            except Exception as e:
+                result["error"] = e
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["texts"]